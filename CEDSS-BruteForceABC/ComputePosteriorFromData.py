@@ -1,5 +1,54 @@
+"""ComputePosteriorFromData.py
+
+Evidence curves, rescaling and posterior plots for the CEDSS brute-force ABC
+datasets. The datasets are registered in a manifest CSV file (by default
+ComputePosteriorFromData-datasets.csv next to this script) with columns:
+
+  dataset       number of the dataset
+  label         label used in the names of the output files
+  figure        label used in the names of the evidence plot files
+  description   description listed when no dataset is given
+  path          CSV file of runs
+  nrows         number of rows of the file to use (empty for all)
+  metrics       metrics (error columns), separated by ';'
+  params        parameters to plot posteriors for, separated by ';'
+  optscales     cached rescaling of each metric, separated by ';' (or empty)
+  logoptscales  cached log rescaling of each metric, separated by ';' (or
+                empty)
+
+Usage: ComputePosteriorFromData.py [-manifest <CSV>] [-cached] [-ranges]
+                                   [-processes <n>] <dataset...>
+
+Each dataset is given by its number or label, or 'all' for every registered
+dataset. With -cached, the scales in the manifest are used instead of being
+computed, and computed scales of datasets without any are saved to it. With
+-ranges, the range of each metric is printed instead. With more than one
+dataset the plots are saved without being shown, and with -processes the
+datasets are processed concurrently. Datasets sharing a source file are read
+from it once.
+
+Uses: numpy, matplotlib, pandas, scipy, corner
+Licence: GNU General Public Licence v3 (see comments)
+"""
+# Copyright (C) 2018-2019  The James Hutton Institute & University of Edinburgh
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public Licence as published by
+# the Free Software Foundation, either version 3 of the Licence, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public Licence for more details.
+#
+# You should have received a copy of the GNU General Public Licence
+# along with this program.  If not, see <https://www.gnu.org/licences/>.
 import sys
 sys.path.insert(1,'/Library/Python/2.7/site-packages')
+import os
+import csv
+import multiprocessing
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -8,7 +57,19 @@ from scipy import optimize as op
 import corner as triangle
 from collections import Counter
 
-def squarediff(x, j):
+_MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'ComputePosteriorFromData-datasets.csv')
+_LISTS = ['metrics', 'params', 'optscales', 'logoptscales']
+
+plotfigs=1
+maketriangleplots=1
+refeps=0.05
+
+Neps=100
+maxeps=1.0
+epvals=[1.0*(maxeps/Neps)*i for i in range(Neps+1)]
+
+def squarediff(x, j, evidences):
     thissum=0.
     for i in range(Neps+1):
         indx=int(x*i)
@@ -17,20 +78,9 @@ def squarediff(x, j):
         else:
             diff=(evidences[0][i]-evidences[j][indx])
         thissum+=diff*diff
-    #if (x < 1.0):
-    #    for i in range(Neps+1):
-    #        indx=int(x*i)
-    #        diff=(evidences[0][i]-evidences[j][indx])
-    #        thissum+=diff*diff
-    #else:
-    #    for i in range(Neps+1):
-    #        indx=int(1.0*i/x)
-    #        diff=(evidences[j][i]-evidences[0][indx])
-    #        thissum+=diff*diff
-        
     return(thissum)
 
-def squarelogdiff(x, j):
+def squarelogdiff(x, j, evidences):
     thissum=0.
     for i in range(Neps+1):
         indx=int(x*i)
@@ -45,428 +95,298 @@ def squarelogdiff(x, j):
             else:
                 diff=0.
         thissum+=diff*diff
-    #print thissum
     return(thissum)
 
-def altsquarelogdiff(x, j):
+def altsquarelogdiff(x, j, logevidences):
     thissum=0.
     for i in range(1,Neps+1):
         indx=int(x*i)
         if (indx > Neps):
             diff=logevidences[0][i]
         else:
-	    if (indx == 0):
+            if (indx == 0):
                 indx=1
-	    diff=(logevidences[0][i]-logevidences[j][indx])
+            diff=(logevidences[0][i]-logevidences[j][indx])
         thissum+=diff*diff
     return(thissum)
 
-if ((len(sys.argv) != 2)):
-    print "Please indicate on the command line which dataset you wish to analyse:"
-    print "    1: 10000 point dataset"
-    print "    2: June full dataset"
-    print "    3: August full dataset"
-    print "    4: December full dataset"
-    print "    5: December full dataset, log"
-    print "    6: Small null dataset, log"
-    print "    7: December dataset, first 64154 points, log"
-    print "    8: December 19th not-null dataset, first 64154 points, log"
-    print "    9: Bioboost Null dataset, log"
-    print "    10: Credit Null dataset, log"
-    print "    11: Habit Adust Null dataset, log"
-    print "    12: Max Links and Visits Null dataset, log"
-    print "    13: Planning Null dataset, log"
-    print "    14: Biospherism Null dataset, log"
-    print "    15: Egoism Null dataset, log"
-    print "    16: Frame Null dataset, log"
-    print "    17: Hedonism Null dataset, log"
-    print "    18: All Null dataset, log"
-    print "    19: December 19th not-null dataset, first 104960 points, log"
-    print "    20: Split data set, group 0"
-    print "    21: Split data set, group 1"
-    exit(0)
-
-#Select data set. 1 = 10000 point dataset, 2 = June full data set, 3 = August full data set, 4 = December full data set
-whichdataset=int(sys.argv[1])
-
-#df=pd.read_csv('data/cedss-abc-results.csv', sep=',',header=0)
-if whichdataset==1:
-    df=pd.read_csv('data/cedss-abc-results-20160628.csv', sep=',',header=0, nrows=10000)
-    #df=pd.read_csv('data/cedss-abc-results-20160628.csv', sep=',',header=0, nrows=100000)
-elif whichdataset==2:
-    #df=pd.read_csv('data/cedss-abc-results-20160628.csv', sep=',',header=0)
-    df=pd.read_csv('data/cedss-abc-results-20160628-WithoutDodgyRow.csv', sep=',',header=0)
-elif whichdataset==3:
-    df=pd.read_csv('data/cedss-abc-results-20160816.csv', sep=',',header=0)
-elif whichdataset==4:
-    df=pd.read_csv('data/cedss-abc2.csv', sep=',',header=0)
-elif whichdataset==5:
-    df=pd.read_csv('data/cedss-abc2_withLogCols.csv', sep=',',header=0)
-elif whichdataset==6:
-    df=pd.read_csv('data/cedss-abc-NULL_withLogCols.csv', sep=',',header=0)
-elif whichdataset==7:
-    df=pd.read_csv('data/cedss-abc2_withLogCols_First64154.csv', sep=',',header=0)
-elif whichdataset==8:
-    df=pd.read_csv('data/cedss-abc-Dec19-notnull_withLogCols_First64154.csv', sep=',',header=0)
-elif whichdataset==9:
-    df=pd.read_csv('data/cedss-nosplit-abc6-results_BioboostUniqueNulls_withLogCols.csv', sep=',',header=0)
-elif whichdataset==10:
-    df=pd.read_csv('data/cedss-nosplit-abc6-results_CreditNull_withLogCols.csv', sep=',',header=0)
-elif whichdataset==11:
-    df=pd.read_csv('data/cedss-nosplit-abc6-results_HabitAdjustUniqueNulls_withLogCols.csv', sep=',',header=0)
-elif whichdataset==12:
-    df=pd.read_csv('data/cedss-nosplit-abc6-results_MaxLinksUniqueNulls_withLogCols.csv', sep=',',header=0)
-elif whichdataset==13:
-    df=pd.read_csv('data/cedss-nosplit-abc6-results_PlanningNull_withLogCols.csv', sep=',',header=0)
-elif whichdataset==14:
-    df=pd.read_csv('data/cedss-nosplit-abc6-results_BiospherismUniqueNulls_withLogCols.csv', sep=',',header=0)
-elif whichdataset==15:
-    df=pd.read_csv('data/cedss-nosplit-abc6-results_EgoismNull_withLogCols.csv', sep=',',header=0)
-elif whichdataset==16:
-    df=pd.read_csv('data/cedss-nosplit-abc6-results_FrameUniqueNulls_withLogCols.csv', sep=',',header=0)
-elif whichdataset==17:
-    df=pd.read_csv('data/cedss-nosplit-abc6-results_HedonismNull_withLogCols.csv', sep=',',header=0)
-elif whichdataset==18:
-    df=pd.read_csv('data/cedss-nosplit-abc6-results_AllNull_withLogCols.csv', sep=',',header=0)
-elif whichdataset==19:
-    df=pd.read_csv('data/cedss-abc-Dec19-notnull-First104960_withLogCols.csv', sep=',',header=0)
-elif whichdataset==20:
-    df=pd.read_csv('data/cedss-abc5-results_split0_withLogCols.csv', sep=',',header=0)
-elif whichdataset==21:
-    df=pd.read_csv('data/cedss-abc5-results_split1_withLogCols.csv', sep=',',header=0)
-else:
-    print "Unrecognized choice of data set, exiting!"
-    sys.exit()
-
-datasetlabels=['SmallCalibrationSet','FullCalibrationSet','RevisedFullCalibrationSet','DecemberCalibrationSet','DecemberCalibrationSet_Log','SmallNullSet_Log','DecemberCalibrationSet_First64154_Log','Dec19NotNullSet_First64154_Log','BioboostNullSet_Log','CreditNullSet_Log','HabitAdjustNullSet_Log','MaxLinksNullSet_Log','PlanningNullSet_Log','BiospherismNullSet_Log','EgoismNullSet_Log','FrameNullSet_Log','HedonismNullSet_Log','AllNullSet_Log','Dec19NotNullSet_First104960_Log','SplitSampleDataSet_Set0','SplitSampleDataSet_Set1']
-
-#headers=['appliance.elect.error','appliance.gas.error','space.heating.elect.error','space.heating.gas.error','space.heating.oil.error','water.heating.elect.error','water.heating.gas.error','water.heating.oil.error']
-#calibvals=[328369,50839,159740,3307148,18198,73544,833652,3701]
-#headers=['appliance.elect.error','appliance.gas.error','space.heating.elect.error','space.heating.gas.error','space.heating.oil.error','water.heating.gas.error','water.heating.oil.error']
-headers=['abs.total.error','log.rel.space.error','log.rel.appliances.error','log.rel.appliances.ratio.error']
-#params=['bioboost','biospherism1']
-#params=['egoism1','hedonism1','habitadjust','visits']
-#params=['egoism1','hedonism1','habitadjust','bioboost','frame1']
-#params=['credit','planning1','planning2','visits']
-params=['credit','visits','frame1','hedonism1','maxlinks','bioboost']
-#calibvals=[328369,50839,159740,3307148,18198,833652,3701]
-calibvals=[0,0,0,0]
-initscales=1.0*np.ones_like(calibvals)
-optscales=1.0*np.ones_like(calibvals)
-logoptscales=1.0*np.ones_like(calibvals)
-for i in range(len(headers)):
-    initscales[i]=1.0*(max(np.fabs(df[headers[i]])))
-
-for j in range(len(calibvals)):
-    print min(df[headers[j]])
-    print max(df[headers[j]])
-    print min(np.fabs(df[headers[j]]))/max(np.fabs(df[headers[j]]))
-sys.exit()
-
-
-#c=Counter(np.array(df['visits']))
-#print c.items()
-#sys.exit()
-plotfigs=1
-compscales=1
-#compscales=0
-maketriangleplots=1
-refeps=0.05
+def readManifest(file_name):
+    """
+    Return the datasets in the manifest as a list of dictionaries, with the
+    lists split, the scales as floats (or None if not cached) and nrows as
+    an int (or None)
+    """
+    datasets=[]
+    fp=open(file_name)
+    for row in csv.DictReader(fp):
+        dataset=dict(row)
+        dataset['dataset']=int(row['dataset'])
+        dataset['nrows']=int(row['nrows']) if row['nrows'] != '' else None
+        for key in _LISTS:
+            dataset[key]=[v for v in row[key].split(';') if v != '']
+        for key in ['optscales', 'logoptscales']:
+            dataset[key]=[float(v) for v in dataset[key]] if len(dataset[key]) > 0 else None
+        datasets.append(dataset)
+    fp.close()
+    return(datasets)
 
-Neps=100
-maxeps=1.0
-epvals=[1.0*(maxeps/Neps)*i for i in range(Neps+1)]
-evidences=np.zeros(len(calibvals)*(Neps+1))
-evidences=evidences.reshape((len(calibvals),Neps+1))
-evratio=np.zeros(len(calibvals)*(Neps+1))
-evratio=evratio.reshape((len(calibvals),Neps+1))
-logevidences=np.zeros(len(calibvals)*(Neps+1))
-logevidences=logevidences.reshape((len(calibvals),Neps+1))
-moments=1.0*np.zeros_like(calibvals)
-logmoments=1.0*np.zeros_like(calibvals)
-for i in range(Neps+1):
-    for j in range(len(calibvals)):
-        evidences[j][i]=1.0*sum(1 for val in 1.0*np.array(df[headers[j]]) if np.fabs(val/initscales[j]) < epvals[i])/(1.0*len(df[headers[j]]))
-        if (i > 0):
-	    evratio[j][i]=1.0*sum(1 for val in 1.0*np.array(df[headers[j]]) if np.fabs(val/initscales[j]) < epvals[i])/(1.0*epvals[i]*len(df[headers[j]]))
-        else:
-	    evratio[j][i]=0.0
-	moments[j]=moments[j]+evidences[j][i]*epvals[i]
-        #print evidences[j][i], moments[j]
-        if (evidences[j][i] > 0.):
-            logevidences[j][i]=np.log(evidences[j][i])
-            logmoments[j]=logmoments[j]+np.log(evidences[j][i])*epvals[i]
-
-if (compscales):
-    for j in range(len(calibvals)):
-        res = op.minimize_scalar(squarediff, args=j)
-        optscales[j]=res.x
-        #logres = op.minimize_scalar(squarelogdiff, args=j,bounds=(0,10))
-        logres = op.minimize_scalar(altsquarelogdiff, args=j,bounds=(0,10),method='bounded')
-        logoptscales[j]=logres.x
-        #optscales[j]=math.sqrt(moments[0]/moments[j])
-        #logoptscales[j]=math.sqrt(logmoments[0]/logmoments[j])
-else:
-    if whichdataset==1:
-        #For 10000 point data set
-        optscales=[1.00000003,  0.49701209,  2.45734723,  1.92618766,  0.59742363,  1.79508192,  1.84390911]
-        logoptscales=[1.01020297,  0.66694802,  9.75487738,  5.01826763,  0.75263322,  7.60846159,  2.36068513]
-    elif whichdataset==2:
-	#For June full data set
-	optscales=[ 1.00000003,  0.46269778,  2.90032411,  2.26928082,  0.71804864,  1.98733833, 2.07978023]
-	logoptscales=[ 1.01066709,  0.67061109,  9.67834354,  8.60356862,  0.92874148,  6.2929358,  3.5410582 ] 
-    elif whichdataset==3:
-	#For revised full data set
-    	optscales=[ 1.00000003,  0.50668116,  2.62610518,  2.11920335,  0.73240833,  1.82764737, 2.30623463]
-    	logoptscales=[ 1.01171154,  0.55702385,  7.71779204,  6.02313515,  0.86259533,  9.75234439, 3.53300704]
-    elif whichdataset==4:
-	#For December data set
-    	optscales=[ 1.00000002, 0.57320673, 2.70469368, 2.161647, 0.72252623, 1.96430477, 2.30155122]
-	logoptscales=[ 1.00785582, 0.71541732, 8.51256119, 5.0189048, 0.85955376, 8.8079923, 3.52347445]
-    elif whichdataset==5:
-	#For December log data set
-	optscales=[ 1.00000003,  1.13018525,  0.66437255,  0.79839934]
-	logoptscales=[ 1.00746564,  1.32258811,  0.39816676,  0.46617584]
-    elif whichdataset==6:
-	#For null log data set
-	optscales=[ 1.00000003,  1.78810892,  1.71128588,  1.76477248]
-	logoptscales=[ 1.00409682,  2.00969392,  1.49386182,  2.01017916]
-    elif whichdataset==7:
-	#For December first 64154 log data set
-	optscales=[ 1.00000003,  1.12973244,  0.68839366,  0.78520967]
-	logoptscales=[ 1.00792126,  1.36414031,  0.4162594,   0.42716665]
-    elif whichdataset==8:
-	#For December 19 not null first 64154 log data set
-	optscales=[ 1.00000003,  1.13215119,  0.63541679,  0.76136669]
-	logoptscales=[ 1.00761079,  1.33478808,  0.36804362,  0.39834098]
-    elif whichdataset==20:
-        optscales=[ 1.00000002,  1.06066118,  0.91362183,  0.40285427]
-        logoptscales=[ 4.97749515,  6.31443827,  6.64323407,  8.91821879]
-    else:
-	print "Unrecognized choice of data set, exiting!"
-	sys.exit()
-
-print optscales
-print logoptscales
-
-lc=['b','g','r','c','m','y','k','b']
-ls=['-','-','-','-','-','-','--','--']
-#target=1
-#plt.plot(np.array(epvals),np.log(evidences[0]),linestyle='-',color='k',label='reference')
-#for j in range(8):
-#    factor=0.25*(j+1)
-#    thisscale=logoptscales[target]*factor
-#    print factor,thisscale,altsquarelogdiff(thisscale,target)
-#    plt.plot(np.array(epvals)/thisscale,logevidences[target],linestyle=ls[j],color=lc[j],label='scale = %f'%factor)
-#plt.xlim([0,1])
-#legend=plt.legend(loc='lower right',shadow=True)
-#plt.show()
-#plt.close()
-#sys.exit()
-
-if (plotfigs):
-    for j in range(len(calibvals)):
-        #plt.plot(np.array(epvals),(evratio[j]),linestyle=ls[j],color=lc[j],label=headers[j])
-        plt.plot(np.array(epvals),(evratio[j]),linestyle=ls[j],color=lc[j],label='Metric %i'%(j+1))
-    #legend=plt.legend(loc='lower right',shadow=True)
-    outdata=np.array(np.reshape(epvals,(Neps+1,1)))
-    for j in range(len(calibvals)):
-	np.append(outdata,np.reshape(evratio[j],(Neps+1,1)),axis=1)
-	print evratio[j]
-    np.savetxt("%s_EvidenceData.txt"%(datasetlabels[whichdataset-1]),outdata)
-    plt.xlabel(r'$\epsilon_i$')
-    plt.ylabel(r'${\cal Z}$')
-    legend=plt.legend(loc='lower right',shadow=True)
-    plt.xlim([0,1])
-    if whichdataset==1:
-        plt.savefig('EvidenceVEps_RelativeToRandom_SmallCalibrationSet.png')
-    elif whichdataset==2:
-        plt.savefig('EvidenceVEps_RelativeToRandom_FullCalibrationSet_WithoutDodgyRow.png')
-    elif whichdataset==3:
-        plt.savefig('EvidenceVEps_RelativeToRandom_RevisedFullCalibrationSet.png')
-    elif whichdataset==4:
-        plt.savefig('EvidenceVEps_RelativeToRandom_DecemberCalibrationSet.png')
-    elif whichdataset==5:
-        plt.savefig('EvidenceVEps_RelativeToRandom_DecemberCalibrationSet_Log.png')
-    elif whichdataset==6:
-        plt.savefig('EvidenceVEps_RelativeToRandom_NullSet_Log.png')
-    elif whichdataset==7:
-        plt.savefig('EvidenceVEps_RelativeToRandom_DecemberCalibrationSet_First64154_Log.png')
-    elif whichdataset==8:
-        plt.savefig('EvidenceVEps_RelativeToRandom_December19NotNullSet_First64154_Log.png')
-    elif whichdataset==9:
-        plt.savefig('EvidenceVEps_RelativeToRandom_BioboostNullSet_Log.png')
-    elif whichdataset==10:
-        plt.savefig('EvidenceVEps_RelativeToRandom_CreditNullSet_Log.png')
-    elif whichdataset==11:
-        plt.savefig('EvidenceVEps_RelativeToRandom_HabitNullSet_Log.png')
-    elif whichdataset==12:
-        plt.savefig('EvidenceVEps_RelativeToRandom_MaxLinksNullSet_Log.png')
-    elif whichdataset==13:
-        plt.savefig('EvidenceVEps_RelativeToRandom_PlanningNullSet_Log.png')
-    elif whichdataset==14:
-        plt.savefig('EvidenceVEps_RelativeToRandom_BiospherismNullSet_Log.png')
-    elif whichdataset==15:
-        plt.savefig('EvidenceVEps_RelativeToRandom_EgoismNullSet_Log.png')
-    elif whichdataset==16:
-        plt.savefig('EvidenceVEps_RelativeToRandom_FrameNullSet_Log.png')
-    elif whichdataset==17:
-        plt.savefig('EvidenceVEps_RelativeToRandom_HedonismNullSet_Log.png')
-    elif whichdataset==18:
-        plt.savefig('EvidenceVEps_RelativeToRandom_AllNullSet_Log.png')
-    elif whichdataset==19:
-        plt.savefig('EvidenceVEps_RelativeToRandom_December19NotNullSet_First104960_Log.png')
-    elif whichdataset==20:
-        plt.savefig('EvidenceVEps_RelativeToRandom_SplitDataSet_Split0_Log.png')
-    elif whichdataset==21:
-        plt.savefig('EvidenceVEps_RelativeToRandom_SplitDataSet_Split1_Log.png')
-    else:
-	print "Unrecognized choice of data set, exiting!"
-	sys.exit()
-    plt.show()
-    plt.close()
-    #sys.exit()
-
-    for j in range(len(calibvals)):
-        plt.plot(np.array(epvals)/optscales[j],(evidences[j]),linestyle=ls[j],color=lc[j],label=headers[j])
-    plt.xlim([0,1])
-    legend=plt.legend(loc='lower right',shadow=True)
-    if whichdataset==1:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_SmallCalibrationSet.png')
-    elif whichdataset==2:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_FullCalibrationSet_WithoutDodgyRow.png')
-    elif whichdataset==3:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_RevisedFullCalibrationSet.png')
-    elif whichdataset==4:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_DecemberCalibrationSet.png')
-    elif whichdataset==5:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_DecemberCalibrationSet_Log.png')
-    elif whichdataset==6:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_NullSet_Log.png')
-    elif whichdataset==7:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_DecemberCalibrationSet_First64154_Log.png')
-    elif whichdataset==8:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_December19NotNullSet_First64154_Log.png')
-    elif whichdataset==9:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_BioboostNullSet_Log.png')
-    elif whichdataset==10:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_CreditNullSet_Log.png')
-    elif whichdataset==11:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_HabitNullSet_Log.png')
-    elif whichdataset==12:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_MaxLinksNullSet_Log.png')
-    elif whichdataset==13:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_PlanningNullSet_Log.png')
-    elif whichdataset==14:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_BiospherismNullSet_Log.png')
-    elif whichdataset==15:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_EgoismNullSet_Log.png')
-    elif whichdataset==16:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_FrameNullSet_Log.png')
-    elif whichdataset==17:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_HedonismNullSet_Log.png')
-    elif whichdataset==18:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_AllNullSet_Log.png')
-    elif whichdataset==19:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_December19NotNullSet_First104960_Log.png')
-    elif whichdataset==20:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_SplitDataSet_Split0_Log.png')
-    elif whichdataset==21:
-        plt.savefig('EvidenceVEps_RescaledToAppElec_SplitDataSet_Split1_Log.png')
-    else:
-	print "Unrecognized choice of data set, exiting!"
-	sys.exit()
-    plt.show()
-    plt.close()
-
-    for j in range(len(calibvals)):
-        plt.plot(np.array(epvals)/logoptscales[j],np.log(evidences[j]),linestyle=ls[j],color=lc[j],label=headers[j])
-    plt.xlim([0,1])
-    legend=plt.legend(loc='lower right',shadow=True)
-    if whichdataset==1:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_SmallCalibrationSet.png')
-    elif whichdataset==2:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_FullCalibrationSet_WithoutDodgyRow.png')
-    elif whichdataset==3:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_RevisedFullCalibrationSet.png')
-    elif whichdataset==4:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_DecemberCalibrationSet.png')
-    elif whichdataset==5:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_DecemberCalibrationSet_Log.png')
-    elif whichdataset==6:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_NullSet_Log.png')
-    elif whichdataset==7:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_DecemberCalibrationSet_First64154_Log.png')
-    elif whichdataset==8:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_December19NotNullSet_First64154_Log.png')
-    elif whichdataset==9:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_BioboostNullSet_Log.png')
-    elif whichdataset==10:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_CreditNullSet_Log.png')
-    elif whichdataset==11:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_HabitNullSet_Log.png')
-    elif whichdataset==12:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_MaxLinksNullSet_Log.png')
-    elif whichdataset==13:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_PlanningNullSet_Log.png')
-    elif whichdataset==14:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_BiospherismNullSet_Log.png')
-    elif whichdataset==15:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_EgoismNullSet_Log.png')
-    elif whichdataset==16:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_FrameNullSet_Log.png')
-    elif whichdataset==17:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_HedonismNullSet_Log.png')
-    elif whichdataset==18:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_AllNullSet_Log.png')
-    elif whichdataset==19:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_December19NotNullSet_First104960_Log.png')
-    elif whichdataset==20:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_SplitDataSet_Split0_Log.png')
-    elif whichdataset==21:
-        plt.savefig('EvidenceVEps_LogRescaledToAppElec_SplitDataSet_Split1_Log.png')
+def writeManifest(file_name, datasets):
+    """
+    Write the datasets back to the manifest
+    """
+    fp=open(file_name, 'w')
+    columns=['dataset', 'label', 'figure', 'description', 'path', 'nrows'] + _LISTS
+    writer=csv.DictWriter(fp, columns, extrasaction='ignore', lineterminator='\n')
+    writer.writeheader()
+    for dataset in datasets:
+        row=dict(dataset)
+        row['nrows']='' if dataset['nrows'] is None else dataset['nrows']
+        for key in _LISTS:
+            row[key]=';'.join([repr(v) if isinstance(v, float) else v for v in (dataset[key] or [])])
+        writer.writerow(row)
+    fp.close()
+
+def findDataset(datasets, name):
+    """
+    Return the registered dataset with the number or label given, or None
+    """
+    for dataset in datasets:
+        if name == str(dataset['dataset']) or name == dataset['label']:
+            return(dataset)
+    return(None)
+
+def sourceGroups(datasets):
+    """
+    Group the datasets by source file, returning a list of (path, nrows,
+    datasets) tuples, where nrows is the number of rows to read for all the
+    datasets in the group (None for all of them)
+    """
+    groups=[]
+    paths={}
+    for dataset in datasets:
+        if dataset['path'] not in paths:
+            paths[dataset['path']]=len(groups)
+            groups.append((dataset['path'], dataset['nrows'], []))
+        (path, nrows, members)=groups[paths[dataset['path']]]
+        if nrows is not None and (dataset['nrows'] is None or dataset['nrows'] > nrows):
+            nrows=dataset['nrows']
+        members.append(dataset)
+        groups[paths[dataset['path']]]=(path, nrows, members)
+    return(groups)
+
+def printRanges(dataset, df):
+    """
+    Print the minimum, maximum and relative minimum magnitude of each metric
+    """
+    for header in dataset['metrics']:
+        print dataset['label'], header
+        print min(df[header])
+        print max(df[header])
+        print min(np.fabs(df[header]))/max(np.fabs(df[header]))
+
+def analyse(dataset, df, cached=False, show=True):
+    """
+    Compute the evidence curves and scales of the dataset and make its
+    plots, returning the scales used as (optscales, logoptscales)
+    """
+    label=dataset['label']
+    headers=dataset['metrics']
+    params=dataset['params']
+    initscales=1.0*np.ones(len(headers))
+    for i in range(len(headers)):
+        initscales[i]=1.0*(max(np.fabs(df[headers[i]])))
+
+    evidences=np.zeros((len(headers),Neps+1))
+    evratio=np.zeros((len(headers),Neps+1))
+    logevidences=np.zeros((len(headers),Neps+1))
+    for j in range(len(headers)):
+        scaled=np.sort(np.fabs(1.0*np.array(df[headers[j]])/initscales[j]))
+        counts=np.searchsorted(scaled, epvals, side='left')
+        evidences[j]=counts/(1.0*len(scaled))
+        evratio[j][1:]=counts[1:]/(np.array(epvals[1:])*len(scaled))
+        logevidences[j][evidences[j] > 0.]=np.log(evidences[j][evidences[j] > 0.])
+
+    if (cached and dataset['optscales'] is not None
+        and len(dataset['optscales']) == len(headers)
+        and len(dataset['logoptscales']) == len(headers)):
+        optscales=dataset['optscales']
+        logoptscales=dataset['logoptscales']
     else:
-	print "Unrecognized choice of data set, exiting!"
-	sys.exit()
-    plt.show()
-    plt.close()
-
-if maketriangleplots:
-    for j in range(len(calibvals)):
-        #postsamples=df[k for k in len(df[headers[j]]) if np.fabs(df[headers[j]][k]-calibvals[j]) < refeps*initscales[j]*logoptscales[j] ]
-    	postsamples=df[np.fabs(df[headers[j]]) < refeps*initscales[j]*logoptscales[j] ]
-    	#print refeps*initscales[j]*logoptscales[j]
-    	#print len(postsamples[headers[j]])
-    	#print np.array(postsamples[params])[:,0:len(params)]
-    	plotsamps=np.array(postsamples[params])[:,0:len(params)]
-    	#print len(plotsamps[:,0])
-    	if len(plotsamps[:,0]) > len(params):
-    	    fig=triangle.corner(plotsamps,labels=params)
-    	    fig.savefig("Triangleplot_%s_%s.png"%(datasetlabels[whichdataset-1],headers[j]),dpi=150)
-    	    plt.show()
-    	    plt.close()
-    	else:
-    	    print "Number of valid samples for metric ",j+1," is too small to make a plot, skipping....."
-
-for j in range(len(calibvals)):
-    postsamples=df[np.fabs(df[headers[j]]) < refeps*initscales[j]*logoptscales[j] ]
-    altev=len(df[np.fabs(df[headers[j]]) < refeps*initscales[j]])
-    plotsamps=np.array(postsamples[params])[:,0:len(params)]
-    print j,len(plotsamps[:,0]),(1.0*len(plotsamps[:,0]))/(1.0*len(df[headers[j]])*refeps*logoptscales[j]),(1.0*altev)/(1.0*len(df[headers[j]])*refeps)
+        if cached:
+            print "No cached scales for %s, computing them"%(label)
+        optscales=1.0*np.ones(len(headers))
+        logoptscales=1.0*np.ones(len(headers))
+        for j in range(len(headers)):
+            res = op.minimize_scalar(squarediff, args=(j, evidences))
+            optscales[j]=res.x
+            logres = op.minimize_scalar(altsquarelogdiff, args=(j, logevidences),bounds=(0,10),method='bounded')
+            logoptscales[j]=logres.x
+        optscales=list(optscales)
+        logoptscales=list(logoptscales)
+
+    print label, optscales
+    print label, logoptscales
+
+    lc=['b','g','r','c','m','y','k','b']
+    ls=['-','-','-','-','-','-','--','--']
+
+    if (plotfigs):
+        for j in range(len(headers)):
+            plt.plot(np.array(epvals),(evratio[j]),linestyle=ls[j],color=lc[j],label='Metric %i'%(j+1))
+        outdata=np.array(np.reshape(epvals,(Neps+1,1)))
+        for j in range(len(headers)):
+            outdata=np.append(outdata,np.reshape(evratio[j],(Neps+1,1)),axis=1)
+            print label, evratio[j]
+        np.savetxt("%s_EvidenceData.txt"%(label),outdata)
+        plt.xlabel(r'$\epsilon_i$')
+        plt.ylabel(r'${\cal Z}$')
+        legend=plt.legend(loc='lower right',shadow=True)
+        plt.xlim([0,1])
+        plt.savefig('EvidenceVEps_RelativeToRandom_%s.png'%(dataset['figure']))
+        if show:
+            plt.show()
+        plt.close()
+
+        for j in range(len(headers)):
+            plt.plot(np.array(epvals)/optscales[j],(evidences[j]),linestyle=ls[j],color=lc[j],label=headers[j])
+        plt.xlim([0,1])
+        legend=plt.legend(loc='lower right',shadow=True)
+        plt.savefig('EvidenceVEps_RescaledToAppElec_%s.png'%(dataset['figure']))
+        if show:
+            plt.show()
+        plt.close()
+
+        for j in range(len(headers)):
+            plt.plot(np.array(epvals)/logoptscales[j],np.log(evidences[j]),linestyle=ls[j],color=lc[j],label=headers[j])
+        plt.xlim([0,1])
+        legend=plt.legend(loc='lower right',shadow=True)
+        plt.savefig('EvidenceVEps_LogRescaledToAppElec_%s.png'%(dataset['figure']))
+        if show:
+            plt.show()
+        plt.close()
+
+    if maketriangleplots:
+        for j in range(len(headers)):
+            postsamples=df[np.fabs(df[headers[j]]) < refeps*initscales[j]*logoptscales[j] ]
+            plotsamps=np.array(postsamples[params])[:,0:len(params)]
+            if len(plotsamps[:,0]) > len(params):
+                fig=triangle.corner(plotsamps,labels=params)
+                fig.savefig("Triangleplot_%s_%s.png"%(label,headers[j]),dpi=150)
+                if show:
+                    plt.show()
+                plt.close()
+            else:
+                print "Number of valid samples for metric ",j+1," of ",label," is too small to make a plot, skipping....."
+
+    for j in range(len(headers)):
+        postsamples=df[np.fabs(df[headers[j]]) < refeps*initscales[j]*logoptscales[j] ]
+        altev=len(df[np.fabs(df[headers[j]]) < refeps*initscales[j]])
+        plotsamps=np.array(postsamples[params])[:,0:len(params)]
+        print label,j,len(plotsamps[:,0]),(1.0*len(plotsamps[:,0]))/(1.0*len(df[headers[j]])*refeps*logoptscales[j]),(1.0*altev)/(1.0*len(df[headers[j]])*refeps)
+        for k in range(len(params)):
+            plt.figure(k+1)
+            if len(plotsamps[:,0]) > len(params):
+                plt.hist(plotsamps[:,k],50,label='metric %i'%(j+1),alpha=0.5,normed=True)
+
     for k in range(len(params)):
         plt.figure(k+1)
-	if len(plotsamps[:,0]) > len(params):
-	    #if k==len(params)-1:
-            #    plt.hist(plotsamps[:,k],5,label='metric %i'%(j+1))
-            #else:
-	    plt.hist(plotsamps[:,k],50,label='metric %i'%(j+1),alpha=0.5,normed=True)
+        plt.legend(loc='best',shadow=False)
+        plt.title('Posterior comparison: %s'%(params[k]))
+        plt.savefig('PosteriorComp_%s_%s.png'%(label,params[k]))
+    if show:
+        plt.show()
+    plt.close('all')
+    return(optscales, logoptscales)
 
-for k in range(len(params)):
-    plt.figure(k+1)
-    plt.legend(loc='best',shadow=False)
-    plt.title('Posterior comparison: %s'%(params[k]))
-    plt.savefig('PosteriorComp_%s_%s.png'%(datasetlabels[whichdataset-1],params[k]))
-plt.show()
+def processGroup(group, cached=False, ranges=False, show=False):
+    """
+    Read the source file of a group of datasets once and analyse each of
+    them, returning a list of (dataset number, optscales, logoptscales)
+    """
+    (path, nrows, members)=group
+    if not show:
+        plt.switch_backend('Agg')
+    source=pd.read_csv(path, sep=',', header=0, nrows=nrows)
+    results=[]
+    for dataset in members:
+        df=source if dataset['nrows'] is None else source.head(dataset['nrows'])
+        if ranges:
+            printRanges(dataset, df)
+            continue
+        (optscales, logoptscales)=analyse(dataset, df, cached, show)
+        results.append((dataset['dataset'], optscales, logoptscales))
+    sys.stdout.flush()
+    return(results)
 
+def processGroupStar(args):
+    """
+    Call processGroup() with a tuple of arguments (for Pool.map())
+    """
+    return(processGroup(*args))
 
+if __name__ == "__main__":
+    manifest=_MANIFEST
+    cached=False
+    ranges=False
+    processes=1
+    i=1
+    while i < len(sys.argv) and sys.argv[i][0:1] == '-':
+        if sys.argv[i] == '-manifest' and i + 1 < len(sys.argv):
+            manifest=sys.argv[i + 1]
+            i=i + 2
+        elif sys.argv[i] == '-cached':
+            cached=True
+            i=i + 1
+        elif sys.argv[i] == '-ranges':
+            ranges=True
+            i=i + 1
+        elif sys.argv[i] == '-processes' and i + 1 < len(sys.argv):
+            processes=int(sys.argv[i + 1])
+            i=i + 2
+        else:
+            sys.stderr.write("Option %s not recognized\n"%(sys.argv[i]))
+            sys.exit(1)
+    argv=sys.argv[i:]
+
+    datasets=readManifest(manifest)
+    if len(argv) == 0:
+        print "Usage: ComputePosteriorFromData.py [-manifest <CSV>] [-cached] [-ranges] [-processes <n>] <dataset...>"
+        print "Please indicate on the command line which datasets you wish to analyse:"
+        for dataset in datasets:
+            print "    %d: %s (%s)"%(dataset['dataset'], dataset['description'], dataset['label'])
+        print "    all: all of the above"
+        sys.exit(0)
+
+    selected=[]
+    for name in argv:
+        if name == 'all':
+            selected.extend(datasets)
+            continue
+        dataset=findDataset(datasets, name)
+        if dataset is None:
+            sys.stderr.write("Unrecognized choice of data set %s (not in %s)\n"%(name, manifest))
+            sys.exit(1)
+        selected.append(dataset)
+    selected=[d for (k, d) in enumerate(selected) if d not in selected[:k]]
+
+    show=(len(selected) == 1)
+    groups=[(group, cached, ranges, show) for group in sourceGroups(selected)]
+    if processes > 1 and len(groups) > 1:
+        pool=multiprocessing.Pool(min(processes, len(groups)))
+        results=pool.map(processGroupStar, groups)
+        pool.close()
+        pool.join()
+    else:
+        results=[processGroupStar(group) for group in groups]
 
+    if cached:
+        saved=False
+        for (number, optscales, logoptscales) in [r for result in results for r in result]:
+            dataset=findDataset(datasets, str(number))
+            if dataset['optscales'] is None:
+                dataset['optscales']=[float(v) for v in optscales]
+                dataset['logoptscales']=[float(v) for v in logoptscales]
+                saved=True
+        if saved:
+            writeManifest(manifest, datasets)
+    sys.exit(0)
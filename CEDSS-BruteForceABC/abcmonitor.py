@@ -0,0 +1,345 @@
+#!/usr/bin/python
+"""abcmonitor.py
+
+A monitor for sampling loops such as go.sh in the CEDSS-ABC*-scripts
+directories, which keep launching runs while a 'continue' file exists. It
+tails the result CSV files as they are written, keeping the evidence curves
+of each metric (and all the metrics jointly) and the posterior mean and
+standard deviation of the dynamic parameters at a chosen epsilon up to date
+as runs arrive, and deletes the continue file(s) once these are stable, so
+that no more runs are started.
+
+Usage: abcmonitor.py [-continue <file>]... [-pid <process id>]...
+                     [-tolerance <t>] [-patience <checks>] [-step <runs>]
+                     [-epsilon <e>] [-parameter <name>]... [-interval <seconds>]
+                     [-evidence <CSV file>] [-history <CSV file>] [-once]
+                     <metrics file> <parameter file> <result CSV files...>
+
+The metrics and parameter files are as for bruteABC.py. The result files
+are file names or glob patterns (e.g. '*-results.csv', quoted so the shell
+does not expand it), which are expanded again at each poll so new files
+are picked up; only complete new lines are read from each file. Rows with
+missing metric or parameter values are ignored.
+
+Every time another step runs (default 1000) have arrived, the curves and
+summaries are compared with those at the previous check. The change is the
+largest absolute difference in evidence over metrics and epsilons, or in a
+posterior mean or standard deviation as a proportion of the parameter's
+range (for the parameters given with -parameter, by default all the dynamic
+parameters), whichever is larger. After patience (default 3) checks in a
+row with a change less than the tolerance (default 0.01), the continue
+files (default 'continue') are deleted and any process ids given are sent
+SIGTERM. The monitor also stops if the continue files have all been
+deleted by someone else. With -evidence, the evidence curves are saved at
+every check (as bruteABC.py calibrate saves them, with a joint column);
+with -history, a row is appended for each check.
+
+Authors: Jonathan Gair (University of Edinburgh)
+         and Gary Polhill (The James Hutton Institute)
+Uses: numpy, pandas
+Licence: GNU General Public Licence v3 (see comments)
+"""
+# Copyright (C) 2018-2019  The James Hutton Institute & University of Edinburgh
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public Licence as published by
+# the Free Software Foundation, either version 3 of the Licence, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public Licence for more details.
+#
+# You should have received a copy of the GNU General Public Licence
+# along with this program.  If not, see <https://www.gnu.org/licences/>.
+import sys
+import os
+import glob
+import io
+import signal
+import time
+import numpy as np
+import pandas as pd
+from bruteABC import BruteABC, _DEFAULT_REFEPS
+
+_DEFAULT_CONTINUE = 'continue'
+_DEFAULT_TOLERANCE = 0.01
+_DEFAULT_PATIENCE = 3
+_DEFAULT_STEP = 1000
+_DEFAULT_INTERVAL = 60.0
+
+class CSVTail:
+    """CSVTail class
+
+    Follows a set of growing CSV files, each with a heading row, returning
+    the complete rows added to them since the last call to read()
+    """
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.offsets = dict()
+        self.headings = dict()
+
+    def read(self):
+        """
+        Return a data frame of the new complete rows in all the files matching
+        the patterns (None if there are none)
+        """
+        frames = []
+        for pattern in self.patterns:
+            for file in sorted(glob.glob(pattern)):
+                frame = self.readFile(file)
+                if frame is not None:
+                    frames.append(frame)
+        if len(frames) == 0:
+            return(None)
+        return(pd.concat(frames, ignore_index = True, sort = False))
+
+    def readFile(self, file):
+        """
+        Return a data frame of the new complete rows in the file (None if
+        there are none). Text after the last newline is left for next time,
+        as the line may still be being written.
+        """
+        offset = self.offsets.get(file, 0)
+        fp = open(file, 'rb')
+        fp.seek(offset)
+        text = fp.read()
+        fp.close()
+        end = text.rfind(b'\n')
+        if end < 0:
+            return(None)
+        self.offsets[file] = offset + end + 1
+        lines = text[0:end + 1].decode('utf-8')
+        if file not in self.headings:
+            (heading, lines) = lines.split('\n', 1)
+            self.headings[file] = heading.strip().split(',')
+            if lines.strip() == '':
+                return(None)
+        return(pd.read_csv(io.StringIO(lines), sep = ',', header = None,
+                           names = self.headings[file]))
+
+class EvidenceMonitor:
+    """EvidenceMonitor class
+
+    Incrementally updated evidence curves and posterior summaries. Each batch
+    of runs is normalised by a BruteABC object, and only the counts of its
+    runs' first accepting epsilons, and the sums of the parameters of the runs
+    accepted at the summary epsilon, are kept.
+    """
+    def __init__(self, metrics, params, epsilon = _DEFAULT_REFEPS, parameters = None):
+        self.metrics = metrics
+        self.params = params
+        self.epsilon = epsilon
+        self.parameters = parameters
+        self.runs = 0
+        self.counts = None
+        self.sums = None
+        self.squares = None
+        self.accepted = None
+        self.brute = None
+
+    def add(self, df):
+        """
+        Add a batch of runs in a data frame, returning the number of runs used
+        """
+        columns = list(self.metrics['metric']) + list(self.params['parameter'])
+        df = df.dropna(subset = [c for c in columns if c in df.columns]).reset_index(drop = True)
+        if len(df) == 0:
+            return(0)
+        brute = BruteABC(df, self.params, self.metrics)
+        if self.brute is None:
+            self.brute = brute
+            if self.parameters is None:
+                self.parameters = brute.params
+            for p in self.parameters:
+                if p not in brute.params:
+                    sys.stderr.write("Parameter %s is not a dynamic parameter\n"%(p))
+                    sys.exit(1)
+            n_cols = brute.n_metrics + 1
+            self.counts = np.zeros((n_cols, brute.epsteps + 2))
+            self.sums = np.zeros((n_cols, len(self.parameters)))
+            self.squares = np.zeros((n_cols, len(self.parameters)))
+            self.accepted = np.zeros(n_cols)
+        values = df[self.parameters].to_numpy(dtype = float)
+        i = np.searchsorted(np.array(brute.epsilons), self.epsilon, side = 'right') - 1
+        for j in range(brute.n_metrics + 1):
+            first = brute.firstEpsilons(j if j < brute.n_metrics else None)
+            self.counts[j] += np.bincount(first, minlength = brute.epsteps + 2)
+            accepted = (first <= i)
+            self.accepted[j] += np.sum(accepted)
+            self.sums[j] += np.sum(values[accepted], axis = 0)
+            self.squares[j] += np.sum(values[accepted] ** 2, axis = 0)
+        self.runs += len(df)
+        return(len(df))
+
+    def evidences(self):
+        """
+        Return the evidence curves, indexed by metric (with all the metrics
+        jointly last) and epsilon
+        """
+        return(np.cumsum(self.counts[:, :-1], axis = 1) / (1.0 * self.runs))
+
+    def summaries(self):
+        """
+        Return the posterior means and standard deviations of the parameters
+        at the summary epsilon, indexed by metric (with all the metrics jointly
+        last) and parameter, as proportions of the parameters' ranges (NaN if
+        no runs are accepted)
+        """
+        index = [self.brute.params.index(p) for p in self.parameters]
+        lower = np.array(self.brute.param_minima)[index]
+        span = np.array(self.brute.param_maxima)[index] - lower
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            means = self.sums / self.accepted[:, None]
+            sds = np.sqrt(np.maximum(self.squares / self.accepted[:, None] - means * means, 0.0))
+        return((means - lower) / span, sds / span)
+
+    def state(self):
+        """
+        Return the evidences and summaries as one array for comparing checks
+        """
+        (means, sds) = self.summaries()
+        return(np.concatenate((self.evidences().ravel(), means.ravel(), sds.ravel())))
+
+    def saveEvidences(self, file_name):
+        """
+        Save the evidence curves to the file in the format of
+        BruteABC.saveEvidences(), with a column for all the metrics jointly
+        """
+        data = np.concatenate((np.array(self.brute.epsilons)[None, :], self.evidences()))
+        np.savetxt(file_name, data.T, delimiter = ",",
+                   header = "epsilon," + ",".join(self.brute.headers + ['joint']))
+
+def stopSampling(continues, pids):
+    """
+    Delete the continue files and send SIGTERM to the processes
+    """
+    for file in continues:
+        if os.path.exists(file):
+            os.remove(file)
+            sys.stderr.write("Deleted %s\n"%(file))
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+            sys.stderr.write("Sent SIGTERM to process %d\n"%(pid))
+        except OSError as e:
+            sys.stderr.write("Could not signal process %d: %s\n"%(pid, e))
+
+if __name__ == "__main__":
+    continues = []
+    pids = []
+    tolerance = _DEFAULT_TOLERANCE
+    patience = _DEFAULT_PATIENCE
+    step = _DEFAULT_STEP
+    epsilon = _DEFAULT_REFEPS
+    parameters = []
+    interval = _DEFAULT_INTERVAL
+    evidence = None
+    history = None
+    once = False
+    i = 1
+    while i < len(sys.argv) and sys.argv[i][0:1] == '-':
+        if sys.argv[i] == '-continue' and i + 1 < len(sys.argv):
+            continues.append(sys.argv[i + 1])
+            i = i + 2
+        elif sys.argv[i] == '-pid' and i + 1 < len(sys.argv):
+            pids.append(int(sys.argv[i + 1]))
+            i = i + 2
+        elif sys.argv[i] == '-tolerance' and i + 1 < len(sys.argv):
+            tolerance = float(sys.argv[i + 1])
+            i = i + 2
+        elif sys.argv[i] == '-patience' and i + 1 < len(sys.argv):
+            patience = int(sys.argv[i + 1])
+            i = i + 2
+        elif sys.argv[i] == '-step' and i + 1 < len(sys.argv):
+            step = int(sys.argv[i + 1])
+            i = i + 2
+        elif sys.argv[i] == '-epsilon' and i + 1 < len(sys.argv):
+            epsilon = float(sys.argv[i + 1])
+            i = i + 2
+        elif sys.argv[i] == '-parameter' and i + 1 < len(sys.argv):
+            parameters.append(sys.argv[i + 1])
+            i = i + 2
+        elif sys.argv[i] == '-interval' and i + 1 < len(sys.argv):
+            interval = float(sys.argv[i + 1])
+            i = i + 2
+        elif sys.argv[i] == '-evidence' and i + 1 < len(sys.argv):
+            evidence = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-history' and i + 1 < len(sys.argv):
+            history = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-once':
+            once = True
+            i = i + 1
+        else:
+            sys.stderr.write("Option %s not recognized\n"%(sys.argv[i]))
+            sys.exit(1)
+    argv = sys.argv[i:]
+
+    if len(argv) < 3:
+        sys.stderr.write("Usage: abcmonitor.py [-continue <file>]... [-pid <process id>]... "
+                         + "[-tolerance <t>] [-patience <checks>] [-step <runs>] "
+                         + "[-epsilon <e>] [-parameter <name>]... [-interval <seconds>] "
+                         + "[-evidence <CSV file>] [-history <CSV file>] [-once] "
+                         + "<metrics file> <parameter file> <result CSV files...>\n")
+        sys.exit(1)
+
+    for file in argv[0:2]:
+        if not os.path.exists(file):
+            sys.stderr.write("File %s does not exist\n"%(file))
+            sys.exit(1)
+    if len(continues) == 0:
+        continues = [_DEFAULT_CONTINUE]
+
+    metrics = pd.read_csv(argv[0], sep = ',', header = 0)
+    params = pd.read_csv(argv[1], sep = ',', header = 0)
+    tail = CSVTail(argv[2:])
+    monitor = EvidenceMonitor(metrics, params, epsilon,
+                              parameters if len(parameters) > 0 else None)
+    previous = None
+    checked = 0
+    stable = 0
+    while True:
+        batch = tail.read()
+        if batch is not None:
+            if monitor.brute is None:
+                BruteABC.ckdata(batch, params, metrics, ", ".join(argv[2:]), argv[1], argv[0])
+            monitor.add(batch)
+        if monitor.runs > 0 and (previous is None or monitor.runs - checked >= step):
+            current = monitor.state()
+            if previous is None:
+                change = np.inf
+            else:
+                change = np.max(np.fabs(current - previous))
+                if np.isnan(change):
+                    change = np.inf
+            stable = stable + 1 if change < tolerance else 0
+            previous = current
+            checked = monitor.runs
+            sys.stderr.write("%s: %d runs, change %g, %d stable check(s)\n"
+                             %(time.strftime("%Y-%m-%dT%H:%M:%S"), monitor.runs,
+                               change, stable))
+            if evidence is not None:
+                monitor.saveEvidences(evidence)
+            if history is not None:
+                new = not os.path.exists(history)
+                fp = open(history, 'a')
+                if new:
+                    fp.write("date,runs,change,stable\n")
+                fp.write("%s,%d,%g,%d\n"%(time.strftime("%Y-%m-%dT%H:%M:%S"),
+                                          monitor.runs, change, stable))
+                fp.close()
+            if stable >= patience:
+                sys.stderr.write("Evidences and summaries stable to within %g for %d "
+                                 "check(s): stopping sampling\n"%(tolerance, stable))
+                stopSampling(continues, pids)
+                break
+        if once:
+            break
+        if not any([os.path.exists(file) for file in continues]):
+            sys.stderr.write("No continue file exists: sampling has stopped\n")
+            break
+        time.sleep(interval)
+    sys.exit(0)
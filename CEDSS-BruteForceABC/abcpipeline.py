@@ -0,0 +1,399 @@
+#!/usr/bin/python
+"""abcpipeline.py
+
+A runner for declarative analysis pipelines over the BruteABC stages, which
+caches the result of each stage on disk under a hash of its inputs and
+settings and only recomputes the stages that are stale. The stages are:
+
+  load      read the run data, metric and parameter files
+  clean     check the files against each other (as bruteABC.py does) and
+            drop runs with missing metric or parameter values
+  evidence  build the BruteABC object: take logs of log metrics, normalise,
+            index the runs on each metric and count the evidences (with any
+            replicate grouping or importance weights)
+  scales    fit the epsilon scales (only does anything with rescale)
+
+followed by the outputs, each a call to a BruteABC method. The load stage
+is keyed on the names, sizes and modification times of the files, and the
+other stages on the key of the stage before and their own settings; all
+keys include the source of bruteABC.py and abcplot.py, so changes to the
+code make everything stale. An output is stale if its key has changed or
+there is no file matching its file name with anything before the suffix
+(plots with several panels, and stems, add to the name). Outputs that
+only read other outputs' files (such as plotTriangleHistograms() reading
+the histograms saved by saveTriangleHistograms()) do not need the run data
+at all. So changing a plot's colours only redraws the plot, and changing
+refeps or the acceptance rule recomputes the posteriors from the cached
+evidence stage, without rereading or recounting the data.
+
+Usage: abcpipeline.py [-n] [-clear] [-prune] <pipeline JSON file>
+
+With -n, the stale stages and outputs are listed but not run. With -clear,
+the cache is emptied first. With -prune, cached stages with keys other than
+this pipeline's (from earlier settings or data) are deleted afterwards.
+
+The pipeline file is a JSON object with the following entries (file names
+are relative to the current directory):
+
+  data, metrics, params   the run data, metric and parameter files, as for
+                          bruteABC.py calibrate
+  cache                   the cache directory (default: the pipeline file
+                          name with .cache in place of .json)
+  clean                   {"dropna": true} (the default) to drop runs with
+                          missing values in the metric or parameter columns
+  evidence                BruteABC settings: "epsteps", "maxep", "rescale",
+                          "replicates" (true to weight replicates) and
+                          "importance" (an importance weight column)
+  posterior               settings for the outputs: "refeps", "accept" and
+                          "accept_value" (see setAcceptance()) and "adjust"
+  outputs                 a list of outputs, in the order to make them
+
+Each output is an object with a "name", the BruteABC "method", the output
+"file" (its first argument), and optionally further positional "args" and
+keyword "options". Static methods are given the files of the outputs listed
+in "inputs" (declared earlier) before the output file. For example:
+
+  {"data": "runs.csv", "metrics": "metrics.csv", "params": "params.csv",
+   "posterior": {"refeps": 0.1},
+   "outputs": [
+     {"name": "evidences", "method": "saveEvidences", "file": "ev.csv"},
+     {"name": "ratios", "method": "plotScaledEvidenceRatio", "file": "evr.png"},
+     {"name": "hist", "method": "saveTriangleHistograms", "file": "tri.npz"},
+     {"name": "triangles", "method": "plotTriangleHistograms",
+      "inputs": ["hist"], "file": "tri.png", "options": {"colour": "red"}},
+     {"name": "posteriors", "method": "posteriorPlots", "file": "post",
+      "args": ["png"]}]}
+
+Authors: Jonathan Gair (University of Edinburgh)
+         and Gary Polhill (The James Hutton Institute)
+Uses: numpy, pandas
+Licence: GNU General Public Licence v3 (see comments)
+"""
+# Copyright (C) 2018-2019  The James Hutton Institute & University of Edinburgh
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public Licence as published by
+# the Free Software Foundation, either version 3 of the Licence, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public Licence for more details.
+#
+# You should have received a copy of the GNU General Public Licence
+# along with this program.  If not, see <https://www.gnu.org/licences/>.
+import sys
+import os
+import glob
+import hashlib
+import json
+import shutil
+import time
+import pandas as pd
+from bruteABC import BruteABC, _DEFAULT_EPSTEPS, _DEFAULT_MAXEP, _DEFAULT_REFEPS
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+_STAGES = ['load', 'clean', 'evidence', 'scales']
+_SOURCES = ['bruteABC.py', 'abcplot.py']
+_MANIFEST = 'outputs.json'
+
+class Pipeline:
+    """Pipeline class
+
+    A pipeline read from a JSON file, with its cache. The stages are computed
+    (or loaded from the cache) only when a stale output needs them.
+    """
+    def __init__(self, file_name):
+        fp = open(file_name)
+        self.spec = json.load(fp)
+        fp.close()
+        for entry in ['data', 'metrics', 'params', 'outputs']:
+            if entry not in self.spec:
+                sys.stderr.write("Pipeline file %s has no %s entry\n"%(file_name, entry))
+                sys.exit(1)
+        self.cache = self.spec.get('cache', os.path.splitext(file_name)[0] + '.cache')
+        self.outputs = []
+        names = dict()
+        for output in self.spec['outputs']:
+            if 'name' not in output or 'method' not in output or 'file' not in output:
+                sys.stderr.write("Output %s in %s needs a name, method and file\n"
+                                 %(json.dumps(output), file_name))
+                sys.exit(1)
+            if output['name'] in _STAGES or output['name'] in names:
+                sys.stderr.write("Output name %s is a stage or another output's name\n"
+                                 %(output['name']))
+                sys.exit(1)
+            if not hasattr(BruteABC, output['method']):
+                sys.stderr.write("Output %s: BruteABC has no method %s\n"
+                                 %(output['name'], output['method']))
+                sys.exit(1)
+            for name in output.get('inputs', []):
+                if name not in names:
+                    sys.stderr.write("Output %s: input %s is not an earlier output\n"
+                                     %(output['name'], name))
+                    sys.exit(1)
+            names[output['name']] = output
+            self.outputs.append(output)
+        self.keys = dict()
+        self.values = dict()
+        source_dir = os.path.dirname(os.path.abspath(__file__))
+        self.version = Pipeline.hash([open(os.path.join(source_dir, source), 'rb').read()
+                                      .decode('utf-8', 'replace') for source in _SOURCES])
+
+    @staticmethod
+    def hash(obj):
+        """
+        Return a hash of the object (anything JSON can encode)
+        """
+        text = json.dumps(obj, sort_keys = True)
+        return(hashlib.md5(text.encode('utf-8')).hexdigest()[0:16])
+
+    @staticmethod
+    def isStatic(method):
+        """
+        Return whether the BruteABC method is static (so needs no run data)
+        """
+        return(isinstance(BruteABC.__dict__.get(method), staticmethod))
+
+    def settings(self, stage):
+        """
+        Return the settings of the stage from the pipeline file, with defaults
+        """
+        if stage == 'load':
+            return([[f, os.path.getsize(f), os.path.getmtime(f)] if os.path.exists(f) else [f]
+                    for f in [self.spec['data'], self.spec['metrics'], self.spec['params']]])
+        if stage == 'clean':
+            return({'dropna': self.spec.get('clean', dict()).get('dropna', True)})
+        if stage == 'evidence':
+            settings = {'epsteps': _DEFAULT_EPSTEPS, 'maxep': _DEFAULT_MAXEP, 'rescale': False,
+                        'replicates': False, 'importance': None}
+            settings.update(self.spec.get('evidence', dict()))
+            return(settings)
+        if stage == 'posterior':
+            settings = {'refeps': _DEFAULT_REFEPS, 'accept': 'epsilon', 'accept_value': None,
+                        'adjust': False}
+            settings.update(self.spec.get('posterior', dict()))
+            return(settings)
+        return(None)
+
+    def key(self, stage):
+        """
+        Return the key of the stage or output (by name)
+        """
+        if stage not in self.keys:
+            if stage in _STAGES:
+                i = _STAGES.index(stage)
+                upstream = self.key(_STAGES[i - 1]) if i > 0 else self.version
+                self.keys[stage] = Pipeline.hash([stage, upstream, self.settings(stage)])
+            else:
+                output = [o for o in self.outputs if o['name'] == stage][0]
+                upstream = [self.key(name) for name in output.get('inputs', [])]
+                if not Pipeline.isStatic(output['method']):
+                    upstream.extend([self.key('scales'), self.settings('posterior')])
+                self.keys[stage] = Pipeline.hash([self.version, upstream, output['method'],
+                                                  output['file'], output.get('args', []),
+                                                  output.get('options', dict())])
+        return(self.keys[stage])
+
+    def cacheFile(self, stage):
+        """
+        Return the name of the cache file of the stage
+        """
+        return(os.path.join(self.cache, '%s-%s.pkl'%(stage, self.key(stage))))
+
+    def value(self, stage):
+        """
+        Return the result of the stage, from the cache if it is there, and
+        otherwise computing it (and the stages before it, as needed) and
+        saving it to the cache
+        """
+        if stage in self.values:
+            return(self.values[stage])
+        file_name = self.cacheFile(stage)
+        if os.path.exists(file_name):
+            start = time.time()
+            fp = open(file_name, 'rb')
+            self.values[stage] = pickle.load(fp)
+            fp.close()
+            sys.stdout.write("%-10s cached (%.1fs to load)\n"%(stage, time.time() - start))
+            return(self.values[stage])
+
+        start = time.time()
+        value = self.compute(stage)
+        if not os.path.isdir(self.cache):
+            os.makedirs(self.cache)
+        fp = open(file_name + '.tmp', 'wb')
+        pickle.dump(value, fp, pickle.HIGHEST_PROTOCOL)
+        fp.close()
+        os.rename(file_name + '.tmp', file_name)
+        sys.stdout.write("%-10s computed in %.1fs\n"%(stage, time.time() - start))
+        self.values[stage] = value
+        return(value)
+
+    def compute(self, stage):
+        """
+        Compute the result of the stage
+        """
+        settings = self.settings(stage)
+        if stage == 'load':
+            for f in [self.spec['data'], self.spec['metrics'], self.spec['params']]:
+                if not os.path.exists(f):
+                    sys.stderr.write("File %s does not exist\n"%(f))
+                    sys.exit(1)
+            return((pd.read_csv(self.spec['data'], sep = ',', header = 0),
+                    pd.read_csv(self.spec['metrics'], sep = ',', header = 0),
+                    pd.read_csv(self.spec['params'], sep = ',', header = 0)))
+        if stage == 'clean':
+            (df, metrics, params) = self.value('load')
+            BruteABC.ckdata(df, params, metrics, self.spec['data'], self.spec['params'],
+                            self.spec['metrics'])
+            if settings['dropna']:
+                columns = list(params['parameter']) + list(metrics['metric'])
+                n_runs = len(df.index)
+                df = df.dropna(subset = columns).reset_index(drop = True)
+                if len(df.index) < n_runs:
+                    sys.stdout.write("%-10s dropped %d runs with missing values\n"
+                                     %(stage, n_runs - len(df.index)))
+            return((df, metrics, params))
+        if stage == 'evidence':
+            (df, metrics, params) = self.value('clean')
+            # BruteABC takes logs in the data frame, so the earlier stages'
+            # results are dropped (they are already in the cache)
+            self.values.pop('load', None)
+            self.values.pop('clean', None)
+            brute = BruteABC(df, params, metrics, epsteps = settings['epsteps'],
+                             maxep = settings['maxep'], rescale = settings['rescale'])
+            if settings['replicates']:
+                brute.groupReplicates()
+            if settings['importance'] is not None:
+                brute.setImportance(settings['importance'])
+            return(brute)
+        if stage == 'scales':
+            brute = self.value('evidence')
+            brute.computeScales()
+            return(brute)
+
+    def stale(self):
+        """
+        Return the outputs that are stale
+        """
+        made = self.manifest()
+        stale = []
+        for output in self.outputs:
+            if made.get(output['name']) != self.key(output['name']) \
+                or len(glob.glob('%s*%s'%os.path.splitext(output['file']))) == 0:
+                stale.append(output)
+        return(stale)
+
+    def manifest(self):
+        """
+        Return the keys of the outputs last made, by name
+        """
+        file_name = os.path.join(self.cache, _MANIFEST)
+        if not os.path.exists(file_name):
+            return(dict())
+        fp = open(file_name)
+        made = json.load(fp)
+        fp.close()
+        return(made)
+
+    def saveManifest(self, made):
+        """
+        Save the keys of the outputs made, by name
+        """
+        if not os.path.isdir(self.cache):
+            os.makedirs(self.cache)
+        fp = open(os.path.join(self.cache, _MANIFEST), 'w')
+        json.dump(made, fp, indent = 1, sort_keys = True)
+        fp.close()
+
+    def run(self, dry_run = False):
+        """
+        Make the stale outputs, computing the stages they need. With dry_run,
+        list the stale stages and outputs instead.
+        """
+        stale = self.stale()
+        if dry_run:
+            needed = len([o for o in stale if not Pipeline.isStatic(o['method'])]) > 0
+            for stage in _STAGES:
+                if needed and not os.path.exists(self.cacheFile(stage)):
+                    sys.stdout.write("%-10s stale\n"%(stage))
+            for output in stale:
+                sys.stdout.write("%-10s stale (%s)\n"%(output['name'], output['file']))
+            return
+        made = self.manifest()
+        posterior = self.settings('posterior')
+        for output in stale:
+            start = time.time()
+            method = getattr(BruteABC, output['method'])
+            args = [self.named(name)['file'] for name in output.get('inputs', [])]
+            args.append(output['file'])
+            args.extend(output.get('args', []))
+            if Pipeline.isStatic(output['method']):
+                method(*args, **output.get('options', dict()))
+            else:
+                brute = self.value('scales')
+                brute.refeps = posterior['refeps']
+                brute.setAcceptance(posterior['accept'], posterior['accept_value'])
+                brute.setAdjustment(posterior['adjust'])
+                method(brute, *args, **output.get('options', dict()))
+            made[output['name']] = self.key(output['name'])
+            self.saveManifest(made)
+            sys.stdout.write("%-10s made %s in %.1fs\n"
+                             %(output['name'], output['file'], time.time() - start))
+        if len(stale) < len(self.outputs):
+            sys.stdout.write("%d outputs up to date\n"%(len(self.outputs) - len(stale)))
+
+    def named(self, name):
+        """
+        Return the output with the name
+        """
+        return([o for o in self.outputs if o['name'] == name][0])
+
+    def prune(self):
+        """
+        Delete the cached stages with keys other than this pipeline's
+        """
+        current = [self.cacheFile(stage) for stage in _STAGES]
+        for file_name in glob.glob(os.path.join(self.cache, '*.pkl')):
+            if file_name not in current:
+                os.remove(file_name)
+
+if __name__ == "__main__":
+    dry_run = False
+    clear = False
+    prune = False
+    i = 1
+    while i < len(sys.argv) and sys.argv[i][0:1] == '-':
+        if sys.argv[i] == '-n':
+            dry_run = True
+            i = i + 1
+        elif sys.argv[i] == '-clear':
+            clear = True
+            i = i + 1
+        elif sys.argv[i] == '-prune':
+            prune = True
+            i = i + 1
+        else:
+            sys.stderr.write("Option %s not recognized\n"%(sys.argv[i]))
+            sys.exit(1)
+    argv = sys.argv[i:]
+
+    if len(argv) != 1:
+        sys.stderr.write("Usage: abcpipeline.py [-n] [-clear] [-prune] <pipeline JSON file>\n")
+        sys.exit(1)
+    if not os.path.exists(argv[0]):
+        sys.stderr.write("File %s does not exist\n"%(argv[0]))
+        sys.exit(1)
+
+    pipeline = Pipeline(argv[0])
+    if clear and os.path.isdir(pipeline.cache):
+        shutil.rmtree(pipeline.cache)
+    pipeline.run(dry_run)
+    if prune and not dry_run:
+        pipeline.prune()
+    sys.exit(0)
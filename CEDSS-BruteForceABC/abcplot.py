@@ -0,0 +1,252 @@
+"""abcplot.py
+
+This module contains the plotting code for bruteABC.py. It is kept separate
+so that the numeric core of bruteABC.py can be imported (e.g. on cluster nodes
+that only need to save evidence files) without loading matplotlib. The
+BruteABC plotting methods import this module when they are first used.
+
+Each drawing function builds one figure from arrays computed by BruteABC
+and saves it to a file, so figures can be drawn without the run data. The
+figures are object-oriented matplotlib Figures with their own Agg canvas,
+not pyplot's global state, so no display is needed and figures can be drawn
+independently of each other. render() draws a list of figure tasks, in a
+process pool if asked.
+
+Authors: Jonathan Gair (University of Edinburgh)
+         and Gary Polhill (The James Hutton Institute)
+Uses: numpy, matplotlib
+Licence: GNU General Public Licence v3 (see comments)
+"""
+# Copyright (C) 2018-2019  The James Hutton Institute & University of Edinburgh
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public Licence as published by
+# the Free Software Foundation, either version 3 of the Licence, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public Licence for more details.
+#
+# You should have received a copy of the GNU General Public Licence
+# along with this program.  If not, see <https://www.gnu.org/licences/>.
+import os
+import time
+import multiprocessing
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+def render(tasks, processes = 1, timed = False):
+    """
+    Draw the figures described by the tasks, each a (function name, argument
+    list) pair naming one of the drawing functions in this module. If
+    processes is more than one, the figures are drawn in a pool of that many
+    processes. If timed is True, a list of the (wall, CPU) seconds taken to
+    draw each figure, in the process that drew it, is returned.
+    """
+    drawer = drawTimed if timed else draw
+    if processes > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(processes, len(tasks)))
+        try:
+            times = pool.map(drawer, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        times = [drawer(task) for task in tasks]
+    if timed:
+        return(times)
+
+def draw(task):
+    """
+    Draw one figure task for render()
+    """
+    (function, args) = task
+    globals()[function](*args)
+
+def drawTimed(task):
+    """
+    Draw one figure task for render(), returning the wall and CPU seconds
+    taken
+    """
+    cpu = os.times()
+    start = time.time()
+    draw(task)
+    end = os.times()
+    return((time.time() - start, sum(end[0:4]) - sum(cpu[0:4])))
+
+def figure(**kwargs):
+    """
+    Return a new Figure with an Agg canvas
+    """
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    return(fig)
+
+def lines(image_file, series, x_label, y_label, legend_pos, font_size,
+          title = None, unity = False, xlim = None, bands = None, loglog = False):
+    """
+    Plot a graph of lines, saving it to the image_file. Each of the series is
+    an (x data, y data, label, colour, line style) tuple. If unity is True, a
+    dashed line is drawn at y = 1 from x = 0 to 1. Any bands, each an
+    (x data, lower y data, upper y data, colour) tuple, are shaded behind the
+    lines. If loglog is True, both axes have log scales.
+    """
+    fig = figure()
+    ax = fig.add_subplot(111)
+    if bands is not None:
+        for (xdata, lower, upper, colour) in bands:
+            ax.fill_between(xdata, lower, upper, color = colour, alpha = 0.2,
+                            linewidth = 0)
+    for (xdata, data, label, colour, style) in series:
+        ax.plot(xdata, data, linewidth = 2, linestyle = style, color = colour,
+                label = label)
+    if title is not None:
+        ax.set_title(title)
+    ax.set_xlabel(x_label)
+    ax.set_ylabel(y_label)
+    ax.legend(loc = legend_pos, shadow = False, frameon = False,
+              fontsize = font_size)
+    if unity:
+        ax.plot([0, 1], [1, 1], linestyle = 'dashed', color = '#000000')
+    if xlim is not None:
+        ax.set_xlim(xlim)
+    if loglog:
+        ax.set_xscale('log')
+        ax.set_yscale('log')
+    fig.savefig(image_file)
+
+def histograms(image_file, series, bins, title, x_label, y_label, font_size):
+    """
+    Plot overlaid density histograms, saving the graph to the image_file. Each
+    of the series is a (values, weights, label, colour) tuple, with weights
+    None for unweighted values.
+    """
+    fig = figure()
+    ax = fig.add_subplot(111)
+    for (values, weights, label, colour) in series:
+        ax.hist(values, bins, label = label, weights = weights,
+                alpha = 0.5, density = True, color = colour)
+    ax.legend(loc = 'lower right', shadow = False, fontsize = font_size,
+              framealpha = 0.75)
+    ax.set_title(title)
+    ax.set_xlabel(x_label)
+    ax.set_ylabel(y_label)
+    fig.savefig(image_file)
+
+def smallMultiples(image_file, edges, cube, epsilons, chosen, disp_metrics, title,
+                   line_colours, line_style, font_size):
+    """
+    Plot one parameter of a posterior cube as small multiples, saving them to
+    the image_file. The cube is indexed by metric (all jointly last, drawn
+    dashed), epsilon and bin; there is one panel for each of the chosen
+    epsilon indices, showing the posterior density of every metric.
+    """
+    widths = np.diff(edges)
+    centres = 0.5 * (edges[:-1] + edges[1:])
+    n_across = int(np.ceil(np.sqrt(len(chosen))))
+    n_down = int(np.ceil(len(chosen) / (1.0 * n_across)))
+    fig = figure(figsize = (3 * n_across, 2.5 * n_down))
+    axes = fig.subplots(n_down, n_across, sharex = True, squeeze = False)
+    for p in range(n_down * n_across):
+        ax = axes[p // n_across][p % n_across]
+        if p >= len(chosen):
+            ax.axis('off')
+            continue
+        i = chosen[p]
+        for j in range(cube.shape[0]):
+            total = np.sum(cube[j, i])
+            if total > 0:
+                ax.plot(centres, cube[j, i] / (total * widths),
+                        color = line_colours[j],
+                        linestyle = (line_style if j < cube.shape[0] - 1 else '--'),
+                        label = disp_metrics[j])
+        ax.set_title(r'$\epsilon$ = %g'%(epsilons[i]), fontsize = font_size)
+        ax.tick_params(labelsize = font_size)
+    axes[0][0].legend(loc = 'best', frameon = False, fontsize = 'x-small')
+    fig.suptitle(title)
+    fig.savefig(image_file)
+
+def triangle(image_file, edges, hist1, hist2, disp_params, title, colour, font_size):
+    """
+    Draw a triangle plot from histograms, saving it to the image_file: bars of
+    the 1D histograms (indexed by parameter and bin, with bin edges indexed by
+    parameter and edge) on the diagonal, and shaded 2D histograms (indexed by
+    pair of parameters in the order of np.tril_indices(), bin of the later
+    parameter and bin of the earlier one) below it.
+    """
+    n_params = len(disp_params)
+    fig = figure(figsize = (2 * n_params + 1, 2 * n_params + 1))
+    axes = fig.subplots(n_params, n_params, squeeze = False)
+    pair = 0
+    for i in range(n_params):
+        for k in range(n_params):
+            ax = axes[i][k]
+            if k > i:
+                ax.axis('off')
+                continue
+            if k == i:
+                ax.bar(edges[i][:-1], hist1[i], width = np.diff(edges[i]),
+                       align = 'edge', color = colour, alpha = 0.5)
+                ax.set_yticks([])
+            else:
+                ax.pcolormesh(edges[k], edges[i], hist2[pair], cmap = 'Greys')
+                pair = pair + 1
+                if k == 0:
+                    ax.set_ylabel(disp_params[i], fontsize = font_size)
+                else:
+                    ax.set_yticklabels([])
+            ax.set_xlim(edges[k][0], edges[k][-1])
+            if i == n_params - 1:
+                ax.set_xlabel(disp_params[k], fontsize = font_size)
+            else:
+                ax.set_xticklabels([])
+            ax.tick_params(labelsize = font_size)
+    fig.suptitle(title)
+    fig.savefig(image_file, dpi = 150)
+
+def densityTriangle(image_file, centres, densities, pair_centres, pair_densities,
+                    lower, upper, disp_params, title, colour, font_size):
+    """
+    Draw a triangle plot of kernel density estimates, saving it to the
+    image_file: the 1D densities (indexed by parameter and cell, with cell
+    centres likewise) on the diagonal, and filled contours of the 2D
+    densities (indexed as for triangle()) below it. Each parameter's axis
+    runs from lower to upper.
+    """
+    n_params = len(disp_params)
+    fig = figure(figsize = (2 * n_params + 1, 2 * n_params + 1))
+    axes = fig.subplots(n_params, n_params, squeeze = False)
+    pair = 0
+    for i in range(n_params):
+        for k in range(n_params):
+            ax = axes[i][k]
+            if k > i:
+                ax.axis('off')
+                continue
+            if k == i:
+                ax.plot(centres[i], densities[i], color = colour)
+                ax.fill_between(centres[i], densities[i], color = colour,
+                                alpha = 0.3)
+                ax.set_ylim(bottom = 0)
+                ax.set_yticks([])
+            else:
+                ax.contourf(pair_centres[k], pair_centres[i], pair_densities[pair], 8,
+                            cmap = 'Greys')
+                pair = pair + 1
+                if k == 0:
+                    ax.set_ylabel(disp_params[i], fontsize = font_size)
+                else:
+                    ax.set_yticklabels([])
+            ax.set_xlim(lower[k], upper[k])
+            if i == n_params - 1:
+                ax.set_xlabel(disp_params[k], fontsize = font_size)
+            else:
+                ax.set_xticklabels([])
+            ax.tick_params(labelsize = font_size)
+    fig.suptitle(title)
+    fig.savefig(image_file, dpi = 150)
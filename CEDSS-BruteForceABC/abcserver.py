@@ -0,0 +1,352 @@
+#!/usr/bin/python
+"""abcserver.py
+
+A local HTTP server answering evidence queries about a run table, so that
+evidences and posteriors at different epsilons, metrics and parameter
+subsets can be explored without rereading the data. The run data are read
+once into a BruteABC object, and an EvidenceIndex is built over its sorted
+absolute deviations for each metric (and the largest normalised distance
+over the metrics, for all the metrics jointly), with cumulative sums of the
+run weights and parameters in the same order. Evidences and the means and
+standard deviations of accepted parameters are then binary searches; other
+queries only touch the accepted runs.
+
+Usage: abcserver.py [-port <n>] [-replicates] [-importance <weight column>]
+                    <run data> <metrics file> <parameter file>
+
+The inputs are as for bruteABC.py calibrate. The server listens on
+127.0.0.1 only, and answers GET requests with JSON:
+
+  /info                         metric and dynamic parameter names, number of
+                                runs and the epsilon grid
+  /evidence?epsilon=<e>         evidence of each metric and all jointly
+  /accepted?epsilon=<e>         number and weight of runs accepted and the
+                                mean and standard deviation of each dynamic
+                                parameter
+  /histogram?epsilon=<e>&parameter=<p>[&bins=<n>]
+                                posterior histogram of a dynamic parameter
+
+/accepted and /histogram take the metric (default 'joint', for all the
+metrics jointly) as metric=<m>. Each query can be restricted to the runs
+selected by a ParamOption parameter file (as for bruteABC.py compare) with
+option=<parameter file>; the selection is kept for later queries.
+
+Authors: Jonathan Gair (University of Edinburgh)
+         and Gary Polhill (The James Hutton Institute)
+Uses: numpy, pandas
+Licence: GNU General Public Licence v3 (see comments)
+"""
+# Copyright (C) 2018-2019  The James Hutton Institute & University of Edinburgh
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public Licence as published by
+# the Free Software Foundation, either version 3 of the Licence, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public Licence for more details.
+#
+# You should have received a copy of the GNU General Public Licence
+# along with this program.  If not, see <https://www.gnu.org/licences/>.
+import sys
+import os
+import json
+import numpy as np
+import pandas as pd
+from bruteABC import BruteABC, ParamOption, _DEFAULT_PROFILE_BINS
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from urlparse import urlparse, parse_qs
+
+_DEFAULT_PORT = 8642
+_HOST = '127.0.0.1'
+
+class QueryError(Exception):
+    """QueryError class
+
+    Raised for a query that cannot be answered, with the HTTP status to reply
+    with
+    """
+    def __init__(self, message, status = 400):
+        Exception.__init__(self, message)
+        self.status = status
+
+class EvidenceIndex:
+    """EvidenceIndex class
+
+    In-memory indexes of a BruteABC object's runs for answering queries. For
+    each metric, and all the metrics jointly, the runs are kept in order of
+    distance from the target with cumulative sums of their weights, weighted
+    parameters and squared weighted parameters.
+    """
+    def __init__(self, brute):
+        self.brute = brute
+        self.names = brute.headers + ['joint']
+        if brute.weights is None:
+            self.weights = np.ones(brute.n_runs)
+        else:
+            self.weights = brute.weights
+        self.values = brute.df[brute.params].to_numpy(dtype = float)
+        dist = brute.distanceMatrix()
+        self.orders = []
+        self.dists = []
+        self.cumweights = []
+        self.cumsums = []
+        self.cumsquares = []
+        for j in range(len(self.names)):
+            column = dist[:, j] if j < brute.n_metrics else np.max(dist, axis = 1)
+            order = np.argsort(column, kind = 'mergesort')
+            weights = self.weights[order]
+            values = self.values[order] * weights[:, None]
+            self.orders.append(order)
+            self.dists.append(column[order])
+            self.cumweights.append(np.concatenate(([0.0], np.cumsum(weights))))
+            self.cumsums.append(np.concatenate((np.zeros((1, len(brute.params))),
+                                                np.cumsum(values, axis = 0))))
+            self.cumsquares.append(np.concatenate((np.zeros((1, len(brute.params))),
+                                                   np.cumsum(values * self.values[order],
+                                                             axis = 0))))
+        self.options = dict()
+
+    def column(self, metric):
+        """
+        Return the index of the metric, or of 'joint' for all the metrics
+        """
+        if metric not in self.names:
+            raise QueryError("Metric %s not recognized"%(metric), 404)
+        return(self.names.index(metric))
+
+    def parameter(self, parameter):
+        """
+        Return the index of a dynamic parameter
+        """
+        if parameter not in self.brute.params:
+            raise QueryError("Dynamic parameter %s not recognized"%(parameter), 404)
+        return(self.brute.params.index(parameter))
+
+    def option(self, file):
+        """
+        Return the cumulative weights of the runs selected by a ParamOption
+        parameter file for each metric and jointly (in the same order as the
+        indexes), and a boolean array of the runs selected
+        """
+        if file not in self.options:
+            if not os.path.exists(file):
+                raise QueryError("Parameter file %s does not exist"%(file), 404)
+            try:
+                selected = ParamOption(file).select(self.brute.df)['row_id'].to_numpy()
+            except (IOError, KeyError, ValueError, pd.errors.ParserError) as e:
+                raise QueryError("Parameter file %s could not be read: %s"%(file, e))
+            mask = np.zeros(self.brute.n_runs, dtype = bool)
+            mask[selected] = True
+            weights = np.where(mask, self.weights, 0.0)
+            self.options[file] = ([np.concatenate(([0.0], np.cumsum(weights[order])))
+                                   for order in self.orders], mask)
+        return(self.options[file])
+
+    def accepted(self, j, epsilon):
+        """
+        Return the number of runs accepted for metric j (or jointly if j is
+        the number of metrics) at epsilon
+        """
+        return(int(np.searchsorted(self.dists[j], epsilon, side = 'left')))
+
+    def evidence(self, epsilon, option = None):
+        """
+        Return a dictionary of the evidence of each metric and all jointly at
+        epsilon, optionally only for the runs selected by the option file
+        """
+        cumweights = self.cumweights
+        if option is not None:
+            cumweights = self.option(option)[0]
+        result = dict()
+        for j in range(len(self.names)):
+            total = cumweights[j][-1]
+            result[self.names[j]] = (cumweights[j][self.accepted(j, epsilon)] / total
+                                     if total > 0 else None)
+        return(result)
+
+    def statistics(self, metric, epsilon, option = None):
+        """
+        Return a dictionary of the number and weight of runs accepted for the
+        metric at epsilon, and the weighted mean and standard deviation of
+        each dynamic parameter over them
+        """
+        j = self.column(metric)
+        k = self.accepted(j, epsilon)
+        if option is None:
+            runs = k
+            weight = self.cumweights[j][k]
+            sums = self.cumsums[j][k]
+            squares = self.cumsquares[j][k]
+        else:
+            rows = self.orders[j][0:k]
+            rows = rows[self.option(option)[1][rows]]
+            weights = self.weights[rows]
+            runs = len(rows)
+            weight = np.sum(weights)
+            sums = np.dot(weights, self.values[rows])
+            squares = np.dot(weights, self.values[rows] ** 2)
+        result = {'metric': metric, 'epsilon': epsilon, 'runs': runs,
+                  'weight': weight, 'parameters': dict()}
+        for p in range(len(self.brute.params)):
+            if weight > 0:
+                mean = sums[p] / weight
+                sd = np.sqrt(max(squares[p] / weight - mean * mean, 0.0))
+            else:
+                mean = None
+                sd = None
+            result['parameters'][self.brute.params[p]] = {'mean': mean, 'sd': sd}
+        return(result)
+
+    def histogram(self, metric, epsilon, parameter, bins = _DEFAULT_PROFILE_BINS,
+                  option = None):
+        """
+        Return a dictionary of the bin edges and (weighted) counts of a dynamic
+        parameter over the runs accepted for the metric at epsilon, with bins
+        spanning the parameter's minimum and maximum in the parameter file
+        """
+        j = self.column(metric)
+        p = self.parameter(parameter)
+        rows = self.orders[j][0:self.accepted(j, epsilon)]
+        if option is not None:
+            rows = rows[self.option(option)[1][rows]]
+        (counts, edges) = np.histogram(self.values[rows, p], bins,
+                                       range = (self.brute.param_minima[p],
+                                                self.brute.param_maxima[p]),
+                                       weights = self.weights[rows])
+        return({'metric': metric, 'epsilon': epsilon, 'parameter': parameter,
+                'runs': len(rows), 'edges': edges.tolist(), 'counts': counts.tolist()})
+
+    def info(self):
+        """
+        Return a dictionary describing the runs and the epsilon grid
+        """
+        return({'metrics': self.brute.headers, 'parameters': self.brute.params,
+                'runs': self.brute.n_runs, 'epsilons': self.brute.epsilons})
+
+    def query(self, path, args):
+        """
+        Answer a query for the path with the arguments (a dictionary of query
+        string values), returning a dictionary
+        """
+        option = args.get('option')
+        if path == '/info':
+            return(self.info())
+        epsilon = EvidenceIndex.number(args, 'epsilon', float)
+        if path == '/evidence':
+            return({'epsilon': epsilon, 'evidence': self.evidence(epsilon, option)})
+        metric = args.get('metric', 'joint')
+        if path == '/accepted':
+            return(self.statistics(metric, epsilon, option))
+        if path == '/histogram':
+            if 'parameter' not in args:
+                raise QueryError("No parameter given")
+            bins = EvidenceIndex.number(args, 'bins', int, _DEFAULT_PROFILE_BINS)
+            if bins < 1:
+                raise QueryError("Number of bins must be positive")
+            return(self.histogram(metric, epsilon, args['parameter'], bins, option))
+        raise QueryError("Query %s not recognized"%(path), 404)
+
+    @staticmethod
+    def number(args, name, kind, default = None):
+        """
+        Return the named query argument converted to a number of the kind,
+        which must be finite
+        """
+        if name not in args:
+            if default is None:
+                raise QueryError("No %s given"%(name))
+            return(default)
+        try:
+            value = kind(args[name])
+        except ValueError:
+            raise QueryError("Invalid %s: %s"%(name, args[name]))
+        if not np.isfinite(value):
+            raise QueryError("Invalid %s: %s"%(name, args[name]))
+        return(value)
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """QueryHandler class
+
+    Replies to GET requests with the answer from the server's EvidenceIndex
+    as JSON
+    """
+    def do_GET(self):
+        url = urlparse(self.path)
+        args = dict([(key, values[-1]) for (key, values) in parse_qs(url.query).items()])
+        try:
+            status = 200
+            reply = self.server.index.query(url.path, args)
+        except QueryError as e:
+            status = e.status
+            reply = {'error': str(e)}
+        body = json.dumps(reply, default = float).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve(index, port = _DEFAULT_PORT):
+    """
+    Answer queries from the index on the port until interrupted
+    """
+    server = HTTPServer((_HOST, port), QueryHandler)
+    server.index = index
+    sys.stderr.write("Serving %d runs on http://%s:%d/\n"%(index.brute.n_runs, _HOST, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+if __name__ == "__main__":
+    port = _DEFAULT_PORT
+    replicates = False
+    importance = None
+    i = 1
+    while i < len(sys.argv) and sys.argv[i][0:1] == '-':
+        if sys.argv[i] == '-port' and i + 1 < len(sys.argv):
+            port = int(sys.argv[i + 1])
+            i = i + 2
+        elif sys.argv[i] == '-replicates':
+            replicates = True
+            i = i + 1
+        elif sys.argv[i] == '-importance' and i + 1 < len(sys.argv):
+            importance = sys.argv[i + 1]
+            i = i + 2
+        else:
+            sys.stderr.write("Option %s not recognized\n"%(sys.argv[i]))
+            sys.exit(1)
+    argv = sys.argv[i:]
+
+    if len(argv) != 3:
+        sys.stderr.write("Usage: abcserver.py [-port <n>] [-replicates] "
+                         + "[-importance <weight column>] <run data> "
+                         + "<metrics file> <parameter file>\n")
+        sys.exit(1)
+
+    for file in argv:
+        if not os.path.exists(file):
+            sys.stderr.write("File %s does not exist\n"%(file))
+            sys.exit(1)
+
+    df = pd.read_csv(argv[0], sep = ',', header = 0)
+    metrics = pd.read_csv(argv[1], sep = ',', header = 0)
+    params = pd.read_csv(argv[2], sep = ',', header = 0)
+
+    BruteABC.ckdata(df, params, metrics, argv[0], argv[2], argv[1])
+
+    brute = BruteABC(df, params, metrics)
+    if replicates:
+        brute.groupReplicates()
+    if importance is not None:
+        brute.setImportance(importance)
+    serve(EvidenceIndex(brute), port)
+    sys.exit(0)
@@ -0,0 +1,228 @@
+#!/usr/bin/python
+"""check.py
+
+Checks of the files written by bruteABC.py calibrate, run on a synthetic run
+table (see synthetic.py) in a temporary directory:
+
+  summaries         -summaries writes a CSV file with one row per dynamic
+                    parameter, metric (and all the metrics jointly) and
+                    epsilon, and one column per summary statistic
+  weights           with -replicates and -importance, the summaries' means
+                    are weighted by the importance weights over the number
+                    of runs with the same parameter set (half the table is
+                    repeated so there are replicates)
+  adjust            with -adjust, the summaries accept the same runs as
+                    without, but are of regression adjusted parameters
+
+Each check runs bruteABC.py in a separate Python interpreter, as a user
+would, and reports 'ok' or what was wrong. The exit status is 1 if any check
+fails.
+
+Usage: check.py [-checks <name,name,...>] [-rows <n>] [-seed <n>]
+
+Uses: numpy, pandas
+Licence: GNU General Public Licence v3 (see comments)
+"""
+# Copyright (C) 2018-2019  The James Hutton Institute & University of Edinburgh
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public Licence as published by
+# the Free Software Foundation, either version 3 of the Licence, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public Licence for more details.
+#
+# You should have received a copy of the GNU General Public Licence
+# along with this program.  If not, see <https://www.gnu.org/licences/>.
+import sys
+import os
+import shutil
+import subprocess
+import tempfile
+import numpy as np
+import pandas as pd
+import synthetic
+
+_CHECKS = ['summaries', 'weights', 'adjust']
+_DEFAULT_ROWS = 5000
+_SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SCRIPT = os.path.join(_SOURCE_DIR, 'bruteABC.py')
+_EPSTEPS = 100          # bruteABC.py's default number of epsilon steps
+_STATS = ['runs', 'mean', 'sd', 'q05', 'q25', 'median', 'q75', 'q95', 'hpd_lower',
+          'hpd_upper']
+
+def calibrate(work, options):
+    """
+    Run bruteABC.py calibrate with the options on the data, metric and
+    parameter files in the work directory, returning None if it succeeded
+    or the last line of its output if not
+    """
+    proc = subprocess.Popen([sys.executable, _SCRIPT, 'calibrate'] + options
+                            + ['data.csv', 'metrics.csv', 'params.csv', 'evidence.csv',
+                               'ratio.csv'],
+                            cwd = work, stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+    output = proc.communicate()[0].decode().strip()
+    if proc.returncode != 0:
+        return("calibrate failed: %s"%(output.split('\n')[-1]))
+    return(None)
+
+def dynamicParams(paramdf):
+    """
+    Return the parameters bruteABC.py gives posteriors for: the numeric ones
+    with a range
+    """
+    return([paramdf['parameter'][i] for i in range(len(paramdf))
+            if paramdf['type'][i] == 'numeric'
+            and paramdf['minimum'][i] != paramdf['maximum'][i]])
+
+def checkSummaries(work, df, paramdf, metricdf):
+    """
+    Check the table written by -summaries, returning a list of problems
+    """
+    error = calibrate(work, ['-summaries', 'summaries.csv'])
+    if error is not None:
+        return([error])
+    table = pd.read_csv(os.path.join(work, 'summaries.csv'))
+    problems = []
+    columns = ['parameter', 'metric', 'epsilon'] + _STATS
+    if list(table.columns) != columns:
+        problems.append("columns are %s, not %s"%(list(table.columns), columns))
+        return(problems)
+    params = dynamicParams(paramdf)
+    metrics = list(metricdf['metric']) + ['joint']
+    expected = len(params) * len(metrics) * (_EPSTEPS + 1)
+    if len(table.index) != expected:
+        problems.append("%d rows, not %d (%d parameters x %d metrics and joint x %d epsilons)"
+                        %(len(table.index), expected, len(params), len(metrics), _EPSTEPS + 1))
+    if sorted(set(table['parameter'])) != sorted(params):
+        problems.append("parameters are %s, not %s"%(sorted(set(table['parameter'])),
+                                                      sorted(params)))
+    if sorted(set(table['metric'])) != sorted(metrics):
+        problems.append("metrics are %s, not %s"%(sorted(set(table['metric'])),
+                                                  sorted(metrics)))
+    if table.duplicated(['parameter', 'metric', 'epsilon']).any():
+        problems.append("repeated parameter, metric and epsilon rows")
+    runs = table.sort_values('epsilon').groupby(['parameter', 'metric'])['runs']
+    if (runs.diff().fillna(0) < 0).any() or (table['runs'] > len(df.index)).any():
+        problems.append("runs accepted do not grow with epsilon up to the number of runs")
+    return(problems)
+
+def checkWeights(work, df, paramdf, metricdf, seed):
+    """
+    Check that the summaries use the replicate and importance weights,
+    comparing the mean of each parameter for all the metrics jointly at the
+    largest epsilon with one computed here, returning a list of problems
+    """
+    rng = np.random.RandomState(seed)
+    df = pd.concat([df, df.iloc[0:len(df.index) // 2]], ignore_index = True)
+    df['importance'] = rng.uniform(0.5, 2.0, len(df.index))
+    df.to_csv(os.path.join(work, 'data.csv'), index = False)
+    error = calibrate(work, ['-replicates', '-importance', 'importance',
+                             '-summaries', 'summaries.csv'])
+    if error is not None:
+        return([error])
+    table = pd.read_csv(os.path.join(work, 'summaries.csv'))
+
+    dist = np.zeros(len(df.index))
+    for i in range(len(metricdf)):
+        (value, target, lower, upper) = (df[metricdf['metric'][i]].to_numpy(dtype = float),
+                                         metricdf['target'][i], metricdf['minimum'][i],
+                                         metricdf['maximum'][i])
+        if metricdf['operator'][i] == 'log':
+            (value, target, lower, upper) = (np.log(value), np.log(target), np.log(lower),
+                                             np.log(upper))
+        dist = np.maximum(dist, np.fabs(value - target) / (upper - lower))
+    epsilon = table['epsilon'].max()
+    accepted = dist < epsilon
+    sizes = df.groupby(list(paramdf['parameter']))['importance'].transform('size')
+    weights = (df['importance'] / sizes).to_numpy(dtype = float)[accepted]
+
+    problems = []
+    for param in dynamicParams(paramdf):
+        row = table[(table['parameter'] == param) & (table['metric'] == 'joint')
+                    & (table['epsilon'] == epsilon)]
+        mean = np.sum(weights * df[param].to_numpy(dtype = float)[accepted]) / np.sum(weights)
+        if len(row.index) != 1 or not np.isclose(row['mean'].iloc[0], mean, rtol = 1e-9):
+            problems.append("joint mean of %s at epsilon %g is %s, not %g"
+                            %(param, epsilon, list(row['mean']), mean))
+    return(problems)
+
+def checkAdjust(work):
+    """
+    Check that -adjust changes the summaries' statistics but not the runs
+    accepted, returning a list of problems
+    """
+    tables = []
+    for options in [[], ['-adjust']]:
+        error = calibrate(work, options + ['-summaries', 'summaries.csv'])
+        if error is not None:
+            return([error])
+        tables.append(pd.read_csv(os.path.join(work, 'summaries.csv')))
+    problems = []
+    if not tables[0]['runs'].equals(tables[1]['runs']):
+        problems.append("runs accepted differ with -adjust")
+    if np.allclose(tables[0]['mean'], tables[1]['mean'], equal_nan = True):
+        problems.append("means are the same with -adjust")
+    return(problems)
+
+def check(name, rows, seed):
+    """
+    Run one check in a temporary directory, returning a list of problems
+    """
+    work = tempfile.mkdtemp(prefix = 'bruteABC-check-')
+    try:
+        (df, paramdf, metricdf) = synthetic.generate(rows, seed = seed)
+        df.to_csv(os.path.join(work, 'data.csv'), index = False)
+        paramdf.to_csv(os.path.join(work, 'params.csv'), index = False)
+        metricdf.to_csv(os.path.join(work, 'metrics.csv'), index = False)
+        if name == 'summaries':
+            return(checkSummaries(work, df, paramdf, metricdf))
+        if name == 'weights':
+            return(checkWeights(work, df, paramdf, metricdf, seed))
+        if name == 'adjust':
+            return(checkAdjust(work))
+        sys.stderr.write("Check %s not recognized\n"%(name))
+        sys.exit(1)
+    finally:
+        shutil.rmtree(work, ignore_errors = True)
+
+if __name__ == "__main__":
+    names = _CHECKS
+    rows = _DEFAULT_ROWS
+    seed = synthetic._DEFAULT_SEED
+    i = 1
+    while i < len(sys.argv) and sys.argv[i][0:1] == '-':
+        if sys.argv[i] == '-checks' and i + 1 < len(sys.argv):
+            names = sys.argv[i + 1].split(',')
+            i = i + 2
+        elif sys.argv[i] == '-rows' and i + 1 < len(sys.argv):
+            rows = int(float(sys.argv[i + 1]))
+            i = i + 2
+        elif sys.argv[i] == '-seed' and i + 1 < len(sys.argv):
+            seed = int(sys.argv[i + 1])
+            i = i + 2
+        else:
+            sys.stderr.write("Option %s not recognized\n"%(sys.argv[i]))
+            sys.exit(1)
+    if i < len(sys.argv):
+        sys.stderr.write("Usage: check.py [-checks <name,name,...>] [-rows <n>] [-seed <n>]\n")
+        sys.exit(1)
+    for name in names:
+        if name not in _CHECKS:
+            sys.stderr.write("Check %s not recognized (use %s)\n"%(name, ", ".join(_CHECKS)))
+            sys.exit(1)
+
+    failed = False
+    for name in names:
+        problems = check(name, rows, seed)
+        if len(problems) == 0:
+            sys.stdout.write("%-17s ok\n"%(name))
+        else:
+            failed = True
+            for problem in problems:
+                sys.stdout.write("%-17s %s\n"%(name, problem))
+        sys.stdout.flush()
+    sys.exit(1 if failed else 0)
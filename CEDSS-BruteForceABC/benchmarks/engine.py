@@ -0,0 +1,283 @@
+#!/usr/bin/python
+"""engine.py
+
+Benchmarks of the bruteABC.py engine on synthetic run tables (see
+synthetic.py), so its performance can be measured without model outputs.
+Each benchmark is run for each number of rows in a separate Python
+interpreter, which generates the table in memory, does any setting up (e.g.
+building the BruteABC object the plots need) and then times one operation:
+
+  read              reading the run table from a CSV file
+  construct         building a BruteABC object (sorting each metric's
+                    deviations and computing the evidences)
+  scales            BruteABC.computeScales() with rescaling on
+  select            ParamOption.select() for one parameter option file
+  compare           ParamOption.plotarray() for two option files, as in
+                    bruteABC.py compare
+  plot_evidence     plotScaledEvidenceRatio()
+  plot_log_evidence plotScaledLogEvidenceRatio()
+  plot_triangles    trianglePlots()
+  plot_posteriors   posteriorPlots()
+  plot_cube         savePosteriorCube() and plotPosteriorCube()
+  plot_profiles     plotParameterProfiles()
+  plot_kde          plotKDETriangles()
+
+The wall and CPU time of the operation and the interpreter's peak resident
+memory before and after it are recorded. Benchmarks taking longer than the
+timeout are stopped and recorded as such.
+
+Usage: engine.py [-sizes <n,n,...>] [-benchmarks <name,name,...>]
+                 [-timeout <seconds>] [-params <n>] [-integers <n>]
+                 [-choosers <n>] [-metrics <n>] [-logs <n>] [-seed <n>]
+                 [<history JSON file>]
+
+The default sizes are 10^4 to 10^7 rows. If a history file is given, the
+results are appended to it (as a list of records, one per call, with the
+date, versions, commit and options), and each result is compared with the
+last one in the history with the same benchmark, rows and table options,
+so regressions are visible.
+
+Uses: numpy, pandas, matplotlib
+Licence: GNU General Public Licence v3 (see comments)
+"""
+# Copyright (C) 2018-2019  The James Hutton Institute & University of Edinburgh
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public Licence as published by
+# the Free Software Foundation, either version 3 of the Licence, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public Licence for more details.
+#
+# You should have received a copy of the GNU General Public Licence
+# along with this program.  If not, see <https://www.gnu.org/licences/>.
+import sys
+import os
+import json
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import synthetic
+
+_BENCHMARKS = ['read', 'construct', 'scales', 'select', 'compare', 'plot_evidence',
+               'plot_log_evidence', 'plot_triangles', 'plot_posteriors', 'plot_cube',
+               'plot_profiles', 'plot_kde']
+_DEFAULT_SIZES = [10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]
+_DEFAULT_TIMEOUT = 3600.0
+_POLL = 0.1             # Seconds between checks on a running benchmark
+_SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_TABLE_OPTIONS = ['params', 'integers', 'choosers', 'metrics', 'logs', 'seed']
+
+def peakMemory():
+    """
+    Return the peak resident memory of this process in MB (ru_maxrss is in
+    kB on Linux but bytes on macOS)
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return(peak / (1024.0 * 1024.0))
+    return(peak / 1024.0)
+
+def setUp(name, rows, options):
+    """
+    Generate the table and do the setting up for the benchmark in the
+    current directory, returning a function doing the operation to time
+    """
+    sys.path.insert(0, _SOURCE_DIR)
+    from bruteABC import BruteABC, ParamOption
+    (df, paramdf, metricdf) = synthetic.generate(rows, *[options[k] for k in _TABLE_OPTIONS])
+    paramdf.to_csv('params.csv', index = False)
+    metricdf.to_csv('metrics.csv', index = False)
+    params = pd.read_csv('params.csv')
+    metrics = pd.read_csv('metrics.csv')
+    if name == 'read':
+        df.to_csv('data.csv', index = False)
+        return(lambda: pd.read_csv('data.csv', sep = ',', header = 0))
+    if name == 'construct':
+        return(lambda: BruteABC(df, params, metrics))
+    if name == 'scales':
+        brute = BruteABC(df, params, metrics, rescale = True)
+        return(brute.computeScales)
+    if name in ['select', 'compare']:
+        files = synthetic.optionFiles(paramdf, 'option')
+        if name == 'select':
+            option = ParamOption(files[0])
+            return(lambda: option.select(df))
+        options = ParamOption.buildarray(files)
+        return(lambda: ParamOption.plotarray(options, df, metrics, 'compare.png'))
+    brute = BruteABC(df, params, metrics)
+    if name == 'plot_evidence':
+        return(lambda: brute.plotScaledEvidenceRatio('evr.png'))
+    if name == 'plot_log_evidence':
+        return(lambda: brute.plotScaledLogEvidenceRatio('levr.png'))
+    if name == 'plot_triangles':
+        return(lambda: brute.trianglePlots('triangle.png'))
+    if name == 'plot_posteriors':
+        return(lambda: brute.posteriorPlots('posterior', 'png'))
+    if name == 'plot_cube':
+        return(lambda: (brute.savePosteriorCube('cube.npz'),
+                        BruteABC.plotPosteriorCube('cube.npz', 'cube', 'png')))
+    if name == 'plot_profiles':
+        return(lambda: brute.plotParameterProfiles('profile', 'png'))
+    if name == 'plot_kde':
+        return(lambda: brute.plotKDETriangles('kde.png'))
+    sys.stderr.write("Benchmark %s not recognized\n"%(name))
+    sys.exit(1)
+
+def child(name, rows, options):
+    """
+    Run one benchmark in this (child) process, writing the result as JSON to
+    the last line of standard output
+    """
+    operation = setUp(name, rows, options)
+    setup_rss = peakMemory()
+    cpu = time.clock() if sys.version_info[0] < 3 else time.process_time()
+    start = time.time()
+    operation()
+    wall = time.time() - start
+    cpu = (time.clock() if sys.version_info[0] < 3 else time.process_time()) - cpu
+    sys.stdout.write("\n" + json.dumps({'seconds': wall, 'cpu_seconds': cpu,
+                                        'setup_rss_mb': setup_rss,
+                                        'peak_rss_mb': peakMemory()}) + "\n")
+
+def benchmark(name, rows, options, timeout = _DEFAULT_TIMEOUT):
+    """
+    Run one benchmark in a new interpreter in a temporary directory,
+    returning a dictionary of the results
+    """
+    work = tempfile.mkdtemp(prefix = 'bruteABC-bench-')
+    result = {'benchmark': name, 'rows': rows}
+    try:
+        out = open(os.path.join(work, 'out.txt'), 'w')
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '-child', name,
+                                 str(rows), json.dumps(options)],
+                                cwd = work, stdout = out, stderr = subprocess.STDOUT)
+        start = time.time()
+        while proc.poll() is None and time.time() - start < timeout:
+            time.sleep(_POLL)
+        out.close()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+            result['status'] = 'timeout'
+        elif proc.returncode != 0:
+            result['status'] = 'failed'
+            lines = open(os.path.join(work, 'out.txt')).read().strip().split('\n')
+            result['error'] = lines[-1]
+        else:
+            lines = open(os.path.join(work, 'out.txt')).read().strip().split('\n')
+            result['status'] = 'ok'
+            result.update(json.loads(lines[-1]))
+    finally:
+        shutil.rmtree(work, ignore_errors = True)
+    return(result)
+
+def commit():
+    """
+    Return the git commit of the source directory, or None
+    """
+    try:
+        return(subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd = _SOURCE_DIR,
+                                       stderr = subprocess.STDOUT).decode().strip())
+    except (OSError, subprocess.CalledProcessError):
+        return(None)
+
+def previous(history, options, name, rows):
+    """
+    Return the last result in the history for the benchmark, rows and table
+    options that ran successfully, or None
+    """
+    for record in reversed(history):
+        if record['options'] != options:
+            continue
+        for result in record['results']:
+            if result['benchmark'] == name and result['rows'] == rows \
+                and result['status'] == 'ok':
+                return(result)
+    return(None)
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == '-child':
+        child(sys.argv[2], int(sys.argv[3]), json.loads(sys.argv[4]))
+        sys.exit(0)
+
+    sizes = _DEFAULT_SIZES
+    names = _BENCHMARKS
+    timeout = _DEFAULT_TIMEOUT
+    options = {'params': synthetic._DEFAULT_PARAMS, 'integers': synthetic._DEFAULT_INTEGERS,
+               'choosers': synthetic._DEFAULT_CHOOSERS, 'metrics': synthetic._DEFAULT_METRICS,
+               'logs': synthetic._DEFAULT_LOGS, 'seed': synthetic._DEFAULT_SEED}
+    i = 1
+    while i < len(sys.argv) and sys.argv[i][0:1] == '-':
+        if sys.argv[i] == '-sizes' and i + 1 < len(sys.argv):
+            sizes = [int(float(n)) for n in sys.argv[i + 1].split(',')]
+            i = i + 2
+        elif sys.argv[i] == '-benchmarks' and i + 1 < len(sys.argv):
+            names = sys.argv[i + 1].split(',')
+            i = i + 2
+        elif sys.argv[i] == '-timeout' and i + 1 < len(sys.argv):
+            timeout = float(sys.argv[i + 1])
+            i = i + 2
+        elif sys.argv[i][1:] in options and i + 1 < len(sys.argv):
+            options[sys.argv[i][1:]] = int(sys.argv[i + 1])
+            i = i + 2
+        else:
+            sys.stderr.write("Option %s not recognized\n"%(sys.argv[i]))
+            sys.exit(1)
+    args = sys.argv[i:]
+    if len(args) > 1:
+        sys.stderr.write("Usage: engine.py [-sizes <n,n,...>] [-benchmarks <name,name,...>] "
+                         + "[-timeout <seconds>] [-params <n>] [-integers <n>] "
+                         + "[-choosers <n>] [-metrics <n>] [-logs <n>] [-seed <n>] "
+                         + "[<history JSON file>]\n")
+        sys.exit(1)
+    for name in names:
+        if name not in _BENCHMARKS:
+            sys.stderr.write("Benchmark %s not recognized (use %s)\n"
+                             %(name, ", ".join(_BENCHMARKS)))
+            sys.exit(1)
+
+    history = []
+    if len(args) == 1 and os.path.exists(args[0]):
+        history = json.load(open(args[0]))
+
+    results = []
+    for rows in sizes:
+        for name in names:
+            result = benchmark(name, rows, options, timeout)
+            results.append(result)
+            line = "%-17s %9d rows: "%(name, rows)
+            if result['status'] == 'ok':
+                line += "%9.3fs wall %9.3fs CPU %9.1fMB peak" \
+                        %(result['seconds'], result['cpu_seconds'], result['peak_rss_mb'])
+                last = previous(history, options, name, rows)
+                if last is not None and last['seconds'] > 0:
+                    line += " (%.2fx time, %.2fx memory of last)" \
+                            %(result['seconds'] / last['seconds'],
+                              result['peak_rss_mb'] / last['peak_rss_mb'])
+            else:
+                line += result['status']
+                if 'error' in result:
+                    line += ": " + result['error']
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+
+    if len(args) == 1:
+        history.append({'date': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        'python': sys.version.split()[0],
+                        'numpy': np.__version__, 'pandas': pd.__version__,
+                        'platform': platform.platform(), 'commit': commit(),
+                        'options': options, 'timeout': timeout, 'results': results})
+        fp = open(args[0], 'w')
+        json.dump(history, fp, indent = 1, sort_keys = True)
+        fp.close()
+    sys.exit(0)
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+"""startup.py
+
+Benchmark of the time taken to start bruteABC.py: each repeat imports the
+module in a fresh Python interpreter and times the import. It also checks
+that importing the numeric core does not load the plotting or scaling
+modules (matplotlib.pyplot, abcplot and scipy), which should only be loaded
+when a plotting method or computeScales() is first used.
+
+Usage: startup.py [-repeats <n>] [<history CSV file>]
+
+If a history file is given, a row with the date, Python version and timings
+is appended to it (the file is created with a heading row if need be), so
+startup time can be tracked over changes to the code.
+
+Uses: numpy
+Licence: GNU General Public Licence v3 (see comments)
+"""
+# Copyright (C) 2018-2019  The James Hutton Institute & University of Edinburgh
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public Licence as published by
+# the Free Software Foundation, either version 3 of the Licence, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public Licence for more details.
+#
+# You should have received a copy of the GNU General Public Licence
+# along with this program.  If not, see <https://www.gnu.org/licences/>.
+import sys
+import os
+import subprocess
+import time
+import numpy as np
+
+_DEFAULT_REPEATS = 10
+_LAZY_MODULES = ['matplotlib.pyplot', 'abcplot', 'scipy']
+_SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in the child interpreter: prints the seconds taken to import bruteABC,
+# then any of the lazily loaded modules that the import loaded anyway
+_CHILD = """
+import sys, time
+start = time.time()
+import bruteABC
+sys.stdout.write('%%r\\n' %% (time.time() - start))
+sys.stdout.write(','.join([m for m in %r if m in sys.modules]) + '\\n')
+""" % (_LAZY_MODULES)
+
+def importOnce():
+    """
+    Import bruteABC in a new interpreter, returning the wall time taken for
+    the whole interpreter, the time taken by the import alone, and a list of
+    lazily loaded modules that the import loaded
+    """
+    start = time.time()
+    output = subprocess.check_output([sys.executable, '-c', _CHILD],
+                                     cwd = _SOURCE_DIR).decode().split('\n')
+    wall = time.time() - start
+    loaded = [m for m in output[1].split(',') if m != '']
+    return(wall, float(output[0]), loaded)
+
+def benchmark(repeats = _DEFAULT_REPEATS):
+    """
+    Return arrays of interpreter and import times over the repeats, and the
+    lazily loaded modules loaded by the import
+    """
+    walls = []
+    imports = []
+    loaded = []
+    for i in range(repeats):
+        (wall, imp, loaded) = importOnce()
+        walls.append(wall)
+        imports.append(imp)
+    return(np.array(walls), np.array(imports), loaded)
+
+def record(history, walls, imports):
+    """
+    Append a row of timings to the history CSV file
+    """
+    new = not os.path.exists(history)
+    fp = open(history, 'a')
+    if new:
+        fp.write("date,python,repeats,median_startup,min_startup,median_import,"
+                 "min_import\n")
+    fp.write("%s,%s,%d,%g,%g,%g,%g\n"%(time.strftime("%Y-%m-%dT%H:%M:%S"),
+                                       sys.version.split()[0], len(walls),
+                                       np.median(walls), np.min(walls),
+                                       np.median(imports), np.min(imports)))
+    fp.close()
+
+if __name__ == "__main__":
+    repeats = _DEFAULT_REPEATS
+    args = sys.argv[1:]
+    if len(args) >= 2 and args[0] == '-repeats':
+        repeats = int(args[1])
+        args = args[2:]
+    if len(args) > 1 or (len(args) == 1 and args[0][0:1] == '-'):
+        sys.stderr.write("Usage: startup.py [-repeats <n>] [<history CSV file>]\n")
+        sys.exit(1)
+
+    (walls, imports, loaded) = benchmark(repeats)
+    sys.stdout.write("Interpreter start and import bruteABC: median %.3fs, min %.3fs\n"
+                     %(np.median(walls), np.min(walls)))
+    sys.stdout.write("Import bruteABC alone: median %.3fs, min %.3fs\n"
+                     %(np.median(imports), np.min(imports)))
+    if len(args) == 1:
+        record(args[0], walls, imports)
+    if len(loaded) > 0:
+        sys.stderr.write("Importing bruteABC loaded %s, which should only be "
+                         "loaded when first used\n"%(", ".join(loaded)))
+        sys.exit(1)
+    sys.exit(0)
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+"""synthetic.py
+
+Generator of synthetic run tables for benchmarking bruteABC.py without model
+outputs. A table has one row per run, with columns for parameters and
+metrics, and comes with parameter and metric metadata files in the formats
+bruteABC.py expects.
+
+The parameters are sampled uniformly: continuous numeric parameters over
+[0, 10], integer (numeric) parameters over 1 to 10, and choosers (string
+parameters, as for NetLogo choosers) over three choices, the first and last
+of which are the minimum and maximum in the parameter file and the middle
+one the setting. A constant numeric parameter is also included, as in
+parameter files covering a whole model. Each metric is a random linear
+function of the numeric parameters plus an offset for each chooser choice
+and normal noise; log metrics (with operator 'log') are the exponential of
+this. Each metric's target is its noise-free value at a random parameter
+setting, and its minimum and maximum are its 1st and 99th percentiles
+(widened to include the target).
+
+Usage: synthetic.py [-params <n>] [-integers <n>] [-choosers <n>]
+                    [-metrics <n>] [-logs <n>] [-seed <n>]
+                    <rows> <data CSV> <metrics CSV> <parameter CSV>
+
+Uses: numpy, pandas
+Licence: GNU General Public Licence v3 (see comments)
+"""
+# Copyright (C) 2018-2019  The James Hutton Institute & University of Edinburgh
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public Licence as published by
+# the Free Software Foundation, either version 3 of the Licence, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public Licence for more details.
+#
+# You should have received a copy of the GNU General Public Licence
+# along with this program.  If not, see <https://www.gnu.org/licences/>.
+import sys
+import numpy as np
+import pandas as pd
+
+_DEFAULT_PARAMS = 4
+_DEFAULT_INTEGERS = 2
+_DEFAULT_CHOOSERS = 1
+_DEFAULT_METRICS = 3
+_DEFAULT_LOGS = 1
+_DEFAULT_SEED = 1
+_CHOICES = 3
+_NOISE = 0.1
+
+def generate(rows, n_params = _DEFAULT_PARAMS, n_integers = _DEFAULT_INTEGERS,
+             n_choosers = _DEFAULT_CHOOSERS, n_metrics = _DEFAULT_METRICS,
+             n_logs = _DEFAULT_LOGS, seed = _DEFAULT_SEED):
+    """
+    Return a run table with the given number of rows, continuous parameters,
+    integer parameters, choosers and metrics (the first n_logs of which have
+    log operators), and its parameter and metric metadata, as data frames
+    """
+    rng = np.random.RandomState(seed)
+    data = dict()
+    params = []
+    numeric = []
+    for k in range(n_params):
+        name = 'p%d'%(k + 1)
+        data[name] = rng.uniform(0.0, 10.0, rows)
+        params.append((name, 'Parameter %d'%(k + 1), 'numeric', 5.0, 0.0, 10.0))
+        numeric.append(name)
+    for k in range(n_integers):
+        name = 'i%d'%(k + 1)
+        data[name] = rng.randint(1, 11, rows)
+        params.append((name, 'Integer %d'%(k + 1), 'numeric', 5, 1, 10))
+        numeric.append(name)
+    choices = ['c%d'%(c) for c in range(_CHOICES)]
+    for k in range(n_choosers):
+        name = 'ch%d'%(k + 1)
+        data[name] = np.array(choices)[rng.randint(0, _CHOICES, rows)]
+        params.append((name, 'Chooser %d'%(k + 1), 'string', choices[_CHOICES // 2],
+                       choices[0], choices[-1]))
+    data['constant'] = np.ones(rows)
+    params.append(('constant', 'Constant', 'numeric', 1.0, 1.0, 1.0))
+
+    metrics = []
+    for j in range(n_metrics):
+        name = 'm%d'%(j + 1)
+        coefs = rng.normal(0.0, 1.0, len(numeric)) / np.sqrt(max(len(numeric), 1))
+        offsets = rng.normal(0.0, 0.5, (n_choosers, _CHOICES))
+        setting = dict([(p, rng.uniform(0.0, 1.0)) for p in numeric])
+        value = np.zeros(rows)
+        target = 0.0
+        for k in range(len(numeric)):
+            (lower, upper) = (params[k][4], params[k][5])
+            value += coefs[k] * (data[numeric[k]] - lower) / (1.0 * (upper - lower))
+            target += coefs[k] * setting[numeric[k]]
+        for k in range(n_choosers):
+            value += offsets[k][np.searchsorted(choices, data['ch%d'%(k + 1)])]
+            target += offsets[k][_CHOICES // 2]
+        value += rng.normal(0.0, _NOISE, rows)
+        operator = 'log' if j < n_logs else 'none'
+        if operator == 'log':
+            value = np.exp(value)
+            target = np.exp(target)
+        minimum = min(np.percentile(value, 1), target)
+        maximum = max(np.percentile(value, 99), target)
+        data[name] = value
+        metrics.append((name, 'Metric %d'%(j + 1), target, minimum, maximum, operator))
+
+    columns = [p[0] for p in params] + [m[0] for m in metrics]
+    df = pd.DataFrame(data, columns = columns)
+    paramdf = pd.DataFrame(params, columns = ['parameter', 'display', 'type', 'setting',
+                                              'minimum', 'maximum'])
+    metricdf = pd.DataFrame(metrics, columns = ['metric', 'display', 'target', 'minimum',
+                                                'maximum', 'operator'])
+    return(df, paramdf, metricdf)
+
+def optionFiles(paramdf, file_stem, options = 2):
+    """
+    Write parameter files for ParamOption, each restricting the first
+    parameter to an equal part of its range, returning their names
+    """
+    files = []
+    lower = float(paramdf['minimum'][0])
+    upper = float(paramdf['maximum'][0])
+    for i in range(options):
+        option = paramdf.copy()
+        option.loc[0, 'minimum'] = lower + (upper - lower) * i / (1.0 * options)
+        option.loc[0, 'maximum'] = lower + (upper - lower) * (i + 1) / (1.0 * options)
+        files.append('%s-%d.csv'%(file_stem, i + 1))
+        option.to_csv(files[-1], index = False)
+    return(files)
+
+if __name__ == "__main__":
+    sizes = {'-params': _DEFAULT_PARAMS, '-integers': _DEFAULT_INTEGERS,
+             '-choosers': _DEFAULT_CHOOSERS, '-metrics': _DEFAULT_METRICS,
+             '-logs': _DEFAULT_LOGS, '-seed': _DEFAULT_SEED}
+    i = 1
+    while i < len(sys.argv) and sys.argv[i][0:1] == '-':
+        if sys.argv[i] in sizes and i + 1 < len(sys.argv):
+            sizes[sys.argv[i]] = int(sys.argv[i + 1])
+            i = i + 2
+        else:
+            sys.stderr.write("Option %s not recognized\n"%(sys.argv[i]))
+            sys.exit(1)
+    argv = sys.argv[i:]
+
+    if len(argv) != 4:
+        sys.stderr.write("Usage: synthetic.py [-params <n>] [-integers <n>] [-choosers <n>] "
+                         + "[-metrics <n>] [-logs <n>] [-seed <n>] <rows> <data CSV> "
+                         + "<metrics CSV> <parameter CSV>\n")
+        sys.exit(1)
+
+    (df, paramdf, metricdf) = generate(int(float(argv[0])), sizes['-params'],
+                                       sizes['-integers'], sizes['-choosers'],
+                                       sizes['-metrics'], sizes['-logs'], sizes['-seed'])
+    df.to_csv(argv[1], index = False)
+    metricdf.to_csv(argv[2], index = False)
+    paramdf.to_csv(argv[3], index = False)
+    sys.exit(0)
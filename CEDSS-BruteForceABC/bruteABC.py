@@ -39,6 +39,16 @@ When run as a script, it expects the following inputs:
    checking which parameters actually change. Type is needed for determining
    numeric parameters. Setting is ignored.
 
+4. For the targets command only, a targets file in CSV format with one column
+   for each metric (named as in the metric metadata file), an optional
+   'target' column naming each row, and one row for each set of calibration
+   values to compute evidences for.
+
+5. For the split command only, either a second data file, with the runs in
+   each data file forming one half of a split sample, or (with -split) the
+   name of a column in the data file with two values dividing the runs into
+   halves.
+
 Outputs:
 
 1. A CSV file with one column for epsilon values, and one column for each
@@ -68,17 +78,19 @@ Licence: GNU General Public Licence v3 (see comments)
 # along with this program.  If not, see <https://www.gnu.org/licences/>.
 __version__ = "1.0"
 __author__ = "Gary Polhill & Jonathan Gair"
-# Imports: There are quite a lot of these, and many are only needed for
-# visualization, which should be handled by a separate module. Minimum
-# imports needed are sys, numpy and pandas. We may need scipy/optimize too,
-# depending on how the epsilon scaling issue is resolved.
+# Imports: Only sys, numpy and pandas are needed for the numeric core.
+# Visualization is handled by a separate module, abcplot, which is imported
+# (with matplotlib) only when a plotting method is first called; likewise
+# scipy is imported only by the methods that use it (computeScales() and
+# nearestRuns()), so saving evidence files starts quickly and needs no display.
 import sys
 import os.path
+import bisect
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import corner as triangle
-from scipy import optimize as op
+import multiprocessing
+import time
+import contextlib
 from collections import Counter
 
 # Globals that are local to this file
@@ -107,6 +119,76 @@ _DEFAULT_LINE_COLOURS = [
                          '#b15928', # twelfth
                          ]  # From colour brewer
 _DEFAULT_LINE_STYLE = '-'
+_ACCEPTANCE_RULES = ['epsilon', 'pareto', 'nearest', 'quantile']
+_DEFAULT_PARETO_LAYERS = 1
+_DEFAULT_NEAREST = 1000
+_DEFAULT_QUANTILE = 1.0     # Percent
+_PARETO_BLOCK = 64      # Points below which divide and conquer stops dividing
+_PARETO_CHUNK = 4096    # Rows compared at once in a vectorised dominance test
+_PARETO_FILTER = 16     # Smallest-sum points used to discard dominated points
+_TARGET_CHUNK = 1 << 22 # Deviations computed at once for multiple targets
+_DEFAULT_PROFILE_BINS = 20
+_DEFAULT_CUBE_BINS = 50
+_DEFAULT_CUBE_PANELS = 12
+_DEFAULT_TRIANGLE_BINS = 20
+_TRIANGLE_CHUNK = 1 << 22   # Pair bin numbers computed at once for triangle plots
+_BANDWIDTH_RULES = ['silverman', 'scott']
+_DEFAULT_BANDWIDTH = 'silverman'
+_DEFAULT_KDE_CELLS = 256
+_DEFAULT_KDE_PAIR_CELLS = 64
+_KDE_TRUNCATE = 4.0     # Kernel standard deviations before the kernel is cut off
+_SUMMARY_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+_SUMMARY_HPD = 0.9
+_HPD_STEPS = 100        # Candidate lower tail probabilities searched for the HPD
+_WEIGHT_TREE_BATCH = 64 # Batch size (as a divisor of tree size) for building a whole tree
+_DEFAULT_EMULATOR_DRAWS = 100000
+_DEFAULT_EMULATOR_TRAIN = 500
+_DEFAULT_EMULATOR_REFITS = 5
+_EMULATOR_CHUNK = 1 << 22   # Kernel entries (or draw-epsilon pairs) computed at once
+_DEFAULT_CONVERGENCE_SIZES = 10
+_CONVERGENCE_MIN_RUNS = 100
+_DEFAULT_BOOTSTRAPS = 100
+_BOOTSTRAP_INTERVAL = 0.95
+_DEFAULT_SPLIT_LABEL = 'split'
+_SUMMARY_STATS = ['runs', 'mean', 'sd', 'q05', 'q25', 'median', 'q75', 'q95',
+                  'hpd_lower', 'hpd_upper']
+
+def _binTriangle(task):
+    """
+    Compute the histograms for one triangle plot from a (values, weights,
+    edges) tuple, where values is an array of accepted runs by parameter,
+    weights their run weights (or None) and edges the bin edges by parameter.
+    Returns an array of 1D histograms indexed by parameter and bin, and an
+    array of 2D histograms indexed by pair of parameters (in the order of
+    np.tril_indices()), bin of the later parameter and bin of the earlier one.
+    Each is a single weighted bincount over combined bin numbers. This is a
+    module-level function so it can be given to a multiprocessing pool.
+    """
+    (values, weights, edges) = task
+    (n, n_params) = values.shape
+    bins = edges.shape[1] - 1
+    if weights is None:
+        weights = np.ones(n)
+    binno = np.empty((n, n_params), dtype = int)
+    for k in range(n_params):
+        binno[:, k] = np.clip(np.searchsorted(edges[k], values[:, k], side = 'right') - 1,
+                              0, bins - 1)
+    hist1 = np.bincount((np.arange(n_params)[None, :] * bins + binno).ravel(),
+                        weights = np.repeat(weights, n_params),
+                        minlength = n_params * bins).reshape(n_params, bins)
+    (rows, cols) = np.tril_indices(n_params, -1)
+    n_pairs = len(rows)
+    hist2 = np.zeros(n_pairs * bins * bins)
+    if n_pairs > 0:
+        chunk = max(1, _TRIANGLE_CHUNK // n_pairs)
+        offsets = np.arange(n_pairs)[None, :] * bins
+        for start in range(0, n, chunk):
+            stop = min(n, start + chunk)
+            index = (offsets + binno[start:stop, rows]) * bins + binno[start:stop, cols]
+            hist2 += np.bincount(index.ravel(),
+                                 weights = np.repeat(weights[start:stop], n_pairs),
+                                 minlength = n_pairs * bins * bins)
+    return(hist1, hist2.reshape(n_pairs, bins, bins))
 
 class BruteABC:
     """BruceABC class
@@ -124,6 +206,8 @@ class BruteABC:
                 n_dyn_parm = n_dyn_parm + 1
         self.params = ["NA" for i in range(n_dyn_parm)]
         self.disp_params = ["NA" for i in range(n_dyn_parm)]
+        self.param_minima = [0.0 for i in range(n_dyn_parm)]
+        self.param_maxima = [0.0 for i in range(n_dyn_parm)]
 
         j = 0
         for i in range(len(params)):
@@ -131,6 +215,8 @@ class BruteABC:
                 and params['type'][i] == 'numeric':
                 self.params[j] = params['parameter'][i]
                 self.disp_params[j] = params['display'][i]
+                self.param_minima[j] = float(params['minimum'][i])
+                self.param_maxima[j] = float(params['maximum'][i])
                 j = j + 1
 
         self.n_metrics = len(metrics)
@@ -139,21 +225,22 @@ class BruteABC:
         self.calibvals = [metrics['target'][i] for i in range(self.n_metrics)]
         self.minima = [metrics['minimum'][i] for i in range(self.n_metrics)]
         self.maxima = [metrics['maximum'][i] for i in range(self.n_metrics)]
+        self.operators = [metrics['operator'][i] for i in range(self.n_metrics)]
 
         self.rescale = rescale
-        self.targets = pd.DataFrame(df.loc[:, self.headers])
+        self.targets = pd.DataFrame(df.loc[:, self.headers], dtype = float)
         self.difima = [self.maxima[i] - self.minima[i] for i in range(self.n_metrics)]
 
         for i in range(self.n_metrics):
-            if metrics['operator'][i] == "log":
-                self.calibvals[i] = np.log(self.calibvals[i])
-                self.minima[i] = np.log(self.minima[i])
-                self.maxima[i] = np.log(self.maxima[i])
-                self.difima[i] = self.maxima[i] - self.minima[i]
-                self.df.loc[:, self.headers[i]] = np.log(self.df[self.headers[i]].to_numpy())
-            for k in range(len(df.index)):
-                self.targets.iloc[k, i] \
-                    = (self.targets.iloc[k, i] - self.calibvals[i]) / self.difima[i]
+            with PhaseProfile.phase('normalise', len(df.index), self.headers[i]):
+                if metrics['operator'][i] == "log":
+                    self.calibvals[i] = np.log(self.calibvals[i])
+                    self.minima[i] = np.log(self.minima[i])
+                    self.maxima[i] = np.log(self.maxima[i])
+                    self.difima[i] = self.maxima[i] - self.minima[i]
+                    self.df.loc[:, self.headers[i]] = np.log(self.df[self.headers[i]].to_numpy())
+                self.targets.iloc[:, i] \
+                    = (self.df[self.headers[i]].to_numpy() - self.calibvals[i]) / self.difima[i]
             if self.minima[i] > self.calibvals[i]:
                 sys.stderr.write("Metric %d (%s): minimum (%g) > calibration "
                                  "value (%g)\n"%(i, self.headers[i],
@@ -185,27 +272,1258 @@ class BruteABC:
         self.optscales = 1.0 * np.ones_like(self.calibvals)
         self.logoptscales = 1.0 * np.ones_like(self.calibvals)
         self.scales_computed = False
+        self.accept = 'epsilon'
+        self.accept_value = None
+        self.adjust = False
+        self.layers = None
+        self.layers_k = None
+        self.kdtree = None
+        self.kdtree_rows = None
+
+        # Sorted absolute deviations of each metric from its target: the
+        # evidence at any epsilon (and for any normalisation of the metric)
+        # is then a binary search rather than a pass through the data. The
+        # order is kept so that cumulative run weights can be looked up too.
+        self.n_runs = len(self.df.index)
+        self.all_params = [params['parameter'][i] for i in range(len(params))]
+        self.absorders = [None for j in range(self.n_metrics)]
+        self.absdevs = [None for j in range(self.n_metrics)]
+        for j in range(self.n_metrics):
+            with PhaseProfile.phase('index', self.n_runs, self.headers[j]):
+                absdev = np.fabs(self.df[self.headers[j]].to_numpy(dtype = float)
+                                 - self.calibvals[j])
+                self.absorders[j] = np.argsort(absdev)
+                self.absdevs[j] = absdev[self.absorders[j]]
+        self.weights = None
+        self.cumweights = None
+        self.groups = None
+        self.n_groups = None
+        self.importance = None
+        self.grouped = False
+        self.figures = None
+        self.emulation = None
+
+        self.computeEvidences()
+
+    def computeEvidences(self):
+        """
+        (Re)compute the evidence curves, evidence ratios and their moments for
+        each metric, taking into account any run weights.
+        """
+        self.evidences[:] = 0.0
+        self.evratio[:] = 0.0
+        self.logevidences[:] = 0.0
+        for j in range(self.n_metrics):
+            with PhaseProfile.phase('evidence', self.n_runs, self.headers[j]):
+                self.evidences[j] = self.evidenceCurve(j)
+            self.evratio[j][1:] = self.evidences[j][1:] / np.array(self.epsilons[1:])
+            self.moments[j] = np.sum(self.evidences[j] * np.array(self.epsilons))
+            nonzero = self.evidences[j] > 0.0
+            self.logevidences[j][nonzero] = np.log(self.evidences[j][nonzero])
+            self.logmoments[j] = np.sum(self.logevidences[j] * np.array(self.epsilons))
+
+    def setWeights(self, weights):
+        """
+        Set a weight for each run (or None for equal weights), to be used in
+        the evidence curves and posteriors, and recompute the evidences. The
+        evidence is then the weighted proportion of runs accepted.
+        """
+        if weights is None:
+            self.weights = None
+            self.cumweights = None
+        else:
+            self.weights = np.array(weights, dtype = float).reshape(self.n_runs)
+            self.cumweights = [np.concatenate(([0.0], np.cumsum(self.weights[self.absorders[j]])))
+                               for j in range(self.n_metrics)]
+        self.computeEvidences()
+
+    def parameterSets(self):
+        """
+        Return an array giving the parameter set (numbered from 0) of each run,
+        and the number of parameter sets. Runs are in the same set if they have
+        the same settings of all the parameters in the parameter file, found by
+        hashing those columns of each row.
+        """
+        if self.groups is None:
+            hashes = pd.util.hash_pandas_object(self.df[self.all_params], index = False)
+            (uniq, self.groups) = np.unique(hashes.to_numpy(), return_inverse = True)
+            self.n_groups = len(uniq)
+        return(self.groups, self.n_groups)
+
+    def groupReplicates(self):
+        """
+        Weight each run by one over the number of runs with the same parameter
+        set, so that each parameter set counts once in the evidences and
+        posteriors, with its replicates giving its probability of acceptance
+        (see acceptanceProbabilities()).
+        """
+        self.grouped = True
+        self.combineWeights()
+
+    def setImportance(self, weights):
+        """
+        Set an importance weight for each run: the prior density of its
+        parameters over the density they were sampled from, for runs from
+        focused, adaptive or pooled designs rather than uniform sampling over
+        the parameter ranges. The weights may be an array or the name of a
+        column in the data (None to go back to uniform sampling). They are
+        used in the evidences, evidence ratios and posteriors (combined with
+        any replicate weights), which then estimate what uniform sampling
+        would have given. See effectiveSampleSizes() for how much information
+        is left after weighting.
+        """
+        if weights is None:
+            self.importance = None
+        else:
+            if isinstance(weights, str):
+                if weights not in self.df.columns:
+                    sys.stderr.write("Importance weight column %s does not appear "
+                                     "in the run data\n"%(weights))
+                    sys.exit(1)
+                weights = self.df[weights]
+            weights = np.array(weights, dtype = float).reshape(self.n_runs)
+            if not np.all(np.isfinite(weights)) or np.any(weights < 0) \
+                or np.sum(weights) <= 0:
+                sys.stderr.write("Importance weights must be finite, non-negative "
+                                 "and not all zero\n")
+                sys.exit(1)
+            self.importance = weights
+        self.combineWeights()
+
+    def combineWeights(self):
+        """
+        Called from groupReplicates() and setImportance(), this method sets the
+        run weights to the product of the importance weights and (if
+        replicates are grouped) one over the size of each run's parameter set
+        """
+        weights = None
+        if self.grouped:
+            (groups, n_groups) = self.parameterSets()
+            sizes = np.bincount(groups, minlength = n_groups)
+            weights = 1.0 / sizes[groups]
+        if self.importance is not None:
+            if weights is None:
+                weights = self.importance
+            else:
+                weights = weights * self.importance
+        self.setWeights(weights)
+
+    def effectiveSampleSizes(self):
+        """
+        Return arrays indexed by metric (with all the metrics jointly last) and
+        epsilon giving the number of runs accepted, their total weight and
+        their effective sample size, (sum of weights)^2 / (sum of squared
+        weights), which is the number of runs accepted if all the weights are
+        equal, and smaller the more uneven the weights are. Each is a
+        cumulative sum over the runs in order of first accepting epsilon.
+        """
+        n_eps = self.epsteps + 1
+        n_cols = self.n_metrics + 1
+        if self.weights is None:
+            weights = np.ones(self.n_runs)
+        else:
+            weights = self.weights
+        runs = np.zeros((n_cols, n_eps))
+        total = np.zeros((n_cols, n_eps))
+        ess = np.zeros((n_cols, n_eps))
+        for j in range(n_cols):
+            first = self.firstEpsilons(j if j < self.n_metrics else None)
+            counts = np.bincount(first, minlength = n_eps + 1)[0:n_eps]
+            sums = np.bincount(first, weights = weights, minlength = n_eps + 1)[0:n_eps]
+            squares = np.bincount(first, weights = weights * weights,
+                                  minlength = n_eps + 1)[0:n_eps]
+            runs[j] = np.cumsum(counts)
+            total[j] = np.cumsum(sums)
+            squares = np.cumsum(squares)
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                ess[j] = np.where(squares > 0, total[j] * total[j] / squares, 0.0)
+        return(runs, total, ess)
+
+    def saveEffectiveSampleSizes(self, file_name, delimiter = ","):
+        """
+        Save the diagnostics from effectiveSampleSizes() to the file (CSV format
+        by default) as a long table, with one row per metric and epsilon
+        """
+        (runs, total, ess) = self.effectiveSampleSizes()
+        names = self.headers + ['joint']
+        n_eps = self.epsteps + 1
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            ratio = np.where(runs > 0, ess / runs, np.nan)
+        pd.DataFrame({
+            'metric': np.repeat(names, n_eps),
+            'epsilon': np.tile(np.array(self.epsilons), len(names)),
+            'runs': runs.ravel().astype(int),
+            'weight': total.ravel(),
+            'ess': ess.ravel(),
+            'ess_ratio': ratio.ravel()
+        }, columns = ['metric', 'epsilon', 'runs', 'weight', 'ess', 'ess_ratio']).to_csv(
+            self.mkname(file_name), sep = delimiter, index = False)
+
+    def convergence(self, sizes = _DEFAULT_CONVERGENCE_SIZES, permutations = 0,
+                    bootstraps = _DEFAULT_BOOTSTRAPS, seed = None):
+        """
+        Diagnose whether there are enough runs for the evidence curves to have
+        converged, by computing them from growing numbers of runs: the first
+        runs in the table, or (if permutations is more than zero) the first
+        runs in each of that many random orders of it. The numbers of runs
+        are sizes values spaced evenly on a log scale up to all the runs (or
+        an array of numbers). For each order, the runs' first accepting
+        epsilons are counted by the smallest number of runs including them and
+        accumulated, so every curve comes from one pass over the runs. The
+        uncertainty of each curve is estimated by bootstraps replicates, each
+        reweighting the runs by independent Poisson(1) counts.
+
+        Returns the numbers of runs, and arrays indexed by metric (with all the
+        metrics jointly last) and number of runs giving: the evidence at each
+        epsilon (as a third index); the change, the largest absolute
+        difference over epsilon between the curve and the curve from the
+        previous number of runs (NaN for the first); the deviation, the
+        largest absolute difference from the curve from all the runs; and the
+        width, the largest width over epsilon of the central _BOOTSTRAP_INTERVAL
+        bootstrap interval. All but the evidences are averaged over the
+        orders.
+        """
+        rng = np.random.RandomState(seed)
+        if np.isscalar(sizes):
+            sizes = np.geomspace(min(_CONVERGENCE_MIN_RUNS, self.n_runs), self.n_runs, sizes)
+        sizes = np.unique(np.clip(np.round(sizes).astype(int), 1, self.n_runs))
+        n_sizes = len(sizes)
+        n_eps = self.epsteps + 1
+        n_cols = self.n_metrics + 1
+        if self.weights is None:
+            weights = np.ones(self.n_runs)
+        else:
+            weights = self.weights
+        first = [self.firstEpsilons(j if j < self.n_metrics else None) for j in range(n_cols)]
+        if permutations > 0:
+            orders = [rng.permutation(self.n_runs) for i in range(permutations)]
+        else:
+            orders = [np.arange(self.n_runs)]
+        evidences = np.zeros((n_cols, n_sizes, n_eps))
+        change = np.zeros((n_cols, n_sizes))
+        deviation = np.zeros((n_cols, n_sizes))
+        width = np.zeros((n_cols, n_sizes))
+        tail = 0.5 * (1.0 - _BOOTSTRAP_INTERVAL)
+        for order in orders:
+            # Index of the smallest number of runs each run is among the first of
+            position = np.empty(self.n_runs, dtype = int)
+            position[order] = np.arange(self.n_runs)
+            size = np.searchsorted(sizes, position, side = 'right')
+            index = [size * (n_eps + 1) + first[j] for j in range(n_cols)]
+            for j in range(n_cols):
+                curves = self.prefixCurves(index[j], weights, n_sizes)
+                evidences[j] += curves / (1.0 * len(orders))
+                change[j, 0] = np.nan
+                change[j, 1:] += np.max(np.fabs(np.diff(curves, axis = 0)), axis = 1)
+                deviation[j] += np.max(np.fabs(curves - curves[-1]), axis = 1)
+            if bootstraps > 1:
+                boots = np.zeros((n_cols, bootstraps, n_sizes, n_eps))
+                for b in range(bootstraps):
+                    resampled = weights * rng.poisson(1.0, self.n_runs)
+                    for j in range(n_cols):
+                        boots[j, b] = self.prefixCurves(index[j], resampled, n_sizes)
+                bands = np.nanpercentile(boots, [100.0 * tail, 100.0 * (1.0 - tail)], axis = 1)
+                width += np.max(bands[1] - bands[0], axis = 2)
+        n_orders = 1.0 * len(orders)
+        return(sizes, evidences, change / n_orders, deviation / n_orders, width / n_orders)
+
+    def prefixCurves(self, index, weights, n_sizes):
+        """
+        Called from convergence(), this method returns the evidence curves
+        (indexed by number of runs and epsilon) from the weighted counts of
+        the runs' indices, each the index of the smallest number of runs the
+        run is among the first of times (epsteps + 2), plus the index of its
+        first accepting epsilon
+        """
+        n_eps = self.epsteps + 1
+        counts = np.bincount(index, weights = weights, minlength = (n_sizes + 1) * (n_eps + 1))
+        counts = np.cumsum(counts.reshape(n_sizes + 1, n_eps + 1)[0:n_sizes], axis = 0)
+        totals = np.sum(counts, axis = 1)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return(np.cumsum(counts[:, 0:n_eps], axis = 1) / totals[:, None])
+
+    def saveConvergence(self, file_name, sizes = _DEFAULT_CONVERGENCE_SIZES,
+                        permutations = 0, bootstraps = _DEFAULT_BOOTSTRAPS,
+                        seed = None, delimiter = ","):
+        """
+        Save the diagnostics from convergence() to the file (CSV format by
+        default) as a long table, with one row per metric and number of runs,
+        giving the change, deviation and bootstrap width of the evidence
+        curve and its evidence at refeps. Returns the diagnostics, so they can
+        be plotted with plotConvergence().
+        """
+        result = self.convergence(sizes, permutations, bootstraps, seed)
+        (sizes, evidences, change, deviation, width) = result
+        names = self.headers + ['joint']
+        i = int(np.argmin(np.fabs(np.array(self.epsilons) - self.refeps)))
+        pd.DataFrame({
+            'metric': np.repeat(names, len(sizes)),
+            'runs': np.tile(sizes, len(names)),
+            'evidence_refeps': evidences[:, :, i].ravel(),
+            'change': change.ravel(),
+            'deviation': deviation.ravel(),
+            'width': width.ravel()
+        }, columns = ['metric', 'runs', 'evidence_refeps', 'change', 'deviation',
+                      'width']).to_csv(self.mkname(file_name), sep = delimiter,
+                                       index = False)
+        return(result)
+
+    def plotConvergence(self, image_file, result = None, line_colours = [],
+                        legend_pos = _DEFAULT_LEGEND_POS, font_size = _DEFAULT_FONT_SIZE):
+        """
+        Plot the change (solid) and bootstrap width (dashed) of each metric's
+        evidence curve against the number of runs on log scales, saving the
+        graph to the image_file. The result of convergence() (or
+        saveConvergence()) can be given, or it is computed with the defaults.
+        """
+        if line_colours == []:
+            line_colours = _DEFAULT_LINE_COLOURS
+        if result is None:
+            result = self.convergence()
+        (sizes, evidences, change, deviation, width) = result
+        labels = ['Metric %i (%s)'%(j + 1, self.disp_metrics[j])
+                  for j in range(self.n_metrics)] + ['All metrics']
+        series = []
+        for j in range(len(labels)):
+            series.append((sizes[1:], change[j, 1:], labels[j] + ', change',
+                           line_colours[j], _DEFAULT_LINE_STYLE))
+            series.append((sizes, width[j], labels[j] + ', bootstrap width',
+                           line_colours[j], '--'))
+        self.drawFigures([('lines', [self.mkname(image_file), series, 'Runs',
+                                     'Largest difference in evidence', legend_pos,
+                                     font_size, 'Convergence of evidence', False, None,
+                                     None, True])])
+
+    def splitHalves(self, label):
+        """
+        Return the two values of the split label (a column in the data) and an
+        array giving the half of the sample (0 or 1) each run is in
+        """
+        if label not in self.df.columns:
+            sys.stderr.write("Split label column %s does not appear in the run "
+                             "data\n"%(label))
+            sys.exit(1)
+        (values, halves) = np.unique(self.df[label].to_numpy(), return_inverse = True)
+        if len(values) != 2:
+            sys.stderr.write("Split label column %s has %d values (it should have "
+                             "2)\n"%(label, len(values)))
+            sys.exit(1)
+        return(values, halves)
+
+    def splitEvidences(self, label, bootstraps = _DEFAULT_BOOTSTRAPS, seed = None):
+        """
+        Compare the evidence curves of the two halves of a split sample, given
+        by the two values of the label column. The runs' first accepting
+        epsilons are counted by half, so both halves' curves come from one
+        pass over the runs. The uncertainty is estimated by bootstraps
+        replicates, each reweighting the runs by independent Poisson(1)
+        counts, as in convergence().
+
+        Returns the values of the label, and arrays indexed by metric (with all
+        the metrics jointly last) giving: the evidences, indexed by half and
+        epsilon; the differences (first half minus second) by epsilon; and the
+        central _BOOTSTRAP_INTERVAL bootstrap bands of each, with the lower and
+        upper bounds as an extra first index.
+        """
+        rng = np.random.RandomState(seed)
+        (values, halves) = self.splitHalves(label)
+        n_cols = self.n_metrics + 1
+        if self.weights is None:
+            weights = np.ones(self.n_runs)
+        else:
+            weights = self.weights
+        index = [halves * (self.epsteps + 2) + self.firstEpsilons(j if j < self.n_metrics else None)
+                 for j in range(n_cols)]
+        evidences = np.array([self.halfCurves(index[j], weights) for j in range(n_cols)])
+        differences = evidences[:, 0] - evidences[:, 1]
+        if bootstraps > 1:
+            tail = 0.5 * (1.0 - _BOOTSTRAP_INTERVAL)
+            boots = np.zeros((bootstraps,) + evidences.shape)
+            for b in range(bootstraps):
+                resampled = weights * rng.poisson(1.0, self.n_runs)
+                for j in range(n_cols):
+                    boots[b, j] = self.halfCurves(index[j], resampled)
+            percents = [100.0 * tail, 100.0 * (1.0 - tail)]
+            bands = np.nanpercentile(boots, percents, axis = 0)
+            diff_bands = np.nanpercentile(boots[:, :, 0] - boots[:, :, 1], percents, axis = 0)
+        else:
+            bands = np.array([evidences, evidences])
+            diff_bands = np.array([differences, differences])
+        return(values, evidences, differences, bands, diff_bands)
+
+    def halfCurves(self, index, weights):
+        """
+        Called from splitEvidences(), this method returns the evidence curves
+        (indexed by half and epsilon) from the weighted counts of the runs'
+        indices, each the run's half times (epsteps + 2) plus the index of its
+        first accepting epsilon
+        """
+        n_eps = self.epsteps + 1
+        counts = np.bincount(index, weights = weights, minlength = 2 * (n_eps + 1))
+        counts = counts.reshape(2, n_eps + 1)
+        totals = np.sum(counts, axis = 1)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return(np.cumsum(counts[:, 0:n_eps], axis = 1) / totals[:, None])
+
+    def saveSplitEvidences(self, file_name, label, bootstraps = _DEFAULT_BOOTSTRAPS,
+                           seed = None, delimiter = ","):
+        """
+        Save the comparison from splitEvidences() to the file (CSV format by
+        default) as a long table, with one row per metric and epsilon giving
+        each half's evidence and bootstrap band (with columns named after the
+        label's values) and their difference and its band. Returns the
+        comparison, so it can be plotted with plotSplitComparison().
+        """
+        result = self.splitEvidences(label, bootstraps, seed)
+        (values, evidences, differences, bands, diff_bands) = result
+        names = self.headers + ['joint']
+        n_eps = self.epsteps + 1
+        table = {'metric': np.repeat(names, n_eps),
+                 'epsilon': np.tile(np.array(self.epsilons), len(names))}
+        columns = ['metric', 'epsilon']
+        for h in range(2):
+            for (prefix, data) in [('evidence', evidences[:, h]), ('lower', bands[0, :, h]),
+                                   ('upper', bands[1, :, h])]:
+                columns.append('%s_%s'%(prefix, values[h]))
+                table[columns[-1]] = data.ravel()
+        table['difference'] = differences.ravel()
+        table['difference_lower'] = diff_bands[0].ravel()
+        table['difference_upper'] = diff_bands[1].ravel()
+        columns.extend(['difference', 'difference_lower', 'difference_upper'])
+        pd.DataFrame(table, columns = columns).to_csv(self.mkname(file_name),
+                                                      sep = delimiter, index = False)
+        return(result)
+
+    def splitSamples(self, label):
+        """
+        Return the accepted samples (see acceptedSamples()) divided between the
+        halves of a split sample, as a list of (label, [(samples, weights) for
+        each half]) tuples, and the values of the label
+        """
+        (values, halves) = self.splitHalves(label)
+        split = []
+        for (sample_label, samples, weights) in self.acceptedSamples():
+            half = np.searchsorted(values, samples[label].to_numpy())
+            parts = []
+            for h in range(2):
+                parts.append((samples[half == h],
+                              None if weights is None else np.asarray(weights)[half == h]))
+            split.append((sample_label, parts))
+        return(split, values)
+
+    def splitTests(self, label):
+        """
+        Test whether the two halves of a split sample give the same posteriors.
+        For each accepted sample (see acceptedSamples()) and dynamic
+        parameter, the two-sample Kolmogorov-Smirnov statistic is the largest
+        difference between the halves' (weighted) cumulative distributions of
+        the parameter, computed from one sort of the sample. Its p-value uses
+        the asymptotic Kolmogorov distribution with Stephens' correction, with
+        effective sample sizes (see effectiveSampleSizes()) in place of the
+        numbers of runs if the runs are weighted.
+
+        Returns a data frame with one row per sample and parameter, giving the
+        number of runs, effective sample size and posterior mean of each half
+        (columns named after the label's values), the statistic and p-value.
+        """
+        from scipy import special
+        (split, values) = self.splitSamples(label)
+        rows = []
+        for (sample_label, parts) in split:
+            for k in range(len(self.params)):
+                row = [sample_label, self.params[k]]
+                x = np.concatenate([parts[h][0][self.params[k]].to_numpy(dtype = float)
+                                    for h in range(2)])
+                w = np.concatenate([np.ones(len(parts[h][0])) if parts[h][1] is None
+                                    else parts[h][1] for h in range(2)])
+                first = np.arange(len(x)) < len(parts[0][0])
+                w_half = [np.where(first, w, 0.0), np.where(first, 0.0, w)]
+                ess = [0.0, 0.0]
+                for h in range(2):
+                    total = np.sum(w_half[h])
+                    squares = np.sum(w_half[h] * w_half[h])
+                    ess[h] = total * total / squares if squares > 0 else 0.0
+                    mean = np.sum(w_half[h] * x) / total if total > 0 else np.nan
+                    row.extend([len(parts[h][0]), ess[h], mean])
+                if ess[0] > 0 and ess[1] > 0:
+                    order = np.argsort(x, kind = 'mergesort')
+                    cdfs = [np.cumsum(w_half[h][order]) / np.sum(w_half[h]) for h in range(2)]
+                    # Only compare the distributions after the last of any tied values
+                    last = np.append(x[order][1:] != x[order][:-1], True)
+                    statistic = np.max(np.fabs(cdfs[0] - cdfs[1])[last])
+                    n_eff = np.sqrt(ess[0] * ess[1] / (ess[0] + ess[1]))
+                    p_value = special.kolmogorov((n_eff + 0.12 + 0.11 / n_eff) * statistic)
+                else:
+                    statistic = np.nan
+                    p_value = np.nan
+                rows.append(row + [statistic, p_value])
+        columns = ['sample', 'parameter']
+        for h in range(2):
+            columns.extend(['%s_%s'%(stat, values[h]) for stat in ['runs', 'ess', 'mean']])
+        return(pd.DataFrame(rows, columns = columns + ['statistic', 'p_value']))
+
+    def saveSplitTests(self, file_name, label, delimiter = ","):
+        """
+        Save the tests from splitTests() to the file (CSV format by default)
+        """
+        self.splitTests(label).to_csv(self.mkname(file_name), sep = delimiter, index = False)
+
+    def plotSplitComparison(self, file_stem, suffix, label, result = None,
+                            line_colours = [], legend_pos = _DEFAULT_LEGEND_POS,
+                            font_size = _DEFAULT_FONT_SIZE):
+        """
+        Plot the comparison of the halves of a split sample: each metric's
+        evidence curves for the two halves (solid and dashed) with their
+        bootstrap bands to file_stem_evidence.suffix, their differences with
+        bands to file_stem_difference.suffix, and histograms of each accepted
+        sample's posteriors for the two halves to
+        file_stem_posterior_sample_parameter.suffix. The result of
+        splitEvidences() (or saveSplitEvidences()) can be given, or it is
+        computed with the defaults.
+        """
+        if line_colours == []:
+            line_colours = _DEFAULT_LINE_COLOURS
+        if result is None:
+            result = self.splitEvidences(label)
+        (values, evidences, differences, bands, diff_bands) = result
+        labels = ['Metric %i (%s)'%(j + 1, self.disp_metrics[j])
+                  for j in range(self.n_metrics)] + ['All metrics']
+        x = np.array(self.epsilons)
+        series = []
+        shading = []
+        diff_series = []
+        diff_shading = []
+        for j in range(len(labels)):
+            for h in range(2):
+                series.append((x, evidences[j, h], '%s, %s = %s'%(labels[j], label, values[h]),
+                               line_colours[j], [_DEFAULT_LINE_STYLE, '--'][h]))
+                shading.append((x, bands[0, j, h], bands[1, j, h], line_colours[j]))
+            diff_series.append((x, differences[j], labels[j], line_colours[j],
+                                _DEFAULT_LINE_STYLE))
+            diff_shading.append((x, diff_bands[0, j], diff_bands[1, j], line_colours[j]))
+        tasks = [('lines', [self.mkname('%s_evidence.%s'%(file_stem, suffix)), series,
+                            _DEFAULT_EP_LABEL, _DEFAULT_EVIDENCE_LABEL, legend_pos, font_size,
+                            'Split sample evidence', False, None, shading]),
+                 ('lines', [self.mkname('%s_difference.%s'%(file_stem, suffix)), diff_series,
+                            _DEFAULT_EP_LABEL, 'Difference in evidence (%s = %s - %s)'
+                            %(label, values[0], values[1]), legend_pos, font_size,
+                            'Split sample evidence difference', False, None, diff_shading])]
+        (split, values) = self.splitSamples(label)
+        for i in range(len(split)):
+            (sample_label, parts) = split[i]
+            if min(len(parts[0][0]), len(parts[1][0])) <= len(self.params):
+                continue
+            for k in range(len(self.params)):
+                name = self.mkname('%s_posterior_%d_%s.%s'%(file_stem, i + 1, self.params[k],
+                                                             suffix))
+                hist = [(parts[h][0][self.params[k]].to_numpy(dtype = float), parts[h][1],
+                         '%s = %s'%(label, values[h]), line_colours[h]) for h in range(2)]
+                tasks.append(('histograms', [name, hist, 50, '%s: %s'%(sample_label,
+                                                                       self.disp_params[k]),
+                                             self.disp_params[k], _DEFAULT_EVIDENCE_LABEL,
+                                             font_size]))
+        self.drawFigures(tasks)
+
+    def acceptanceProbabilities(self, j, epsilon = None):
+        """
+        Return the proportion of each parameter set's runs that are within
+        epsilon of the target for metric j, as an array indexed by parameter
+        set, or (if epsilon is None) by parameter set and epsilon. The runs'
+        first accepting epsilons are counted per set and accumulated.
+        """
+        (groups, n_groups) = self.parameterSets()
+        sizes = np.bincount(groups, minlength = n_groups)
+        if epsilon is not None:
+            dist = np.fabs(self.targets[self.headers[j]].to_numpy(dtype = float))
+            accepted = np.bincount(groups, weights = (dist < epsilon), minlength = n_groups)
+            return(accepted / sizes)
+        n_eps = self.epsteps + 1
+        first = self.firstEpsilons(j)
+        counts = np.bincount(groups * (n_eps + 1) + first,
+                             minlength = n_groups * (n_eps + 1))
+        counts = counts.reshape(n_groups, n_eps + 1)
+        return(np.cumsum(counts[:, 0:n_eps], axis = 1) / (1.0 * sizes[:, None]))
+
+    def firstEpsilons(self, j = None):
+        """
+        Return the index of the first (smallest) epsilon at which each run is
+        accepted for metric j, or for all the metrics jointly if j is None.
+        Runs never accepted get index epsteps + 1, so a cumulative sum of
+        counts of these indices gives the number accepted at each epsilon.
+        """
+        if j is None:
+            dist = np.max(self.distanceMatrix(), axis = 1)
+        else:
+            dist = np.fabs(self.targets[self.headers[j]].to_numpy(dtype = float))
+        return(np.searchsorted(np.array(self.epsilons), dist, side = 'right'))
+
+    def parameterCounts(self, bins):
+        """
+        Return a list of bin edges, a list of cumulative counts and a list of
+        total counts for each dynamic parameter. The cumulative counts are an
+        array indexed by metric (with all the metrics jointly last), parameter
+        bin and epsilon, giving the (weighted) number of runs in the bin
+        accepted at each epsilon; the totals are indexed by metric and bin.
+        Bins span the parameter's minimum and maximum in the parameter file.
+        Each parameter takes one bincount over its bins, the metrics and the
+        runs' first accepting epsilons -- in effect a counting sort of the runs
+        by distance -- followed by a cumulative sum over epsilon.
+        """
+        n_eps = self.epsteps + 1
+        n_cols = self.n_metrics + 1
+        first = np.array([self.firstEpsilons(j) for j in range(self.n_metrics)]
+                         + [self.firstEpsilons()])
+        if self.weights is None:
+            weights = np.ones(self.n_runs)
+        else:
+            weights = self.weights
+        all_edges = []
+        all_counts = []
+        all_totals = []
+        for k in range(len(self.params)):
+            edges = np.linspace(self.param_minima[k], self.param_maxima[k], bins + 1)
+            values = self.df[self.params[k]].to_numpy(dtype = float)
+            binno = np.clip(np.searchsorted(edges, values, side = 'right') - 1, 0, bins - 1)
+            index = ((np.arange(n_cols)[:, None] * bins + binno[None, :]) * (n_eps + 1)
+                     + first)
+            counts = np.bincount(index.ravel(), weights = np.tile(weights, n_cols),
+                                 minlength = n_cols * bins * (n_eps + 1))
+            counts = counts.reshape(n_cols, bins, n_eps + 1)
+            all_edges.append(edges)
+            all_counts.append(np.cumsum(counts[:, :, 0:n_eps], axis = 2))
+            all_totals.append(np.sum(counts, axis = 2))
+        return(all_edges, all_counts, all_totals)
+
+    def parameterProfiles(self, bins = _DEFAULT_PROFILE_BINS):
+        """
+        Return a list of bin edges and a list of conditional evidences for each
+        dynamic parameter. The evidences are an array indexed by metric (with
+        the joint evidence of all the metrics last), parameter bin and epsilon,
+        giving the (weighted) proportion of runs in the bin accepted at each
+        epsilon. Empty bins have NaN evidence.
+        """
+        (all_edges, all_counts, all_totals) = self.parameterCounts(bins)
+        all_evidences = []
+        for k in range(len(self.params)):
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                all_evidences.append(all_counts[k] / all_totals[k][:, :, None])
+        return(all_edges, all_evidences)
+
+    def posteriorCube(self, bins = _DEFAULT_CUBE_BINS):
+        """
+        Return the bin edges (indexed by dynamic parameter and edge) and the
+        posterior cube: the (weighted) histogram counts of each dynamic
+        parameter's accepted runs at every epsilon, as an array indexed by
+        parameter, metric (with all the metrics jointly last), epsilon and bin.
+        """
+        (all_edges, all_counts, all_totals) = self.parameterCounts(bins)
+        cube = np.zeros((len(self.params), self.n_metrics + 1, self.epsteps + 1, bins))
+        for k in range(len(self.params)):
+            cube[k] = np.transpose(all_counts[k], (0, 2, 1))
+        return(np.array(all_edges).reshape(len(self.params), bins + 1), cube)
+
+    def savePosteriorCube(self, file_name, bins = _DEFAULT_CUBE_BINS):
+        """
+        Save the posterior cube to a compressed numpy (.npz) file, with the bin
+        edges, epsilons and names needed to plot it with plotPosteriorCube()
+        """
+        (edges, cube) = self.posteriorCube(bins)
+        self.writeCube(file_name, edges, cube)
 
-        for i in range(epsteps + 1):
+    def writeCube(self, file_name, edges, cube):
+        """
+        Write a posterior cube (from posteriorCube() or emulate()) and its bin
+        edges to a compressed numpy (.npz) file for plotPosteriorCube()
+        """
+        np.savez_compressed(self.mkname(file_name), cube = cube, edges = edges,
+                            epsilons = np.array(self.epsilons),
+                            params = np.array(self.params),
+                            disp_params = np.array(self.disp_params),
+                            metrics = np.array(self.headers + ['joint']),
+                            disp_metrics = np.array(['Metric %i (%s)'%(j + 1, self.disp_metrics[j])
+                                                     for j in range(self.n_metrics)]
+                                                    + ['All metrics']))
+
+    @staticmethod
+    def plotPosteriorCube(cube_file, file_stem, suffix, panels = _DEFAULT_CUBE_PANELS,
+                          line_colours = [], font_size = _DEFAULT_FONT_SIZE,
+                          processes = 1):
+        """
+        Plot a posterior cube saved by savePosteriorCube() as small multiples,
+        one file per parameter named file_stem_parameter.suffix, with a panel
+        for each of (up to) panels epsilons evenly spaced on the grid, each
+        showing the posterior density of every metric and all jointly. Only
+        the cube file is needed, not the run data. The parameters' figures are
+        drawn in parallel if processes is more than one.
+        """
+        if line_colours == []:
+            line_colours = _DEFAULT_LINE_COLOURS
+        data = np.load(cube_file)
+        epsilons = data['epsilons']
+        n_panels = min(panels, len(epsilons) - 1)
+        chosen = np.unique(np.linspace(1, len(epsilons) - 1, n_panels).astype(int))
+        tasks = [('smallMultiples', [BruteABC.mkname('%s_%s.%s'%(file_stem, data['params'][k],
+                                                                 suffix)),
+                                     data['edges'][k], data['cube'][k], epsilons, chosen,
+                                     data['disp_metrics'],
+                                     'Posterior by epsilon: %s'%(data['disp_params'][k]),
+                                     line_colours, _DEFAULT_LINE_STYLE, font_size])
+                 for k in range(len(data['params']))]
+        PhaseProfile.render(tasks, processes)
+
+    def posteriorSummaries(self):
+        """
+        Return summary statistics of the posterior of each dynamic parameter
+        at every epsilon, for each metric and all the metrics jointly, as an
+        array indexed by parameter, metric (joint last), epsilon and statistic
+        (in the order of _SUMMARY_STATS): the number of runs accepted, the
+        (weighted) mean and standard deviation, the 5, 25, 50, 75 and 95%
+        quantiles (inverse CDF, so always one of the run values) and the
+        shortest interval holding 90% of the weight (searched over
+        _HPD_STEPS + 1 lower tail probabilities). The accepted runs at each
+        epsilon are those at the previous epsilon plus those first accepted
+        at it, so the means come from cumulative sums in order of first
+        accepting epsilon, and the quantiles from a WeightTree to which each
+        epsilon's runs are added in turn. Statistics are NaN where no runs are
+        accepted. With regression adjustment on (see setAdjustment()), the
+        statistics are of the adjusted parameters (see adjustedSummaries()).
+        """
+        n_eps = self.epsteps + 1
+        n_cols = self.n_metrics + 1
+        if self.weights is None:
+            weights = np.ones(self.n_runs)
+        else:
+            weights = np.asarray(self.weights, dtype = float)
+        tails = np.linspace(0.0, 1.0 - _SUMMARY_HPD, _HPD_STEPS + 1)
+        probs = np.concatenate((_SUMMARY_QUANTILES, tails, tails + _SUMMARY_HPD))
+        n_q = len(_SUMMARY_QUANTILES)
+        summaries = np.full((len(self.params), n_cols, n_eps, len(_SUMMARY_STATS)), np.nan)
+        firsts = [self.firstEpsilons(j) for j in range(self.n_metrics)] + [self.firstEpsilons()]
+        if self.adjust:
+            return(self.adjustedSummaries(firsts, weights, probs, summaries))
+        for k in range(len(self.params)):
+            values = self.df[self.params[k]].to_numpy(dtype = float)
+            byvalue = np.argsort(values, kind = 'mergesort')
+            sorted_values = values[byvalue]
+            rank = np.empty(self.n_runs, dtype = int)
+            rank[byvalue] = np.arange(1, self.n_runs + 1)
+            shift = np.mean(values)
+            for j in range(n_cols):
+                first = firsts[j]
+                order = np.argsort(first, kind = 'mergesort')
+                ends = np.searchsorted(first[order], np.arange(n_eps), side = 'right')
+                w = weights[order]
+                x = values[order] - shift
+                cumw = np.concatenate(([0.0], np.cumsum(w)))[ends]
+                cumwx = np.concatenate(([0.0], np.cumsum(w * x)))[ends]
+                cumwxx = np.concatenate(([0.0], np.cumsum(w * x * x)))[ends]
+                tree = WeightTree(self.n_runs)
+                start = 0
+                for i in range(n_eps):
+                    tree.add(rank[order[start:ends[i]]], w[start:ends[i]])
+                    start = ends[i]
+                    if cumw[i] <= 0:
+                        continue
+                    mean = cumwx[i] / cumw[i]
+                    q = sorted_values[tree.select(probs * cumw[i]) - 1]
+                    widths = q[n_q + _HPD_STEPS + 1:] - q[n_q:n_q + _HPD_STEPS + 1]
+                    h = int(np.argmin(widths))
+                    summaries[k, j, i] = np.concatenate((
+                        [ends[i], mean + shift,
+                         np.sqrt(max(0.0, cumwxx[i] / cumw[i] - mean * mean))],
+                        q[0:n_q],
+                        [q[n_q + h], q[n_q + _HPD_STEPS + 1 + h]]))
+        return(summaries)
+
+    def adjustedSummaries(self, firsts, weights, probs, summaries):
+        """
+        Called from posteriorSummaries() when regression adjustment is on, this
+        method fills in and returns the summaries array for the adjusted
+        parameters, given each run's first accepting epsilon index by metric
+        (joint last), the run weights and the quantile probabilities. The
+        adjustment depends on the runs accepted, so each metric and epsilon
+        has its own regressionAdjustment() (one solve for all the
+        parameters), repeated only when more runs are accepted, and the
+        quantiles come from sorting the adjusted values rather than from a
+        WeightTree. The statistics are weighted by the adjusted sample's
+        weights (the kernel weights times the run weights).
+        """
+        n_q = len(_SUMMARY_QUANTILES)
+        for j in range(len(firsts)):
+            previous = 0
+            for i in range(self.epsteps + 1):
+                rows = np.nonzero(firsts[j] <= i)[0]
+                if len(rows) == 0:
+                    continue
+                if len(rows) == previous:
+                    summaries[:, j, i] = summaries[:, j, i - 1]
+                    continue
+                previous = len(rows)
+                (theta, kweights) = self.regressionAdjustment(
+                    rows, j if j < self.n_metrics else None, weights[rows])
+                total = np.sum(kweights)
+                if total <= 0:
+                    continue
+                targets = np.clip(probs * total, np.finfo(float).tiny, total * (1.0 - 1e-9))
+                for k in range(len(self.params)):
+                    order = np.argsort(theta[:, k], kind = 'mergesort')
+                    values = theta[order, k]
+                    cumw = np.cumsum(kweights[order])
+                    q = values[np.minimum(np.searchsorted(cumw, targets, side = 'left'),
+                                          len(values) - 1)]
+                    widths = q[n_q + _HPD_STEPS + 1:] - q[n_q:n_q + _HPD_STEPS + 1]
+                    h = int(np.argmin(widths))
+                    mean = np.sum(kweights * theta[:, k]) / total
+                    var = np.sum(kweights * (theta[:, k] - mean) ** 2) / total
+                    summaries[k, j, i] = np.concatenate((
+                        [len(rows), mean, np.sqrt(max(0.0, var))],
+                        q[0:n_q],
+                        [q[n_q + h], q[n_q + _HPD_STEPS + 1 + h]]))
+        return(summaries)
+
+    def saveSummaries(self, file_name, delimiter = ","):
+        """
+        Save the posterior summaries from posteriorSummaries() to the file
+        (CSV format by default) as a long table, with one row per parameter,
+        metric and epsilon, and one column per statistic. The parameters are
+        regression adjusted if adjustment is on.
+        """
+        summaries = self.posteriorSummaries()
+        names = self.headers + ['joint']
+        n_eps = self.epsteps + 1
+        table = pd.DataFrame(summaries.reshape(-1, len(_SUMMARY_STATS)),
+                             columns = _SUMMARY_STATS)
+        table['runs'] = table['runs'].fillna(0).astype(int)
+        table.insert(0, 'parameter', np.repeat(self.params, len(names) * n_eps))
+        table.insert(1, 'metric', np.tile(np.repeat(names, n_eps), len(self.params)))
+        table.insert(2, 'epsilon', np.tile(np.array(self.epsilons),
+                                           len(self.params) * len(names)))
+        table.to_csv(self.mkname(file_name), sep = delimiter, index = False)
+
+    def saveParameterProfiles(self, file_name, bins = _DEFAULT_PROFILE_BINS,
+                              delimiter = ","):
+        """
+        Save the conditional evidences and evidence ratios from
+        parameterProfiles() to the file (CSV format by default) as a long
+        table, with one row per parameter, metric, bin and epsilon
+        """
+        (all_edges, all_evidences) = self.parameterProfiles(bins)
+        names = self.headers + ['joint']
+        epsilons = np.array(self.epsilons)
+        n_eps = self.epsteps + 1
+        tables = []
+        for k in range(len(self.params)):
+            edges = all_edges[k]
+            evidences = all_evidences[k]
+            n_rows = len(names) * bins * n_eps
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                evratio = np.where(epsilons > 0, evidences / epsilons, 0.0)
+            tables.append(pd.DataFrame({
+                'parameter': [self.params[k] for i in range(n_rows)],
+                'metric': np.repeat(names, bins * n_eps),
+                'lower': np.tile(np.repeat(edges[:-1], n_eps), len(names)),
+                'upper': np.tile(np.repeat(edges[1:], n_eps), len(names)),
+                'epsilon': np.tile(epsilons, len(names) * bins),
+                'evidence': evidences.ravel(),
+                'evratio': evratio.ravel()
+            }, columns = ['parameter', 'metric', 'lower', 'upper', 'epsilon',
+                          'evidence', 'evratio']))
+        pd.concat(tables).to_csv(self.mkname(file_name), sep = delimiter, index = False)
+
+    def plotParameterProfiles(self, file_stem, suffix, bins = _DEFAULT_PROFILE_BINS,
+                              ratio = False, line_colours = [],
+                              legend_pos = _DEFAULT_LEGEND_POS,
+                              y_label = _DEFAULT_EVIDENCE_LABEL,
+                              font_size = _DEFAULT_FONT_SIZE):
+        """
+        Plot the conditional evidence (or evidence ratio) at refeps against
+        each dynamic parameter, one line per metric and one for all the metrics
+        jointly, saving one graph per parameter to a file name composed as
+        file_stem_parameter.suffix
+        """
+        if line_colours == []:
+            line_colours = _DEFAULT_LINE_COLOURS
+        (all_edges, all_evidences) = self.parameterProfiles(bins)
+        i = int(np.argmin(np.fabs(np.array(self.epsilons) - self.refeps)))
+        labels = ['Metric %i (%s)'%(j + 1, self.disp_metrics[j])
+                  for j in range(self.n_metrics)] + ['All metrics']
+        tasks = []
+        for k in range(len(self.params)):
+            centres = 0.5 * (all_edges[k][:-1] + all_edges[k][1:])
+            series = []
+            for j in range(len(labels)):
+                data = all_evidences[k][j, :, i]
+                if ratio and self.epsilons[i] > 0:
+                    data = data / self.epsilons[i]
+                series.append((centres, data, labels[j], line_colours[j],
+                               (_DEFAULT_LINE_STYLE if j < self.n_metrics else '--')))
+            tasks.append(('lines', [self.mkname('%s_%s.%s'%(file_stem, self.params[k], suffix)),
+                                    series, self.disp_params[k], y_label, legend_pos,
+                                    font_size, 'Evidence profile (epsilon = %g): %s'
+                                               %(self.epsilons[i], self.disp_params[k])]))
+        self.drawFigures(tasks)
+
+    def evidenceCurve(self, j, difima = None):
+        """
+        Return the evidence for metric j at each epsilon: the proportion of runs
+        (weighted, if weights have been set) with an absolute deviation from
+        the target less than epsilon times the range of the metric. Another
+        range (difima) can be given to get the evidence for a different
+        normalisation of the metric without revisiting the data, as only the
+        search bounds are rescaled.
+        """
+        if difima is None:
+            difima = self.difima[j]
+        bounds = np.array(self.epsilons) * difima
+        counts = np.searchsorted(self.absdevs[j], bounds, side = 'left')
+        if self.weights is None:
+            return(counts / (1.0 * self.n_runs))
+        return(self.cumweights[j][counts] / self.cumweights[j][-1])
+
+    def variantEvidences(self, variants, ratio = False):
+        """
+        Return an array of evidences (or evidence ratios) indexed by variant,
+        metric and epsilon, for a list of metric metadata variants (data frames
+        in the same format as the metrics file). The variants may differ from
+        the metrics used to create this object only in their minimum and
+        maximum columns, which change each metric's normalisation but not the
+        order of its deviations from the target.
+        """
+        result = np.zeros((len(variants), self.n_metrics, self.epsteps + 1))
+        for v in range(len(variants)):
+            difima = self.variantRanges(variants[v], v)
             for j in range(self.n_metrics):
-                self.evidences[j][i] \
-                    = sum(1.0 for val in 1.0 * np.array(self.df[self.headers[j]])
-                          if self.inEpsilonBox(val, self.epsilons[i], j)
-                          ) / (1.0 * len(self.df[self.headers[j]]))
-                if i > 0:
-                    self.evratio[j][i] = self.evidences[j][i] / self.epsilons[i]
-                self.moments[j] = self.moments[j] + self.evidences[j][i] * self.epsilons[i]
-                if self.evidences[j][i] > 0.0:
-                    self.logevidences[j][i] = np.log(self.evidences[j][i])
-                    self.logmoments[j] \
-                        = self.logmoments[j] + self.logevidences[j][i] * self.epsilons[i]
+                result[v][j] = self.evidenceCurve(j, difima[j])
+                if ratio:
+                    result[v][j][0] = 0.0
+                    result[v][j][1:] = result[v][j][1:] / np.array(self.epsilons[1:])
+        return(result)
+
+    def variantRanges(self, metrics, v = 0):
+        """
+        Called from variantEvidences(), this method checks a metric metadata
+        variant against the metrics used to create this object, and returns
+        the range (maximum - minimum) of each metric in the variant.
+        """
+        difima = [0.0 for j in range(self.n_metrics)]
+        names = [metrics['metric'][i] for i in range(len(metrics))]
+        for j in range(self.n_metrics):
+            if names.count(self.headers[j]) != 1:
+                sys.stderr.write("Metric %d (%s) does not appear exactly once in "
+                                 "variant %d\n"%(j, self.headers[j], v))
+                sys.exit(1)
+            i = names.index(self.headers[j])
+            calibval = metrics['target'][i]
+            minimum = metrics['minimum'][i]
+            maximum = metrics['maximum'][i]
+            if metrics['operator'][i] == "log":
+                calibval = np.log(calibval)
+                minimum = np.log(minimum)
+                maximum = np.log(maximum)
+            if calibval != self.calibvals[j]:
+                sys.stderr.write("Metric %d (%s): variant %d changes the "
+                                 "calibration value or operator\n"%(j, self.headers[j], v))
+                sys.exit(1)
+            if minimum > calibval or calibval > maximum:
+                sys.stderr.write("Metric %d (%s): variant %d calibration value "
+                                 "(%g) is not in [%g, %g]\n"%(j, self.headers[j],
+                                 v, calibval, minimum, maximum))
+                sys.exit(1)
+            difima[j] = maximum - minimum
+        return(difima)
+
+    def saveVariantEvidences(self, file_name, variants, names, ratio = False,
+                             delimiter = ","):
+        """
+        Save the evidences (or evidence ratios) for each metric metadata
+        variant to the file (CSV format by default), with one block of rows
+        per variant labelled by the corresponding entry in names
+        """
+        evidences = self.variantEvidences(variants, ratio)
+        fp = open(self.mkname(file_name), "w")
+        fp.write("variant" + delimiter + "epsilon" + delimiter
+                 + delimiter.join(self.headers) + "\n")
+        for v in range(len(variants)):
+            for i in range(self.epsteps + 1):
+                fp.write(names[v] + delimiter + "%.18e"%(self.epsilons[i]) + delimiter
+                         + delimiter.join(["%.18e"%(evidences[v][j][i])
+                                           for j in range(self.n_metrics)]) + "\n")
+        fp.close()
+
+    def targetEvidences(self, targets, ratio = False):
+        """
+        Return an array of evidences (or evidence ratios) indexed by target,
+        metric and epsilon, for a matrix of calibration values with one row per
+        target set and one column per metric (in the order of the metrics
+        file, and before any log operator is applied). An extra last metric
+        gives the joint evidence: the proportion of runs within epsilon of the
+        target on all the metrics at once. The deviations from all the targets
+        are computed together, a chunk of runs at a time to bound the memory
+        used, and each run's first accepting epsilon is counted so that the
+        evidence curves are cumulative sums of the counts.
+        """
+        targets = np.array(targets, dtype = float).reshape(-1, self.n_metrics)
+        for j in range(self.n_metrics):
+            if self.operators[j] == "log":
+                targets[:, j] = np.log(targets[:, j])
+            outside = (targets[:, j] < self.minima[j]) | (targets[:, j] > self.maxima[j])
+            if np.any(outside):
+                sys.stderr.write("Warning: metric %d (%s) has %d target(s) outside "
+                                 "[%g, %g]\n"%(j, self.headers[j], np.sum(outside),
+                                 self.minima[j], self.maxima[j]))
+
+        n_targets = len(targets)
+        n_cols = self.n_metrics + 1
+        n_eps = self.epsteps + 1
+        values = self.df[self.headers].to_numpy(dtype = float)
+        difima = np.array(self.difima, dtype = float)
+        epsilons = np.array(self.epsilons)
+        offsets = (np.arange(n_targets * n_cols) * (n_eps + 1)).reshape(n_targets, n_cols)
+        counts = np.zeros(n_targets * n_cols * (n_eps + 1))
+
+        step = max(1, _TARGET_CHUNK // (n_targets * n_cols))
+        for start in range(0, self.n_runs, step):
+            block = values[start:start + step]
+            devs = np.fabs(block[:, None, :] - targets[None, :, :]) / difima
+            devs = np.concatenate((devs, np.max(devs, axis = 2)[:, :, None]), axis = 2)
+            first = np.searchsorted(epsilons, devs, side = 'right')
+            if self.weights is None:
+                counts += np.bincount((offsets[None, :, :] + first).ravel(),
+                                      minlength = len(counts))
+            else:
+                weights = np.broadcast_to(self.weights[start:start + step, None, None],
+                                          first.shape)
+                counts += np.bincount((offsets[None, :, :] + first).ravel(),
+                                      weights = weights.ravel(), minlength = len(counts))
+
+        counts = counts.reshape(n_targets, n_cols, n_eps + 1)
+        if self.weights is None:
+            result = np.cumsum(counts[:, :, 0:n_eps], axis = 2) / (1.0 * self.n_runs)
+        else:
+            result = np.cumsum(counts[:, :, 0:n_eps], axis = 2) / np.sum(self.weights)
+        if ratio:
+            result[:, :, 0] = 0.0
+            result[:, :, 1:] = result[:, :, 1:] / epsilons[1:]
+        return(result)
+
+    def saveTargetEvidences(self, file_name, targets, names, ratio = False,
+                            delimiter = ","):
+        """
+        Save the evidences (or evidence ratios) for each row of a matrix of
+        targets to the file (CSV format by default), with one block of rows
+        per target labelled by the corresponding entry in names, and a last
+        column for the joint evidence of all the metrics
+        """
+        evidences = self.targetEvidences(targets, ratio)
+        fp = open(self.mkname(file_name), "w")
+        fp.write("target" + delimiter + "epsilon" + delimiter
+                 + delimiter.join(self.headers) + delimiter + "joint\n")
+        for t in range(len(names)):
+            for i in range(self.epsteps + 1):
+                fp.write(names[t] + delimiter + "%.18e"%(self.epsilons[i]) + delimiter
+                         + delimiter.join(["%.18e"%(evidences[t][j][i])
+                                           for j in range(self.n_metrics + 1)]) + "\n")
+        fp.close()
+
+    def distanceMatrix(self):
+        """
+        Return an array with one row per run and one column per metric, giving
+        the absolute normalised distance of the run from the metric's target
+        (the distance the evidence curves compare with epsilon)
+        """
+        return(np.fabs(self.targets[self.headers].to_numpy(dtype = float)))
+
+    def paretoLayers(self, k = None):
+        """
+        Return the Pareto layer (1 for the non-dominated runs, 2 for those
+        non-dominated once the first layer is removed, and so on) of each run,
+        using the normalised distances of all the metrics. If k is given, runs
+        beyond the first k layers are all given layer k + 1. The result is
+        cached, as it is needed by each of the plotting methods.
+        """
+        if self.layers is None or self.layers_k != k:
+            self.layers = Pareto.layers(self.distanceMatrix(), k)
+            self.layers_k = k
+        return(self.layers)
+
+    def nearestRuns(self, k, j = None):
+        """
+        Return the positions of the k runs closest to the target for metric j,
+        or for all the metrics jointly if j is None. For a single metric this is
+        a partial selection, taking linear time. Jointly, the runs are found
+        with a KD-tree over the normalised deviations of all the metrics, using
+        the largest deviation as the distance, so that the runs found are those
+        in the smallest epsilon box containing k runs. The tree is cached.
+        """
+        k = int(min(max(k, 0), self.n_runs))
+        if k == 0:
+            return(np.zeros(0, dtype = int))
+        if j is not None:
+            dist = np.fabs(self.targets[self.headers[j]].to_numpy(dtype = float))
+            dist[np.isnan(dist)] = np.inf
+            return(np.argpartition(dist, k - 1)[0:k])
+
+        if self.kdtree is None:
+            from scipy.spatial import cKDTree
+            devs = self.targets[self.headers].to_numpy(dtype = float)
+            self.kdtree_rows = np.flatnonzero(np.all(np.isfinite(devs), axis = 1))
+            self.kdtree = cKDTree(devs[self.kdtree_rows])
+        k = min(k, len(self.kdtree_rows))
+        if k == 0:
+            return(np.zeros(0, dtype = int))
+        (dist, rows) = self.kdtree.query(np.zeros(self.n_metrics), k = k, p = np.inf)
+        return(self.kdtree_rows[np.atleast_1d(rows)])
+
+    def setAcceptance(self, rule, value = None):
+        """
+        Set the rule used to choose the runs accepted into the posterior by
+        trianglePlots() and posteriorPlots(). The rules are 'epsilon' (runs
+        within refeps of the target for each metric separately, the default),
+        'pareto' (runs in the first value Pareto layers of all metrics
+        jointly, a threshold-free alternative to an epsilon box), 'nearest'
+        (the value runs closest to the target) and 'quantile' (the closest
+        value percent of the runs). The last two give the same sample size for
+        each metric, and for all the metrics jointly.
+        """
+        if rule not in _ACCEPTANCE_RULES:
+            sys.stderr.write("Acceptance rule \"%s\" not recognized (use one "
+                             "of %s)\n"%(rule, ", ".join(_ACCEPTANCE_RULES)))
+            sys.exit(1)
+        if value is None:
+            if rule == 'pareto':
+                value = _DEFAULT_PARETO_LAYERS
+            elif rule == 'nearest':
+                value = _DEFAULT_NEAREST
+            elif rule == 'quantile':
+                value = _DEFAULT_QUANTILE
+        self.accept = rule
+        self.accept_value = value
+
+    def acceptedSamples(self):
+        """
+        Return a list of (label, samples, weights) tuples, where samples are the
+        rows of the data accepted under the acceptance rule, and weights their
+        run weights (None if weights have not been set). With regression
+        adjustment on (see setAdjustment()), the samples' parameters are
+        adjusted and the weights include kernel weights. The 'epsilon' rule
+        gives one tuple per metric; the 'pareto' rule one for all the metrics;
+        and the 'nearest' and 'quantile' rules one per metric and one for all
+        the metrics.
+        """
+        self.computeScales()
+        if self.accept == 'pareto':
+            k = int(self.accept_value)
+            layers = self.paretoLayers(k)
+            return([self.sample('Pareto layers 1-%d'%(k), layers <= k)])
+
+        if self.accept == 'nearest' or self.accept == 'quantile':
+            if self.accept == 'nearest':
+                k = int(self.accept_value)
+                desc = '%d nearest'%(k)
+            else:
+                k = int(np.ceil(self.accept_value * self.n_runs / 100.0))
+                desc = 'best %g%%'%(self.accept_value)
+            samples = [self.sample('Metric %i (%s), %s'%(j + 1, self.disp_metrics[j], desc),
+                                   self.nearestRuns(k, j), j)
+                       for j in range(self.n_metrics)]
+            samples.append(self.sample('All metrics, %s'%(desc), self.nearestRuns(k)))
+            return(samples)
+
+        samples = []
+        for j in range(self.n_metrics):
+            accepted = (np.fabs(self.targets[self.headers[j]].to_numpy(dtype = float))
+                        < self.refeps * self.initscales[j] * self.logoptscales[j])
+            samples.append(self.sample('Metric %i (%s)'%(j + 1, self.disp_metrics[j]),
+                                       accepted, j))
+        return(samples)
 
-    def inEpsilonBox(self, value, epsilon, metric):
+    def sample(self, label, rows, j = None):
         """
-        Return whether a value is within an epsilon of a metric
+        Called from acceptedSamples(), this method returns a (label, samples,
+        weights) tuple for the rows given by position or boolean array,
+        accepted on metric j (or all the metrics jointly if j is None). If
+        regression adjustment is on, the samples' parameters are adjusted and
+        the weights include the kernel weights (see regressionAdjustment()).
         """
-        return (np.fabs((value - self.calibvals[metric]) / self.difima[metric])
-                < epsilon)
+        samples = self.df.iloc[rows]
+        if self.weights is None:
+            weights = None
+        else:
+            weights = self.weights[rows]
+        if self.adjust and len(samples) > 0:
+            (adjusted, weights) = self.regressionAdjustment(rows, j, weights)
+            samples = samples.copy()
+            samples[self.params] = adjusted
+            label = '%s, adjusted'%(label)
+        return((label, samples, weights))
+
+    def setAdjustment(self, adjust = True):
+        """
+        Set whether the accepted samples used by trianglePlots(),
+        posteriorPlots(), kdePosteriors() and saveSamples(), and the runs
+        accepted at each epsilon in posteriorSummaries(), have their
+        parameters adjusted by local-linear regression
+        """
+        self.adjust = adjust
+
+    def regressionAdjustment(self, rows, j = None, weights = None):
+        """
+        Return the parameters of the accepted rows (given by position or
+        boolean array) after the local-linear regression adjustment of
+        Beaumont, Zhang and Balding (2002, Genetics 162: 2025-2035), and the
+        weights of the adjusted sample. The regressors are the normalised
+        deviations of metric j from its target (or all the metrics if j is
+        None). Each row is weighted by the Epanechnikov kernel of its distance
+        from the target, with bandwidth the largest distance accepted, times
+        its run weight (if any). All the dynamic parameters are fitted at once
+        by one weighted least squares solve, and each row's parameters are
+        then moved along the fitted slopes to where its metrics would match
+        the targets. Adjusted values may fall outside the parameters' ranges.
+        Rows with missing metrics, and samples with no kernel weight, are not
+        adjusted.
+        """
+        if j is None:
+            x = self.targets[self.headers].to_numpy(dtype = float)[rows]
+        else:
+            x = self.targets[self.headers[j]].to_numpy(dtype = float)[rows][:, None]
+        theta = self.df[self.params].to_numpy(dtype = float)[rows]
+        if weights is None:
+            weights = np.ones(len(theta))
+        finite = np.all(np.isfinite(x), axis = 1)
+        x = np.where(finite[:, None], x, 0.0)
+        dist = np.max(np.fabs(x), axis = 1)
+        bandwidth = np.max(dist)
+        if bandwidth > 0:
+            kernel = np.where(finite, 1.0 - (dist / bandwidth) ** 2, 0.0)
+        else:
+            kernel = finite.astype(float)
+        kweights = kernel * weights
+        if np.sum(kweights) <= 0:
+            return(theta, weights)
+        design = np.column_stack((np.ones(len(theta)), x))
+        root = np.sqrt(kweights)[:, None]
+        beta = np.linalg.lstsq(root * design, root * theta, rcond = None)[0]
+        return(theta - x.dot(beta[1:]), kweights)
+
+    def saveSamples(self, file_name, delimiter = ","):
+        """
+        Save the accepted samples (regression adjusted if adjustment is on) to
+        the file (CSV format by default), with one row per run in each sample,
+        giving the sample label, the run's row in the data, its dynamic
+        parameters and its weight
+        """
+        tables = []
+        for (label, postsamples, weights) in self.acceptedSamples():
+            table = pd.DataFrame(postsamples[self.params].to_numpy(dtype = float),
+                                 columns = self.params)
+            table.insert(0, 'sample', [label for i in range(len(table))])
+            table.insert(1, 'row', postsamples.index)
+            if weights is None:
+                table['weight'] = 1.0
+            else:
+                table['weight'] = weights
+            tables.append(table)
+        pd.concat(tables).to_csv(self.mkname(file_name), sep = delimiter, index = False)
 
     def saveEvidences(self, file_name, delimiter = ","):
         """
@@ -275,40 +1593,12 @@ class BruteABC:
         if scaled:
             self.computeScales()
 
-        for j in range(self.n_metrics):
-            xdata = self.getEpsilons(j, scaled, log)
-            # if scaled:
-            #     if log:
-            #         xdata = np.array(self.epsilons) / self.logoptscales[j]
-            #     else:       # not log
-            #         xdata = np.array(self.epsilons) / self.optscales[j]
-            # else:           # not scaled
-            #     xdata = np.array(self.epsilons)
-
-            data = self.getEvidences(j, log, ratio)
-            # if ratio:
-            #     if log:
-            #         data = np.log(self.evratio[j])
-            #     else:       # not log
-            #         data = self.evratio[j]
-            # else:           # not ratio
-            #     if log:
-            #         data = self.logevidences[j]
-            #     else:       # not log
-            #         data = self.evidences[j]
-
-            plt.plot(xdata, (data), linewidth = 2,
-                     linestyle = line_styles[j], color = line_colours[j],
-                     label = 'Metric %i (%s)'%(j + 1, self.disp_metrics[j]))
-        plt.xlabel(x_label)
-        plt.ylabel(y_label)
-        legend = plt.legend(loc = legend_pos, shadow = False, frameon = False,
-                            fontsize = font_size) #, markerfirst = False)
-        if not log:
-            plt.plot([0, 1], [1, 1], linestyle = 'dashed', color = '#000000')
-        plt.xlim([0, 1])
-        plt.savefig(self.mkname(image_file))
-        plt.close()
+        series = [(self.getEpsilons(j, scaled, log), self.getEvidences(j, log, ratio),
+                   'Metric %i (%s)'%(j + 1, self.disp_metrics[j]),
+                   line_colours[j], line_styles[j])
+                  for j in range(self.n_metrics)]
+        self.drawFigures([('lines', [self.mkname(image_file), series, x_label, y_label,
+                                     legend_pos, font_size, None, not log, [0, 1]])])
 
     def plotEvidence(self, png_file,
                      line_colours = [],
@@ -438,67 +1728,461 @@ class BruteABC:
             self.scales_computed = True
 
         if(not self.scales_computed):
+            from scipy import optimize as op
             for i in range(len(self.headers)):
                 self.initscales[i] = 1.0 * (max(np.fabs(self.df[self.headers[i]])))
 
             for j in range(self.n_metrics):
-                res = op.minimize_scalar(self.squareDiff, args = j)
-                self.optscales[j] = res.x
-                logres = op.minimize_scalar(self.logSquareDiff, args = j,
-                                            bounds = (_LOGRES_LOWER_BOUND,
-                                                      _LOGRES_UPPER_BOUND),
-                                            method = 'bounded')
-                self.logoptscales[j] = logres.x
+                with PhaseProfile.phase('scales', self.n_runs, self.headers[j]):
+                    res = op.minimize_scalar(self.squareDiff, args = j)
+                    self.optscales[j] = res.x
+                    logres = op.minimize_scalar(self.logSquareDiff, args = j,
+                                                bounds = (_LOGRES_LOWER_BOUND,
+                                                          _LOGRES_UPPER_BOUND),
+                                                method = 'bounded')
+                    self.logoptscales[j] = logres.x
         self.scales_computed = True
 
-    def trianglePlots(self, file_name):
+    def triangleHistograms(self, bins = _DEFAULT_TRIANGLE_BINS, processes = 1):
         """
-        Save triangle plots of the posteriors to the file_name.
+        Return the binned triangle plots of the accepted samples: the bin edges
+        (indexed by dynamic parameter and edge, spanning the minimum and maximum
+        in the parameter file), the sample labels, the number of runs in each
+        sample, the 1D histograms (indexed by sample, parameter and bin) and
+        the 2D histograms (indexed by sample, pair of parameters, and the bins
+        of the two parameters in the pair; see _binTriangle()). If processes is
+        more than one, the samples are binned in parallel.
         """
-        self.computeScales()
-        for j in range(self.n_metrics):
-#            postsamples = self.df[np.fabs(self.df[self.headers[j]])
-#                                  < self.refeps * self.initscales[j] * self.logoptscales[j] ]
-            postsamples = self.df[np.fabs(self.targets[self.headers[j]])
-                                  < self.refeps * self.initscales[j] * self.logoptscales[j]]
-            plotsamps = np.array(postsamples[self.params])[:, 0:len(self.params)]
-            if len(plotsamps[:, 0]) > len(self.params):
-                fig = triangle.corner(plotsamps, labels = self.params)
-                fig.savefig(self.mkname(file_name), dpi = 150)
-                plt.close()
-            else:
-                print "Number of valid samples (", len(plotsamps[:, 0]), \
-                ") for metric", j + 1, \
-                "is too small to make a plot, skipping....."
+        edges = np.array([np.linspace(self.param_minima[k], self.param_maxima[k], bins + 1)
+                          for k in range(len(self.params))]).reshape(len(self.params),
+                                                                     bins + 1)
+        samples = self.acceptedSamples()
+        tasks = [(postsamples[self.params].to_numpy(dtype = float), weights, edges)
+                 for (label, postsamples, weights) in samples]
+        if processes > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(processes, len(tasks)))
+            try:
+                binned = pool.map(_binTriangle, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            binned = [_binTriangle(task) for task in tasks]
+        labels = [label for (label, postsamples, weights) in samples]
+        counts = np.array([len(postsamples) for (label, postsamples, weights) in samples])
+        hist1 = np.array([h1 for (h1, h2) in binned])
+        hist2 = np.array([h2 for (h1, h2) in binned])
+        return(edges, labels, counts, hist1, hist2)
+
+    def saveTriangleHistograms(self, file_name, bins = _DEFAULT_TRIANGLE_BINS,
+                               processes = 1, binned = None):
+        """
+        Save the triangle plot histograms to a compressed numpy (.npz) file,
+        with the names needed to plot them with plotTriangleHistograms(). Pass
+        the result of triangleHistograms() as binned to avoid recomputing it.
+        """
+        if binned is None:
+            binned = self.triangleHistograms(bins, processes)
+        (edges, labels, counts, hist1, hist2) = binned
+        np.savez_compressed(self.mkname(file_name), edges = edges,
+                            labels = np.array(labels), counts = counts,
+                            hist1 = hist1, hist2 = hist2,
+                            params = np.array(self.params),
+                            disp_params = np.array(self.disp_params))
+
+    def trianglePlots(self, file_name, bins = _DEFAULT_TRIANGLE_BINS, processes = 1,
+                      hist_file = None):
+        """
+        Save triangle plots of the posteriors to the file_name, numbered from 1
+        if there is more than one sample accepted (e.g. one per metric). The
+        plots are drawn from histograms binned by triangleHistograms(), which
+        are also saved to hist_file if it is given.
+        """
+        binned = self.triangleHistograms(bins, processes)
+        if hist_file is not None:
+            self.saveTriangleHistograms(hist_file, binned = binned)
+        (edges, labels, counts, hist1, hist2) = binned
+        self.drawFigures(BruteABC.triangleFigures(file_name, edges, labels, counts,
+                                                  hist1, hist2, self.disp_params))
 
-    def posteriorPlots(self, file_stem, suffix, y_label = _DEFAULT_EVIDENCE_LABEL):
+    @staticmethod
+    def plotTriangleHistograms(hist_file, file_name, colour = _DEFAULT_LINE_COLOURS[0],
+                               font_size = _DEFAULT_FONT_SIZE, processes = 1):
         """
-        Save plots of the posteriors (as histograms), one per parameter
-        to a file name composed as file_stem_parameter.png
+        Save triangle plots from histograms saved by saveTriangleHistograms()
+        to the file_name, numbered as in trianglePlots(). Only the histogram
+        file is needed, not the run data. The figures are drawn in parallel if
+        processes is more than one.
         """
-        barcolours = [_DEFAULT_LINE_COLOURS[i] for i in range(self.n_metrics)]
-        self.computeScales()
-        for j in range(self.n_metrics):
-#            postsamples = self.df[np.fabs(self.df[self.headers[j]])
-#                                  < self.refeps * self.initscales[j] * self.logoptscales[j] ]
-            postsamples = self.df[np.fabs(self.targets[self.headers[j]])
-                                  < self.refeps * self.initscales[j] * self.logoptscales[j]]
-            plotsamps = np.array(postsamples[self.params])[:, 0:len(self.params)]
-            for k in range(len(self.params)):
-                plt.figure(k + 1)
-                if len(plotsamps[:, 0]) > len(self.params):
-                    plt.hist(plotsamps[:,k], 50,
-                             label = 'Metric %i (%s)'%(j + 1, self.disp_metrics[j]),
-                             alpha = 0.5, normed = True, color = barcolours[j])
+        data = np.load(hist_file)
+        PhaseProfile.render(BruteABC.triangleFigures(file_name, data['edges'], data['labels'],
+                                                     data['counts'], data['hist1'],
+                                                     data['hist2'], data['disp_params'],
+                                                     colour, font_size), processes)
 
+    @staticmethod
+    def triangleFigures(file_name, edges, labels, counts, hist1, hist2, disp_params,
+                        colour = _DEFAULT_LINE_COLOURS[0],
+                        font_size = _DEFAULT_FONT_SIZE):
+        """
+        Called from trianglePlots() and plotTriangleHistograms(), this method
+        returns figure tasks for abcplot.render() drawing a triangle plot for
+        each sample from its histograms: bars on the diagonal and shaded 2D
+        histograms below it. Samples with no more runs than parameters are
+        skipped.
+        """
+        n_params = len(disp_params)
+        (stem, suffix) = os.path.splitext(file_name)
+        tasks = []
+        for s in range(len(labels)):
+            if counts[s] <= n_params:
+                print("Number of valid samples (%d) for %s is too small to make "
+                      "a plot, skipping....."%(counts[s], labels[s]))
+                continue
+            if len(labels) > 1:
+                name = '%s_%d%s'%(stem, s + 1, suffix)
+            else:
+                name = file_name
+            tasks.append(('triangle', [BruteABC.mkname(name), edges, hist1[s], hist2[s],
+                                       disp_params, labels[s], colour, font_size]))
+        return(tasks)
+
+    def posteriorPlots(self, file_stem, suffix, y_label = _DEFAULT_EVIDENCE_LABEL,
+                       kde = False, cells = _DEFAULT_KDE_CELLS,
+                       rule = _DEFAULT_BANDWIDTH):
+        """
+        Save plots of the posteriors (as histograms, or kernel density
+        estimates from kdePosteriors() if kde is True), one per parameter
+        to a file name composed as file_stem_parameter.png
+        """
+        samples = self.acceptedSamples()
+        barcolours = [_DEFAULT_LINE_COLOURS[i] for i in range(len(samples))]
+        if kde:
+            (labels, centres, densities, pair_centres, pair_densities,
+             bandwidths) = self.kdePosteriors(cells, 0, rule)
+        plotted = [j for j in range(len(samples))
+                   if len(samples[j][1]) > len(self.params)]
+        tasks = []
         for k in range(len(self.params)):
-            plt.figure(k + 1)
-            plt.legend(loc = 'lower right', shadow = False, fontsize = _DEFAULT_FONT_SIZE,
-                       framealpha = 0.75)
-            plt.title('Posterior comparison: %s'%(self.disp_params[k]))
-            plt.xlabel(self.disp_params[k])
-            plt.ylabel(y_label)
-            plt.savefig(self.mkname('%s_%s.%s'%(file_stem, self.params[k], suffix)))
+            name = self.mkname('%s_%s.%s'%(file_stem, self.params[k], suffix))
+            title = 'Posterior comparison: %s'%(self.disp_params[k])
+            series = []
+            for j in plotted:
+                (label, postsamples, weights) = samples[j]
+                if kde:
+                    series.append((centres[k], densities[j, k], label, barcolours[j],
+                                   _DEFAULT_LINE_STYLE))
+                else:
+                    series.append((postsamples[self.params[k]].to_numpy(dtype = float),
+                                   weights, label, barcolours[j]))
+            if kde:
+                tasks.append(('lines', [name, series, self.disp_params[k], y_label,
+                                        'lower right', _DEFAULT_FONT_SIZE, title]))
+            else:
+                tasks.append(('histograms', [name, series, 50, title, self.disp_params[k],
+                                             y_label, _DEFAULT_FONT_SIZE]))
+        self.drawFigures(tasks)
+
+    def kdePosteriors(self, cells = _DEFAULT_KDE_CELLS,
+                      pair_cells = _DEFAULT_KDE_PAIR_CELLS, rule = _DEFAULT_BANDWIDTH):
+        """
+        Return Gaussian kernel density estimates of the posteriors of the
+        accepted samples, computed by KernelDensity with reflection at each
+        dynamic parameter's minimum and maximum in the parameter file. Returns
+        the sample labels; the cell centres (indexed by parameter and cell)
+        and densities (indexed by sample, parameter and cell) in 1D; the same
+        with pair_cells cells for each pair of parameters in 2D (the densities
+        indexed by sample, pair in the order of np.tril_indices(), cell of the
+        later parameter and cell of the earlier one); and the 1D bandwidths
+        (indexed by sample and parameter). Samples with fewer than two runs
+        have NaN densities. The rule is passed to KernelDensity.bandwidth().
+        """
+        n_params = len(self.params)
+        lower = np.array(self.param_minima, dtype = float)
+        upper = np.array(self.param_maxima, dtype = float)
+        (rows, cols) = np.tril_indices(n_params, -1)
+        samples = self.acceptedSamples()
+        n_samples = len(samples)
+        centres = [KernelDensity.centres(lower[k], upper[k], cells)
+                   for k in range(n_params)]
+        pair_centres = [KernelDensity.centres(lower[k], upper[k], pair_cells)
+                        for k in range(n_params)]
+        densities = np.full((n_samples, n_params, cells), np.nan)
+        pair_densities = np.full((n_samples, len(rows), pair_cells, pair_cells), np.nan)
+        bandwidths = np.full((n_samples, n_params), np.nan)
+        for j in range(n_samples):
+            (label, postsamples, weights) = samples[j]
+            values = postsamples[self.params].to_numpy(dtype = float)
+            if len(values) < 2:
+                continue
+            if weights is None:
+                weights = np.ones(len(values))
+            for k in range(n_params):
+                bandwidths[j, k] = KernelDensity.bandwidth(values[:, k], weights, rule,
+                                                           span = upper[k] - lower[k])
+                densities[j, k] = KernelDensity.density(values[:, k:k + 1], weights,
+                                                        lower[k:k + 1], upper[k:k + 1],
+                                                        cells, bandwidths[j, k:k + 1])
+            if pair_cells > 0:
+                pair_bw = np.array([KernelDensity.bandwidth(values[:, k], weights, rule,
+                                                            dims = 2,
+                                                            span = upper[k] - lower[k])
+                                    for k in range(n_params)])
+                for p in range(len(rows)):
+                    both = [rows[p], cols[p]]
+                    pair_densities[j, p] = KernelDensity.density(values[:, both], weights,
+                                                                 lower[both], upper[both],
+                                                                 pair_cells, pair_bw[both])
+        labels = [label for (label, postsamples, weights) in samples]
+        return(labels, np.array(centres).reshape(n_params, cells), densities,
+               np.array(pair_centres).reshape(n_params, pair_cells), pair_densities,
+               bandwidths)
+
+    def saveKDEPosteriors(self, file_stem, cells = _DEFAULT_KDE_CELLS,
+                          pair_cells = _DEFAULT_KDE_PAIR_CELLS,
+                          rule = _DEFAULT_BANDWIDTH, delimiter = ","):
+        """
+        Save the kernel density estimates from kdePosteriors() as long tables
+        (CSV format by default): file_stem_1d.csv with one row per sample,
+        parameter and cell, and file_stem_2d.csv with one row per sample, pair
+        of parameters and pair of cells.
+        """
+        (labels, centres, densities, pair_centres, pair_densities,
+         bandwidths) = self.kdePosteriors(cells, pair_cells, rule)
+        n_params = len(self.params)
+        pd.DataFrame({
+            'sample': np.repeat(labels, n_params * cells),
+            'parameter': np.tile(np.repeat(self.params, cells), len(labels)),
+            'value': np.tile(centres.ravel(), len(labels)),
+            'density': densities.ravel(),
+            'bandwidth': np.repeat(bandwidths.ravel(), cells)
+        }, columns = ['sample', 'parameter', 'value', 'density', 'bandwidth']).to_csv(
+            self.mkname(file_stem + "_1d.csv"), sep = delimiter, index = False)
+        (rows, cols) = np.tril_indices(n_params, -1)
+        n_cells = pair_cells * pair_cells
+        pd.DataFrame({
+            'sample': np.repeat(labels, len(rows) * n_cells),
+            'parameter_x': np.tile(np.repeat(np.array(self.params)[cols], n_cells),
+                                   len(labels)),
+            'parameter_y': np.tile(np.repeat(np.array(self.params)[rows], n_cells),
+                                   len(labels)),
+            'x': np.tile(np.tile(pair_centres[cols], (1, pair_cells)).ravel(),
+                         len(labels)),
+            'y': np.tile(np.repeat(pair_centres[rows], pair_cells, axis = 1).ravel(),
+                         len(labels)),
+            'density': pair_densities.ravel()
+        }, columns = ['sample', 'parameter_x', 'parameter_y', 'x', 'y', 'density']).to_csv(
+            self.mkname(file_stem + "_2d.csv"), sep = delimiter, index = False)
+
+    def plotKDETriangles(self, file_name, cells = _DEFAULT_KDE_CELLS,
+                         pair_cells = _DEFAULT_KDE_PAIR_CELLS,
+                         rule = _DEFAULT_BANDWIDTH, colour = _DEFAULT_LINE_COLOURS[0],
+                         font_size = _DEFAULT_FONT_SIZE):
+        """
+        Save triangle plots of the kernel density estimates from
+        kdePosteriors() to the file_name, numbered as in trianglePlots(), with
+        the 1D densities on the diagonal and filled contours of the 2D
+        densities below it.
+        """
+        (labels, centres, densities, pair_centres, pair_densities,
+         bandwidths) = self.kdePosteriors(cells, pair_cells, rule)
+        (stem, suffix) = os.path.splitext(file_name)
+        tasks = []
+        for s in range(len(labels)):
+            if np.isnan(densities[s, 0, 0]):
+                print("Too few samples for %s to estimate densities, "
+                      "skipping....."%(labels[s]))
+                continue
+            if len(labels) > 1:
+                name = '%s_%d%s'%(stem, s + 1, suffix)
+            else:
+                name = file_name
+            tasks.append(('densityTriangle', [self.mkname(name), centres, densities[s],
+                                              pair_centres, pair_densities[s],
+                                              self.param_minima, self.param_maxima,
+                                              self.disp_params, labels[s], colour,
+                                              font_size]))
+        self.drawFigures(tasks)
+
+    def emulate(self, draws = _DEFAULT_EMULATOR_DRAWS, train = _DEFAULT_EMULATOR_TRAIN,
+                refits = _DEFAULT_EMULATOR_REFITS, bins = _DEFAULT_CUBE_BINS, seed = None):
+        """
+        Smooth the evidence curves and posteriors with an Emulator of each
+        metric fitted to a random subsample of (up to) train runs. The
+        emulators stand in for the model at draws parameter sets sampled
+        uniformly over the dynamic parameters' ranges. Each draw's probability
+        of acceptance at every epsilon follows from the emulator's normal
+        predictive distribution of the metric, whose variance is the nugget
+        (the run-to-run variation) plus the emulator's predictive variance of
+        the mean, so draws far from the training runs are given less certain
+        acceptance. The joint probability for all the metrics is the product
+        of these; the evidence is the mean of these probabilities over the
+        draws, so it is smooth even at epsilons where few runs are accepted.
+        This is repeated refits times, each with a new subsample and draws,
+        and the spread over the refits estimates the error from the choice
+        of subsample; the hyperparameters are fitted to the first subsample
+        and kept fixed for the others, so their uncertainty is not included.
+        The posterior cube's counts for all the metrics come from one
+        bincount per parameter for each batch of draws. Besides fitting the
+        hyperparameters, most of the time goes on the predictive means and
+        variances at the draws (the variances cost a triangular solve with
+        the train runs for each draw), so it grows in proportion to draws.
+
+        Returns the evidences (indexed by refit, metric with all the metrics
+        jointly last, and epsilon), the bin edges of the dynamic parameters,
+        and a posterior cube as for posteriorCube() holding the expected
+        number of accepted draws in each bin, averaged over the refits. The
+        result is kept for saveEmulation() and plotEmulatedEvidences().
+        """
+        from scipy import special
+        rng = np.random.RandomState(seed)
+        n_eps = self.epsteps + 1
+        n_cols = self.n_metrics + 1
+        n_params = len(self.params)
+        lower = np.array(self.param_minima)
+        span = np.array(self.param_maxima) - lower
+        x = (self.df[self.params].to_numpy(dtype = float) - lower) / span
+        y = [self.df[self.headers[j]].to_numpy(dtype = float) for j in range(self.n_metrics)]
+        epsilons = np.array(self.epsilons)
+        edges = np.array([np.linspace(0.0, 1.0, bins + 1) * span[k] + lower[k]
+                          for k in range(n_params)]).reshape(n_params, bins + 1)
+        evidences = np.zeros((refits, n_cols, n_eps))
+        cube = np.zeros((n_params, n_cols, n_eps, bins))
+        hypers = [None for j in range(self.n_metrics)]
+        chunk = max(1, _EMULATOR_CHUNK // n_eps)
+        for r in range(refits):
+            rows = rng.choice(self.n_runs, min(train, self.n_runs), replace = False)
+            emulators = []
+            for j in range(self.n_metrics):
+                emulators.append(Emulator(x[rows], y[j][rows], hypers[j]))
+                hypers[j] = emulators[j].hyper
+            for start in range(0, draws, chunk):
+                n_draws = min(chunk, draws - start)
+                sample = rng.uniform(size = (n_draws, n_params))
+                probs = np.ones((n_cols, n_draws, n_eps))
+                for j in range(self.n_metrics):
+                    (mean, var) = emulators[j].predict(sample, variance = True)
+                    sd = np.sqrt(emulators[j].noise() ** 2 + var)[:, None]
+                    upper = (self.calibvals[j] + epsilons * self.difima[j] - mean[:, None]) / sd
+                    below = (self.calibvals[j] - epsilons * self.difima[j] - mean[:, None]) / sd
+                    probs[j] = special.ndtr(upper) - special.ndtr(below)
+                    probs[-1] *= probs[j]
+                evidences[r] += np.sum(probs, axis = 1)
+                binno = np.clip((sample * bins).astype(int), 0, bins - 1)
+                offsets = (np.arange(n_cols * n_eps) * bins).reshape(n_cols, 1, n_eps)
+                for k in range(n_params):
+                    index = offsets + binno[:, k][None, :, None]
+                    cube[k] += np.bincount(index.ravel(), weights = probs.ravel(),
+                                           minlength = n_cols * n_eps * bins).reshape(
+                                               n_cols, n_eps, bins)
+        evidences = evidences / (1.0 * draws)
+        cube = cube / (1.0 * refits)
+        self.emulation = (evidences, edges, cube)
+        return(evidences, edges, cube)
+
+    def rawEvidences(self):
+        """
+        Return the evidence curves computed from the runs, indexed by metric
+        (with all the metrics jointly last) and epsilon
+        """
+        n_eps = self.epsteps + 1
+        if self.weights is None:
+            weights = np.ones(self.n_runs)
+        else:
+            weights = self.weights
+        joint = np.bincount(self.firstEpsilons(), weights = weights,
+                            minlength = n_eps + 1)[0:n_eps]
+        joint = np.cumsum(joint) / np.sum(weights)
+        return(np.concatenate((self.evidences, joint[None, :]), axis = 0))
+
+    def saveEmulation(self, file_stem, delimiter = ","):
+        """
+        Save the results of emulate() (using its defaults if it has not been
+        called) as a long table of raw and emulated evidences, one row per
+        metric and epsilon, to file_stem_evidence.csv (CSV format by
+        default), with the mean, standard deviation, minimum and maximum of
+        the emulated evidence over the refits; and the emulated posterior
+        cube to file_stem_cube.npz, which can be plotted with
+        plotPosteriorCube()
+        """
+        if self.emulation is None:
+            self.emulate()
+        (evidences, edges, cube) = self.emulation
+        names = self.headers + ['joint']
+        n_eps = self.epsteps + 1
+        pd.DataFrame({
+            'metric': np.repeat(names, n_eps),
+            'epsilon': np.tile(np.array(self.epsilons), len(names)),
+            'raw': self.rawEvidences().ravel(),
+            'emulated': np.mean(evidences, axis = 0).ravel(),
+            'sd': np.std(evidences, axis = 0).ravel(),
+            'lower': np.min(evidences, axis = 0).ravel(),
+            'upper': np.max(evidences, axis = 0).ravel()
+        }, columns = ['metric', 'epsilon', 'raw', 'emulated', 'sd', 'lower', 'upper']).to_csv(
+            self.mkname(file_stem + "_evidence.csv"), sep = delimiter, index = False)
+        self.writeCube(file_stem + "_cube.npz", edges, cube)
+
+    def plotEmulatedEvidences(self, image_file, line_colours = [],
+                              legend_pos = _DEFAULT_LEGEND_POS,
+                              x_label = _DEFAULT_EP_LABEL,
+                              y_label = _DEFAULT_EVIDENCE_LABEL,
+                              font_size = _DEFAULT_FONT_SIZE):
+        """
+        Plot the raw (solid) and emulated (dashed) evidence curves of each
+        metric and all the metrics jointly together, with the range of the
+        emulated evidence over the refits shaded, saving the graph to the
+        image_file. emulate() is called with its defaults if need be.
+        """
+        if line_colours == []:
+            line_colours = _DEFAULT_LINE_COLOURS
+        if self.emulation is None:
+            self.emulate()
+        evidences = self.emulation[0]
+        raw = self.rawEvidences()
+        epsilons = np.array(self.epsilons)
+        labels = ['Metric %i (%s)'%(j + 1, self.disp_metrics[j])
+                  for j in range(self.n_metrics)] + ['All metrics']
+        series = []
+        bands = []
+        for j in range(len(labels)):
+            series.append((epsilons, raw[j], labels[j], line_colours[j], _DEFAULT_LINE_STYLE))
+            series.append((epsilons, np.mean(evidences[:, j], axis = 0),
+                           labels[j] + ', emulated', line_colours[j], '--'))
+            bands.append((epsilons, np.min(evidences[:, j], axis = 0),
+                          np.max(evidences[:, j], axis = 0), line_colours[j]))
+        self.drawFigures([('lines', [self.mkname(image_file), series, x_label, y_label,
+                                     legend_pos, font_size, 'Raw and emulated evidence',
+                                     False, [0, 1], bands])])
+
+    def deferFigures(self):
+        """
+        Collect the figures from subsequent calls to the plotting methods rather
+        than drawing each straight away, so that renderFigures() can draw them
+        all at once
+        """
+        self.figures = []
+
+    def renderFigures(self, processes = 1):
+        """
+        Draw the figures collected since deferFigures(), in a pool of processes
+        if processes is more than one, and go back to drawing figures straight
+        away
+        """
+        tasks = self.figures
+        self.figures = None
+        if tasks is not None:
+            PhaseProfile.render(tasks, processes)
+
+    def drawFigures(self, tasks):
+        """
+        Called from the plotting methods, this method draws a list of figure
+        tasks with abcplot.render() (see PhaseProfile.render()), or collects
+        them if figures are deferred
+        """
+        if self.figures is None:
+            PhaseProfile.render(tasks)
+        else:
+            self.figures.extend(tasks)
 
     @staticmethod
     def mkname(filename):
@@ -507,6 +2191,26 @@ class BruteABC:
             rename = rename.replace(chr, "_")
         return(rename)
 
+    @staticmethod
+    def readTargets(file_name, headers):
+        """
+        Read a targets file in CSV format, with one column for each metric in
+        headers and one row for each set of calibration values. An optional
+        'target' column gives a name for each row; otherwise rows are named by
+        number. Returns a list of names and a matrix of calibration values.
+        """
+        targetdf = pd.read_csv(file_name, sep = ",", header = 0)
+        for name in headers:
+            if name not in targetdf.columns:
+                sys.stderr.write("Metric name %s does not appear as a column "
+                                 "heading in targets file %s\n"%(name, file_name))
+                sys.exit(1)
+        if 'target' in targetdf.columns:
+            names = [str(targetdf['target'][i]) for i in range(len(targetdf))]
+        else:
+            names = ["%d"%(i + 1) for i in range(len(targetdf))]
+        return(names, targetdf[headers].to_numpy(dtype = float))
+
     @staticmethod
     def ckdata(df, params, metrics, dffile, paramfile, metricfile, die = True):
         pnames = [params['parameter'][i] for i in range(len(params))]
@@ -546,6 +2250,630 @@ class BruteABC:
 
         return(True)
 
+class Pareto:
+    """Pareto class
+
+    Static methods finding the non-dominated (skyline) rows of an array of
+    distances, and successive Pareto layers, where smaller is better in every
+    column. One row dominates another if it is no worse in any column and
+    better in at least one. Identical rows do not dominate each other, and so
+    are always put in the same layer. Missing distances count as infinite.
+    """
+
+    @staticmethod
+    def layers(points, k = None):
+        """
+        Return an array with the Pareto layer (starting at 1) of each row of
+        points. If k is given, rows beyond the first k layers have layer k + 1.
+        Two columns are handled by a single sort-and-sweep over all layers,
+        three by a sort-and-sweep per layer, and more than three by divide and
+        conquer per layer.
+        """
+        points = np.array(points, dtype = float)
+        if points.ndim == 1:
+            points = points.reshape(len(points), 1)
+        points[np.isnan(points)] = np.inf
+        n = points.shape[0]
+        if k is None:
+            k = n
+        if n == 0:
+            return(np.zeros(0, dtype = int))
+
+        uniq, inverse = np.unique(points, axis = 0, return_inverse = True)
+        order = np.lexsort(uniq.T[::-1])
+        uniq = uniq[order]
+        rank = np.empty(len(order), dtype = int)
+        rank[order] = np.arange(len(order))
+        inverse = rank[inverse]
+
+        if uniq.shape[1] == 1:
+            ulayers = np.minimum(np.arange(1, len(uniq) + 1), k + 1)
+        elif uniq.shape[1] == 2:
+            ulayers = Pareto.sweep2(uniq, k)
+        else:
+            ulayers = np.zeros(len(uniq), dtype = int) + k + 1
+            remaining = np.arange(len(uniq))
+            for layer in range(1, k + 1):
+                if len(remaining) == 0:
+                    break
+                if uniq.shape[1] == 3:
+                    front = Pareto.sweep3(uniq[remaining])
+                else:
+                    front = Pareto.divideAndConquer(uniq[remaining])
+                ulayers[remaining[front]] = layer
+                remaining = remaining[~front]
+        return(ulayers[inverse])
+
+    @staticmethod
+    def skyline(points):
+        """
+        Return a boolean array that is True for the non-dominated rows of points
+        """
+        return(Pareto.layers(points, 1) == 1)
+
+    @staticmethod
+    def sweep2(points, k):
+        """
+        Assign layers to distinct two-column points sorted lexicographically.
+        An earlier point dominates a later one if its second column is no
+        larger, so each layer need only remember its smallest second column;
+        these minima increase with layer, and a binary search finds the first
+        layer none of whose points dominate the new one.
+        """
+        minima = []
+        layers = np.empty(len(points), dtype = int)
+        for i in range(len(points)):
+            y = points[i, 1]
+            layer = bisect.bisect_right(minima, y)
+            if layer < k:
+                if layer == len(minima):
+                    minima.append(y)
+                else:
+                    minima[layer] = y
+            layers[i] = min(layer, k) + 1
+        return(layers)
+
+    @staticmethod
+    def sweep3(points):
+        """
+        Return the skyline of distinct three-column points sorted
+        lexicographically. The last two columns of the skyline so far are kept
+        as a staircase (second column increasing, third decreasing), so a new
+        point is dominated if the staircase step at or before its second
+        column is no higher than its third.
+        """
+        ys = []
+        zs = []
+        front = np.zeros(len(points), dtype = bool)
+        for i in range(len(points)):
+            y = points[i, 1]
+            z = points[i, 2]
+            pos = bisect.bisect_right(ys, y)
+            if pos > 0 and zs[pos - 1] <= z:
+                continue
+            front[i] = True
+            start = bisect.bisect_left(ys, y)
+            end = start
+            while end < len(ys) and zs[end] >= z:
+                end += 1
+            ys[start:end] = [y]
+            zs[start:end] = [z]
+        return(front)
+
+    @staticmethod
+    def divideAndConquer(points):
+        """
+        Return the skyline of distinct points sorted lexicographically, with
+        any number of columns. Points dominated by one of the few points with
+        the smallest sum of columns (which are cheap to find, and dominate a
+        large share of the rest) are discarded before dividing.
+        """
+        front = np.zeros(len(points), dtype = bool)
+        best = np.argsort(points.sum(axis = 1))[:_PARETO_FILTER]
+        keep = np.flatnonzero(~Pareto.dominated(points, points[best]))
+        front[keep] = Pareto.divide(points[keep])
+        return(front)
+
+    @staticmethod
+    def divide(points):
+        """
+        Called from divideAndConquer(). A point cannot be dominated by one after
+        it in lexicographic order, so the skyline of the first half is kept
+        whole, and the skyline of the second half is kept where none of the
+        first half's skyline dominates it.
+        """
+        n = len(points)
+        if n <= _PARETO_BLOCK:
+            return(~Pareto.dominated(points, points))
+        half = n // 2
+        front = np.zeros(n, dtype = bool)
+        front[:half] = Pareto.divide(points[:half])
+        upper = Pareto.divide(points[half:])
+        upper_index = half + np.flatnonzero(upper)
+        front[upper_index] = ~Pareto.dominated(points[upper_index],
+                                               points[:half][front[:half]])
+        return(front)
+
+    @staticmethod
+    def dominated(points, others):
+        """
+        Return a boolean array that is True for each of the (distinct) points
+        dominated by any of the others, comparing blocks of points at a time
+        """
+        result = np.zeros(len(points), dtype = bool)
+        if len(others) == 0:
+            return(result)
+        step = max(1, _PARETO_CHUNK // len(others))
+        for start in range(0, len(points), step):
+            block = points[start:start + step]
+            no_worse = np.all(others[None, :, :] <= block[:, None, :], axis = 2)
+            better = np.any(others[None, :, :] < block[:, None, :], axis = 2)
+            result[start:start + step] = np.any(no_worse & better, axis = 1)
+        return(result)
+
+class KernelDensity:
+    """KernelDensity class
+
+    Static methods computing Gaussian kernel density estimates of large
+    (weighted) samples on a regular grid of cells between lower and upper
+    bounds. The sample is binned onto the grid and convolved with the kernel
+    using FFT, so the cost depends on the number of cells rather than the
+    product of the number of cells and the sample size. Bounds are handled
+    by reflection: the binned counts are mirrored at each bound before
+    convolution, so no density leaks outside the parameter's range.
+    """
+
+    @staticmethod
+    def centres(lower, upper, cells):
+        """
+        Return the centres of the cells between lower and upper
+        """
+        return(lower + (upper - lower) * (np.arange(cells) + 0.5) / (1.0 * cells))
+
+    @staticmethod
+    def bandwidth(values, weights = None, rule = _DEFAULT_BANDWIDTH, dims = 1,
+                  span = 1.0):
+        """
+        Return the kernel bandwidth (standard deviation) for the values. The
+        rule is 'silverman' (robust to heavy tails, for 1D), 'scott', or a
+        number giving the bandwidth as a fraction of span, the width of the
+        parameter's range. For dims of 2 or more, Silverman's rule is the same
+        as Scott's. Weighted samples use Kish's effective sample size.
+        """
+        if rule not in _BANDWIDTH_RULES:
+            try:
+                return(float(rule) * span)
+            except ValueError:
+                sys.stderr.write("Bandwidth rule \"%s\" not recognized (use one "
+                                 "of %s, or a fraction of the parameter range)\n"
+                                 %(rule, ", ".join(_BANDWIDTH_RULES)))
+                sys.exit(1)
+        if weights is None:
+            weights = np.ones(len(values))
+        total = np.sum(weights)
+        n_eff = total * total / np.sum(weights * weights)
+        mean = np.sum(weights * values) / total
+        sd = np.sqrt(np.sum(weights * (values - mean) ** 2) / total)
+        if rule == 'silverman' and dims == 1:
+            order = np.argsort(values)
+            cumweights = np.cumsum(weights[order]) / total
+            (q1, q3) = values[order][np.minimum(np.searchsorted(cumweights, [0.25, 0.75]),
+                                                len(values) - 1)]
+            spread = sd if q3 <= q1 else min(sd, (q3 - q1) / 1.349)
+            return(0.9 * spread * n_eff ** -0.2)
+        return(sd * n_eff ** (-1.0 / (dims + 4)))
+
+    @staticmethod
+    def density(values, weights, lower, upper, cells, bandwidths):
+        """
+        Return the density estimate of the values (an array indexed by sample
+        member and dimension) at the centres of a grid with cells cells along
+        each dimension between lower and upper (arrays indexed by dimension),
+        using a Gaussian kernel with the given bandwidths in each dimension.
+        The result is indexed by cell in each dimension in turn, as from
+        np.histogramdd(), and integrates to one.
+        """
+        (n, dims) = values.shape
+        widths = (upper - lower) / (1.0 * cells)
+        binno = np.clip(np.floor((values - lower[None, :]) / widths[None, :]).astype(int),
+                        0, cells - 1)
+        index = np.zeros(n, dtype = int)
+        for d in range(dims):
+            index = index * cells + binno[:, d]
+        counts = np.bincount(index, weights = weights,
+                             minlength = cells ** dims).reshape((cells,) * dims)
+        smoothed = KernelDensity.smooth(counts, bandwidths / widths)
+        total = np.sum(smoothed) * np.prod(widths)
+        if total <= 0:
+            return(smoothed)
+        return(smoothed / total)
+
+    @staticmethod
+    def smooth(counts, sigmas):
+        """
+        Convolve an array of binned counts with a Gaussian kernel with the
+        standard deviations (in cells) along each axis given by sigmas,
+        mirroring the counts at the edges, using FFT. The kernel is cut off at
+        _KDE_TRUNCATE standard deviations, or the width of the array.
+        """
+        halves = [int(min(np.ceil(_KDE_TRUNCATE * sigmas[a]), counts.shape[a]))
+                  for a in range(counts.ndim)]
+        padded = np.pad(counts, [(h, h) for h in halves], mode = 'symmetric')
+        kernel = np.ones([1] * counts.ndim)
+        for a in range(counts.ndim):
+            x = np.arange(-halves[a], halves[a] + 1)
+            if sigmas[a] > 0:
+                k = np.exp(-0.5 * (x / (1.0 * sigmas[a])) ** 2)
+            else:
+                k = (x == 0).astype(float)
+            shape = [1] * counts.ndim
+            shape[a] = len(k)
+            kernel = kernel * (k / np.sum(k)).reshape(shape)
+        fft_shape = [int(2 ** np.ceil(np.log2(padded.shape[a] + kernel.shape[a] - 1)))
+                     for a in range(counts.ndim)]
+        result = np.fft.irfftn(np.fft.rfftn(padded, fft_shape)
+                               * np.fft.rfftn(kernel, fft_shape), fft_shape)
+        region = tuple(slice(2 * halves[a], 2 * halves[a] + counts.shape[a])
+                       for a in range(counts.ndim))
+        return(np.clip(result[region], 0, None))
+
+class WeightTree:
+    """WeightTree class
+
+    A Fenwick (binary indexed) tree of weights at positions 1 to n, used to
+    select weighted order statistics from a set of runs that only grows.
+    Positions are ranks in value order, so selecting the first position at
+    which the cumulative weight reaches a target gives a weighted quantile.
+    Adding and selecting are vectorised over batches, and each takes time
+    proportional to log n per element.
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.tree = np.zeros(n + 1)
+        self.total = 0.0
+        self.top = 1
+        while self.top * 2 <= n:
+            self.top = self.top * 2
+
+    def add(self, positions, weights):
+        """
+        Add the weights at the positions (arrays, positions starting at 1).
+        Small batches are passed up the tree element by element; large ones
+        are counted into a whole tree, built a level at a time, and added.
+        """
+        index = np.asarray(positions, dtype = int)
+        weights = np.asarray(weights, dtype = float)
+        self.total = self.total + np.sum(weights)
+        if len(index) * _WEIGHT_TREE_BATCH > self.n:
+            delta = np.bincount(index, weights = weights, minlength = self.n + 1)
+            step = 1
+            while step <= self.n:
+                children = np.arange(step, self.n + 1 - step, 2 * step)
+                delta[children + step] += delta[children]
+                step = step * 2
+            self.tree += delta
+            return
+        while len(index) > 0:
+            np.add.at(self.tree, index, weights)
+            index = index + (index & -index)
+            keep = index <= self.n
+            index = index[keep]
+            weights = weights[keep]
+
+    def select(self, targets):
+        """
+        Return, for each target, the first position at which the cumulative
+        weight reaches the target. Zero targets select the first position with
+        any weight, and targets of (about) the total weight or more the last,
+        allowing for rounding error in the sums.
+        """
+        remaining = np.clip(np.asarray(targets, dtype = float), np.finfo(float).tiny,
+                            self.total * (1.0 - 1e-9))
+        position = np.zeros(len(remaining), dtype = int)
+        step = self.top
+        while step > 0:
+            after = position + step
+            move = after <= self.n
+            move[move] = self.tree[after[move]] < remaining[move]
+            remaining[move] = remaining[move] - self.tree[after[move]]
+            position[move] = after[move]
+            step = step // 2
+        return(np.minimum(position + 1, self.n))
+
+class Emulator:
+    """Emulator class
+
+    A Gaussian process regression of one metric on the dynamic parameters
+    (scaled to [0, 1]), used by BruteABC.emulate() as a cheap surrogate for
+    the model. The metric is standardised, and the kernel is squared
+    exponential with a length scale for each parameter, plus a nugget for the
+    run-to-run variation of the metric at the same parameter values. Unless
+    given, the hyperparameters (the logs of the length scales, the signal
+    variance and the nugget) are those maximising the marginal likelihood of
+    the training runs.
+    """
+    def __init__(self, x, y, hyper = None):
+        from scipy import linalg
+        self.x = np.array(x, dtype = float)
+        y = np.array(y, dtype = float)
+        self.centre = np.mean(y)
+        self.spread = np.std(y)
+        if self.spread <= 0:
+            self.spread = 1.0
+        z = (y - self.centre) / self.spread
+        if hyper is None:
+            hyper = Emulator.fit(self.x, z)
+        self.hyper = hyper
+        (self.scales, self.signal, self.nugget) = Emulator.unpack(hyper)
+        cov = Emulator.kernel(self.x, self.x, self.scales, self.signal) \
+              + self.nugget * np.eye(len(z))
+        self.factor = linalg.cho_factor(cov, lower = True)
+        self.alpha = linalg.cho_solve(self.factor, z)
+
+    @staticmethod
+    def unpack(hyper):
+        """
+        Return the length scales, signal variance and nugget from the
+        hyperparameters
+        """
+        hyper = np.array(hyper, dtype = float)
+        return(np.exp(hyper[:-2]), np.exp(hyper[-2]), np.exp(hyper[-1]))
+
+    @staticmethod
+    def kernel(a, b, scales, signal):
+        """
+        Return the squared exponential covariances between the rows of a and b
+        """
+        a = a / scales
+        b = b / scales
+        cov = np.dot(a, b.T)
+        cov -= 0.5 * np.sum(a * a, axis = 1)[:, None]
+        cov -= 0.5 * np.sum(b * b, axis = 1)[None, :]
+        np.minimum(cov, 0.0, out = cov)
+        np.exp(cov, out = cov)
+        cov *= signal
+        return(cov)
+
+    @staticmethod
+    def likelihood(hyper, x, z):
+        """
+        Return the negative log marginal likelihood of the standardised metric
+        z at the scaled parameters x, and its gradient with respect to the
+        hyperparameters
+        """
+        from scipy import linalg
+        (scales, signal, nugget) = Emulator.unpack(hyper)
+        n = len(z)
+        sqdiff = (x[:, None, :] - x[None, :, :]) ** 2 / (scales * scales)
+        cov_f = signal * np.exp(-0.5 * np.sum(sqdiff, axis = 2))
+        try:
+            factor = linalg.cho_factor(cov_f + nugget * np.eye(n), lower = True)
+        except linalg.LinAlgError:
+            return(1.0e25, np.zeros(len(hyper)))
+        alpha = linalg.cho_solve(factor, z)
+        nll = 0.5 * np.dot(z, alpha) + np.sum(np.log(np.diag(factor[0]))) \
+              + 0.5 * n * np.log(2.0 * np.pi)
+        inner = np.outer(alpha, alpha) - linalg.cho_solve(factor, np.eye(n))
+        grad = np.zeros(len(hyper))
+        for k in range(len(scales)):
+            grad[k] = -0.5 * np.sum(inner * cov_f * sqdiff[:, :, k])
+        grad[-2] = -0.5 * np.sum(inner * cov_f)
+        grad[-1] = -0.5 * nugget * np.trace(inner)
+        return(nll, grad)
+
+    @staticmethod
+    def fit(x, z):
+        """
+        Return the hyperparameters maximising the marginal likelihood of the
+        standardised metric z at the scaled parameters x
+        """
+        from scipy import optimize as op
+        n_params = x.shape[1]
+        start = np.array([np.log(0.3) for k in range(n_params)] + [0.0, np.log(0.1)])
+        bounds = [(np.log(0.01), np.log(100.0)) for k in range(n_params)] \
+                 + [(np.log(1.0e-4), np.log(100.0)), (np.log(1.0e-6), np.log(10.0))]
+        res = op.minimize(Emulator.likelihood, start, args = (x, z), jac = True,
+                          method = 'L-BFGS-B', bounds = bounds)
+        return(res.x)
+
+    def predict(self, x, variance = False):
+        """
+        Return the emulator's mean of the metric at each row of the scaled
+        parameters x, and if variance is True, also the predictive variance
+        of the mean (which is small near the training runs and grows away
+        from them, up to the signal variance), found by a triangular solve
+        against the Cholesky factor of the training covariance
+        """
+        from scipy import linalg
+        chunk = max(1, _EMULATOR_CHUNK // len(self.alpha))
+        mean = np.zeros(len(x))
+        var = np.zeros(len(x))
+        for start in range(0, len(x), chunk):
+            cov = Emulator.kernel(x[start:start + chunk], self.x, self.scales, self.signal)
+            mean[start:start + chunk] = np.dot(cov, self.alpha)
+            if variance:
+                v = linalg.solve_triangular(self.factor[0], cov.T, lower = True,
+                                            check_finite = False)
+                var[start:start + chunk] = self.signal - np.sum(v * v, axis = 0)
+        mean = self.centre + self.spread * mean
+        if variance:
+            return(mean, self.spread * self.spread * np.maximum(var, 0.0))
+        return(mean)
+
+    def noise(self):
+        """
+        Return the standard deviation of the metric between runs at the same
+        parameter values, as estimated by the nugget
+        """
+        return(self.spread * np.sqrt(self.nugget))
+
+class PhaseProfile:
+    """PhaseProfile class
+
+    Records the wall time, CPU time, peak resident memory and throughput (rows
+    per second) of the phases of a bruteABC.py command, such as reading the
+    data, normalising, indexing and counting evidences for each metric,
+    selecting and analysing the runs of each ParamOption, fitting scales,
+    saving and plotting. Each figure drawn is a phase of its own (see
+    render()), so where figures are deferred the plotting phases only time
+    preparing them. The code marks its phases with PhaseProfile.phase(),
+    which does nothing unless a profile has been activated. Phases can be
+    nested (e.g. each metric's normalisation within building a BruteABC
+    object), and have their depth recorded. Peak memory is for the phase alone
+    where Linux allows the peak to be reset, otherwise for the process so far.
+    If cprofile is True, each outermost phase is run under cProfile and the
+    statistics of the slowest are kept (the times then include cProfile's
+    overhead).
+    """
+    active = None
+
+    def __init__(self, cprofile = False):
+        self.records = []
+        self.stack = []
+        self.cprofile = cprofile
+        self.slowest = None
+        self.started = time.time()
+
+    def activate(self):
+        """
+        Make this the profile that phases are recorded in
+        """
+        PhaseProfile.active = self
+
+    @staticmethod
+    @contextlib.contextmanager
+    def phase(name, rows = None, metric = None, option = None):
+        """
+        Context manager marking a phase with the number of rows it processes
+        and the metric and ParamOption it is for, if any (a nested phase takes
+        the option of the phase it is in). The phase's record (a dictionary)
+        is given to the with statement, so the rows can be set once known.
+        """
+        profile = PhaseProfile.active
+        if option is None and profile is not None and len(profile.stack) > 0:
+            option = profile.stack[-1]['option']
+        record = {'phase': name, 'metric': metric, 'option': option, 'rows': rows}
+        if profile is None:
+            yield record
+            return
+        parent = profile.stack[-1] if len(profile.stack) > 0 else None
+        if parent is not None:
+            parent['peak_rss_mb'] = max(parent['peak_rss_mb'], PhaseProfile.peakMemory())
+        record['depth'] = len(profile.stack)
+        record['peak_rss_mb'] = PhaseProfile.peakMemory(reset = True)
+        profiler = None
+        if profile.cprofile and parent is None:
+            import cProfile
+            profiler = cProfile.Profile()
+        profile.stack.append(record)
+        cpu = os.times()
+        record['start'] = time.time() - profile.started
+        start = time.time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record['seconds'] = time.time() - start
+            end = os.times()
+            record['cpu_seconds'] = sum(end[0:4]) - sum(cpu[0:4])
+            record['peak_rss_mb'] = max(record['peak_rss_mb'], PhaseProfile.peakMemory())
+            if record['rows'] is not None and record['seconds'] > 0:
+                record['rows_per_second'] = record['rows'] / record['seconds']
+            else:
+                record['rows_per_second'] = None
+            profile.stack.pop()
+            if parent is not None:
+                parent['peak_rss_mb'] = max(parent['peak_rss_mb'], record['peak_rss_mb'])
+            profile.records.append(record)
+            if profiler is not None and (profile.slowest is None
+                                         or record['seconds'] > profile.slowest[0]):
+                profile.slowest = (record['seconds'], name, profiler)
+
+    @staticmethod
+    def peakMemory(reset = False):
+        """
+        Return the peak resident memory in MB: since the last reset, from
+        /proc on Linux, or of the process so far, from getrusage(), otherwise.
+        If reset is True, the peak is reset (where /proc allows it).
+        """
+        peak = None
+        try:
+            fp = open('/proc/self/status')
+            for line in fp:
+                if line.startswith('VmHWM:'):
+                    peak = float(line.split()[1]) / 1024.0
+            fp.close()
+            if reset:
+                fp = open('/proc/self/clear_refs', 'w')
+                fp.write('5')
+                fp.close()
+        except (IOError, OSError):
+            pass
+        if peak is None:
+            try:
+                import resource
+                peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss \
+                       / (1048576.0 if sys.platform == 'darwin' else 1024.0)
+            except ImportError:
+                peak = 0.0
+        return(peak)
+
+    @staticmethod
+    def render(tasks, processes = 1):
+        """
+        Draw figure tasks with abcplot.render(), recording a phase for each
+        figure, named after its drawing function and with its image file as
+        the option, if a profile is active. Figures drawn in a pool of
+        processes get the wall and CPU times the pool's process took to draw
+        them, all starting when the pool does, and no peak memory.
+        """
+        import abcplot
+        profile = PhaseProfile.active
+        if profile is None:
+            abcplot.render(tasks, processes)
+        elif processes <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                with PhaseProfile.phase(task[0], option = task[1][0]):
+                    abcplot.draw(task)
+        else:
+            start = time.time() - profile.started
+            times = abcplot.render(tasks, processes, timed = True)
+            for (task, (seconds, cpu_seconds)) in zip(tasks, times):
+                profile.records.append({'phase': task[0], 'depth': len(profile.stack),
+                                        'metric': None, 'option': task[1][0],
+                                        'rows': None, 'start': start, 'seconds': seconds,
+                                        'cpu_seconds': cpu_seconds, 'peak_rss_mb': None,
+                                        'rows_per_second': None})
+
+    def save(self, file_name, cprofile_file = None):
+        """
+        Save the phase records to the file, as JSON if its name ends .json and
+        CSV otherwise, in order of starting. If a cprofile_file is given, the
+        cProfile statistics of the slowest outermost phase are dumped to it.
+        """
+        columns = ['phase', 'depth', 'metric', 'option', 'rows', 'start', 'seconds',
+                   'cpu_seconds', 'peak_rss_mb', 'rows_per_second']
+        records = sorted(self.records, key = lambda record: record['start'])
+        slowest = None
+        if self.slowest is not None:
+            slowest = self.slowest[1]
+            if cprofile_file is not None:
+                self.slowest[2].dump_stats(cprofile_file)
+        if file_name.endswith('.json'):
+            import json
+            fp = open(file_name, 'w')
+            json.dump({'command': sys.argv, 'seconds': time.time() - self.started,
+                       'cprofile_phase': slowest,
+                       'phases': [dict([(c, record[c]) for c in columns])
+                                  for record in records]}, fp, indent = 1)
+            fp.close()
+        else:
+            pd.DataFrame(records, columns = columns).to_csv(file_name, index = False)
+
 class Param:
     analyses = dict()
 
@@ -554,9 +2882,13 @@ class Param:
         self.display = display
         self.typestr = typestr
         self.setting = setting
+        self.isNumeric = (self.typestr == 'numeric')
+        if self.isNumeric:
+            # The columns are read as strings if any parameter is non-numeric
+            minimum = float(minimum)
+            maximum = float(maximum)
         self.minimum = minimum
         self.maximum = maximum
-        self.isNumeric = (self.typestr == 'numeric')
         self.isDynamic = (self.isNumeric and (self.minimum < self.maximum))
         self.isConstant = (self.minimum == self.maximum)
         self.done_analysis = False
@@ -656,9 +2988,11 @@ class ParamOption:
         return(s)
 
     def abc(self, df, metrics):
-        s = self.select(df)
+        with PhaseProfile.phase('select', len(df.index), option = self.name):
+            s = self.select(df)
         if(len(s) > 0):
-            abc = BruteABC(s, self.paramdf, metrics)
+            with PhaseProfile.phase('construct', len(s.index), option = self.name):
+                abc = BruteABC(s, self.paramdf, metrics)
         else:
             abc = None
         return(abc)
@@ -682,50 +3016,193 @@ class ParamOption:
                   legend_pos = _DEFAULT_LEGEND_POS,
                   x_label = _DEFAULT_EP_LABEL,
                   y_label = _DEFAULT_EVIDENCE_LABEL,
-                  font_size = _DEFAULT_FONT_SIZE):
+                  font_size = _DEFAULT_FONT_SIZE,
+                  processes = 1):
 
         if line_colours == []:
             line_colours = _DEFAULT_LINE_COLOURS
 
         abcs = [paramopts[i].abc(data, metrics) for i in range(len(paramopts))]
 
+        tasks = []
         for j in range(len(metrics)):
-            for i in range(len(abcs)):
-                if(not abcs[i] is None):
-                    xdata = abcs[i].getEpsilons(j, scaled, log)
-                    data = abcs[i].getEvidences(j, log, ratio)
-                    plt.plot(xdata, (data), linewidth = 2,
-                            linestyle = '-', color = line_colours[i],
-                            label = paramopts[i].name)
-
-            plt.title('Metric %i (%s)'%(j + 1, metrics['display'][j]))
-            plt.xlabel(x_label)
-            plt.ylabel(y_label)
-            legend = plt.legend(loc = legend_pos, shadow = False, frameon = False,
-                                fontsize = font_size) #, markerfirst = False)
-            if not log:
-                plt.plot([0, 1], [1, 1], linestyle = 'dashed', color = '#000000')
-            plt.xlim([0, 1])
-            plt.savefig(BruteABC.mkname('%s_%s.%s'%(image_file[:-4],
-                        metrics['metric'][j], image_file[-3:])))
-            plt.close()
+            series = [(abcs[i].getEpsilons(j, scaled, log), abcs[i].getEvidences(j, log, ratio),
+                       paramopts[i].name, line_colours[i], '-')
+                      for i in range(len(abcs)) if not abcs[i] is None]
+            tasks.append(('lines', [BruteABC.mkname('%s_%s.%s'%(image_file[:-4],
+                                                                metrics['metric'][j],
+                                                                image_file[-3:])),
+                                    series, x_label, y_label, legend_pos, font_size,
+                                    'Metric %i (%s)'%(j + 1, metrics['display'][j]),
+                                    not log, [0, 1]]))
+        with PhaseProfile.phase('render'):
+            PhaseProfile.render(tasks, processes)
 
 
 if __name__ == "__main__":
-    if(len(sys.argv) < 2):
-        sys.stderr.write("Usage: bruteABC.py calibrate <run data> <metrics file> "
+    # Options come after the command and before its other arguments
+    argv = sys.argv[0:2]
+    accept = 'epsilon'
+    accept_value = None
+    replicates = False
+    profiles = None
+    cube = None
+    triangles = None
+    processes = 1
+    kde = None
+    bandwidth = _DEFAULT_BANDWIDTH
+    summaries = None
+    adjust = False
+    samples = None
+    importance = None
+    ess = None
+    convergence = None
+    permutations = 0
+    emulate = None
+    draws = _DEFAULT_EMULATOR_DRAWS
+    timings = None
+    cprofile = None
+    split = None
+    bootstraps = _DEFAULT_BOOTSTRAPS
+    i = 2
+    while i < len(sys.argv) and sys.argv[i][0:1] == '-':
+        if sys.argv[i] == '-pareto' and i + 1 < len(sys.argv):
+            accept = 'pareto'
+            accept_value = int(sys.argv[i + 1])
+            i = i + 2
+        elif sys.argv[i] == '-nearest' and i + 1 < len(sys.argv):
+            accept = 'nearest'
+            accept_value = int(sys.argv[i + 1])
+            i = i + 2
+        elif sys.argv[i] == '-quantile' and i + 1 < len(sys.argv):
+            accept = 'quantile'
+            accept_value = float(sys.argv[i + 1])
+            i = i + 2
+        elif sys.argv[i] == '-replicates':
+            replicates = True
+            i = i + 1
+        elif sys.argv[i] == '-evprofiles' and i + 1 < len(sys.argv):
+            profiles = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-cube' and i + 1 < len(sys.argv):
+            cube = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-triangles' and i + 1 < len(sys.argv):
+            triangles = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-processes' and i + 1 < len(sys.argv):
+            processes = int(sys.argv[i + 1])
+            i = i + 2
+        elif sys.argv[i] == '-kde' and i + 1 < len(sys.argv):
+            kde = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-bandwidth' and i + 1 < len(sys.argv):
+            bandwidth = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-summaries' and i + 1 < len(sys.argv):
+            summaries = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-importance' and i + 1 < len(sys.argv):
+            importance = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-ess' and i + 1 < len(sys.argv):
+            ess = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-convergence' and i + 1 < len(sys.argv):
+            convergence = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-permutations' and i + 1 < len(sys.argv):
+            permutations = int(sys.argv[i + 1])
+            i = i + 2
+        elif sys.argv[i] == '-timings' and i + 1 < len(sys.argv):
+            timings = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-cprofile' and i + 1 < len(sys.argv):
+            cprofile = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-emulate' and i + 1 < len(sys.argv):
+            emulate = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-draws' and i + 1 < len(sys.argv):
+            draws = int(sys.argv[i + 1])
+            i = i + 2
+        elif sys.argv[i] == '-adjust':
+            adjust = True
+            i = i + 1
+        elif sys.argv[i] == '-samples' and i + 1 < len(sys.argv):
+            samples = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-split' and i + 1 < len(sys.argv):
+            split = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-bootstraps' and i + 1 < len(sys.argv):
+            bootstraps = int(sys.argv[i + 1])
+            i = i + 2
+        else:
+            sys.stderr.write("Option %s not recognized\n"%(sys.argv[i]))
+            sys.exit(1)
+    argv.extend(sys.argv[i:])
+    if timings is not None:
+        PhaseProfile(cprofile = (cprofile is not None)).activate()
+
+    if(len(argv) < 2):
+        sys.stderr.write("Usage: bruteABC.py calibrate [-pareto <layers> | "
+                         + "-nearest <runs> | -quantile <percent>] [-replicates] "
+                         + "[-evprofiles <file stem>] [-cube <npz file>] "
+                         + "[-triangles <npz file>] [-processes <n>] "
+                         + "[-kde <file stem> [-bandwidth <rule>]] "
+                         + "[-summaries <CSV file>] "
+                         + "[-adjust] [-samples <CSV file>] "
+                         + "[-importance <weight column>] [-ess <CSV file>] "
+                         + "[-emulate <file stem> [-draws <n>]] "
+                         + "[-convergence <CSV file> [-permutations <n>]] "
+                         + "[-timings <report file> [-cprofile <stats file>]] "
+                         + "<run data> <metrics file> "
                          + "<parameter file> <save evidence file> "
                          + "<save evidence ratio file> [<plot log evidence "
                          + "ratio file> <plot evidence ratio file> <triangle "
                          + "plots file> <posterior plots file (no suffix)>]\n")
-        sys.stderr.write("\nOR   : bruteABC.py compare <run data> <metrics file> "
+        sys.stderr.write("\nOR   : bruteABC.py compare [-processes <n>] [-timings <report file> "
+                         + "[-cprofile <stats file>]] "
+                         + "<run data> <metrics file> "
                          + "<plot evidence ratio file> <parameter files...>\n")
+        sys.stderr.write("\nOR   : bruteABC.py normalise <run data> <metrics file> "
+                         + "<parameter file> <save evidence file> "
+                         + "<save evidence ratio file> <metrics variant files...>\n")
+        sys.stderr.write("\nOR   : bruteABC.py targets [-replicates] "
+                         + "[-importance <weight column>] "
+                         + "<run data> <metrics file> "
+                         + "<parameter file> <targets file> <save evidence file> "
+                         + "<save evidence ratio file>\n")
+        sys.stderr.write("\nOR   : bruteABC.py split "
+                         + "[-split <label column>] [-bootstraps <n>] "
+                         + "[-pareto <layers> | -nearest <runs> | -quantile <percent>] "
+                         + "[-replicates] [-importance <weight column>] [-adjust] "
+                         + "[-processes <n>] [-timings <report file> "
+                         + "[-cprofile <stats file>]] <run data> [<second run data>] "
+                         + "<metrics file> <parameter file> <save evidence comparison file> "
+                         + "<save test file> [<plot files (no suffix)> <suffix>]\n")
+        sys.stderr.write("\nOR   : bruteABC.py plotcube [-processes <n>] <npz file> "
+                         + "<posterior plots file (no suffix)> <suffix>\n")
+        sys.stderr.write("\nOR   : bruteABC.py plottriangles [-processes <n>] <npz file> "
+                         + "<triangle plots file>\n")
         sys.exit(1)
 
-    if(sys.argv[1] == 'calibrate'):
-
-        if(len(sys.argv) != 7 and len(sys.argv) != 11):
-            sys.stderr.write("Usage: bruteABC.py calibrate <run data> <metrics file> "                     + "<parameter file> <save evidence file> "
+    if(argv[1] == 'calibrate'):
+
+        if(len(argv) != 7 and len(argv) != 11):
+            sys.stderr.write("Usage: bruteABC.py calibrate [-pareto <layers> | "
+                             + "-nearest <runs> | -quantile <percent>] [-replicates] "
+                             + "[-evprofiles <file stem>] [-cube <npz file>] "
+                             + "[-triangles <npz file>] [-processes <n>] "
+                             + "[-kde <file stem> [-bandwidth <rule>]] "
+                             + "[-summaries <CSV file>] "
+                             + "[-adjust] [-samples <CSV file>] "
+                             + "[-importance <weight column>] [-ess <CSV file>] "
+                             + "[-emulate <file stem> [-draws <n>]] "
+                             + "[-convergence <CSV file> [-permutations <n>]] "
+                             + "[-timings <report file> [-cprofile <stats file>]] "
+                             + "<run data> <metrics file> "
                              + "<parameter file> <save evidence file> "
                              + "<save evidence ratio file> [<plot log evidence "
                              + "ratio file> <plot evidence ratio file> <triangle "
@@ -733,60 +3210,270 @@ if __name__ == "__main__":
             sys.exit(1)
 
 
-        if(not os.path.exists(sys.argv[2])):
-            sys.stderr.write("Run data file %s does not exist\n"%(sys.argv[2]))
+        if(not os.path.exists(argv[2])):
+            sys.stderr.write("Run data file %s does not exist\n"%(argv[2]))
             sys.exit(1)
 
-        if(not os.path.exists(sys.argv[3])):
-            sys.stderr.write("Metrics file %s does not exist\n"%(sys.argv[3]))
+        if(not os.path.exists(argv[3])):
+            sys.stderr.write("Metrics file %s does not exist\n"%(argv[3]))
             sys.exit(1)
 
-        if(not os.path.exists(sys.argv[4])):
-            sys.stderr.write("Parameter list file %s does not exist\n"%(sys.argv[4]))
+        if(not os.path.exists(argv[4])):
+            sys.stderr.write("Parameter list file %s does not exist\n"%(argv[4]))
             sys.exit(1)
 
-        df = pd.read_csv(sys.argv[2], sep = ',', header = 0)
-        metrics = pd.read_csv(sys.argv[3], sep = ',', header = 0)
-        params = pd.read_csv(sys.argv[4], sep = ',', header = 0)
-
-        BruteABC.ckdata(df, params, metrics, sys.argv[2], sys.argv[4], sys.argv[5])
-
-        brute = BruteABC(df, params, metrics)
-        brute.saveEvidences(sys.argv[5])
-        brute.saveEvidenceRatios(sys.argv[6])
-
-        if(len(sys.argv) == 11):
-            suffix = (sys.argv[7])[-3:]
-            brute.plotScaledLogEvidenceRatio(sys.argv[7])
-            brute.plotScaledEvidenceRatio(sys.argv[8])
-            brute.trianglePlots(sys.argv[9])
-            brute.posteriorPlots(sys.argv[10], suffix)
+        with PhaseProfile.phase('read') as record:
+            df = pd.read_csv(argv[2], sep = ',', header = 0)
+            record['rows'] = len(df.index)
+        metrics = pd.read_csv(argv[3], sep = ',', header = 0)
+        params = pd.read_csv(argv[4], sep = ',', header = 0)
+
+        BruteABC.ckdata(df, params, metrics, argv[2], argv[4], argv[5])
+
+        n_rows = len(df.index)
+        with PhaseProfile.phase('construct', n_rows):
+            brute = BruteABC(df, params, metrics)
+        with PhaseProfile.phase('weights', n_rows):
+            if replicates:
+                brute.groupReplicates()
+            if importance is not None:
+                brute.setImportance(importance)
+        with PhaseProfile.phase('acceptance', n_rows):
+            brute.setAcceptance(accept, accept_value)
+        brute.setAdjustment(adjust)
+        with PhaseProfile.phase('save_evidences', n_rows):
+            brute.saveEvidences(argv[5])
+            brute.saveEvidenceRatios(argv[6])
+        if profiles is not None:
+            with PhaseProfile.phase('save_profiles', n_rows):
+                brute.saveParameterProfiles(profiles + ".csv")
+        if cube is not None:
+            with PhaseProfile.phase('save_cube', n_rows):
+                brute.savePosteriorCube(cube)
+        if triangles is not None and len(argv) != 11:
+            with PhaseProfile.phase('save_triangles', n_rows):
+                brute.saveTriangleHistograms(triangles, processes = processes)
+        if kde is not None:
+            with PhaseProfile.phase('save_kde', n_rows):
+                brute.saveKDEPosteriors(kde, rule = bandwidth)
+        if summaries is not None:
+            with PhaseProfile.phase('save_summaries', n_rows):
+                brute.saveSummaries(summaries)
+        if samples is not None:
+            with PhaseProfile.phase('save_samples', n_rows):
+                brute.saveSamples(samples)
+        if ess is not None:
+            with PhaseProfile.phase('save_ess', n_rows):
+                brute.saveEffectiveSampleSizes(ess)
+        if emulate is not None:
+            with PhaseProfile.phase('emulate', n_rows):
+                brute.emulate(draws = draws)
+                brute.saveEmulation(emulate)
+        if convergence is not None:
+            with PhaseProfile.phase('convergence', n_rows):
+                converged = brute.saveConvergence(convergence, permutations = permutations)
+
+        if(len(argv) == 11):
+            suffix = (argv[7])[-3:]
+            brute.deferFigures()
+            with PhaseProfile.phase('plot_evidences', n_rows):
+                brute.plotScaledLogEvidenceRatio(argv[7])
+                brute.plotScaledEvidenceRatio(argv[8])
+            with PhaseProfile.phase('plot_triangles', n_rows):
+                brute.trianglePlots(argv[9], processes = processes, hist_file = triangles)
+            with PhaseProfile.phase('plot_posteriors', n_rows):
+                brute.posteriorPlots(argv[10], suffix, kde = (kde is not None),
+                                     rule = bandwidth)
+            if kde is not None:
+                with PhaseProfile.phase('plot_kde', n_rows):
+                    brute.plotKDETriangles('%s_triangle.%s'%(kde, suffix), rule = bandwidth)
+            if profiles is not None:
+                with PhaseProfile.phase('plot_profiles', n_rows):
+                    brute.plotParameterProfiles(profiles, suffix)
+            if emulate is not None:
+                with PhaseProfile.phase('plot_emulation', n_rows):
+                    brute.plotEmulatedEvidences('%s_evidence.%s'%(emulate, suffix))
+            if convergence is not None:
+                with PhaseProfile.phase('plot_convergence', n_rows):
+                    brute.plotConvergence('%s.%s'%(os.path.splitext(convergence)[0], suffix),
+                                          converged)
+            with PhaseProfile.phase('render'):
+                brute.renderFigures(processes)
+
+    if(argv[1] == 'split'):
+
+        n_data = 1 if split is not None else 2
+        if(len(argv) != 6 + n_data and len(argv) != 8 + n_data):
+            sys.stderr.write("Usage: bruteABC.py split "
+                             + "[-split <label column>] [-bootstraps <n>] "
+                             + "[-pareto <layers> | -nearest <runs> | -quantile <percent>] "
+                             + "[-replicates] [-importance <weight column>] [-adjust] "
+                             + "[-processes <n>] [-timings <report file> "
+                             + "[-cprofile <stats file>]] <run data> [<second run data>] "
+                             + "<metrics file> <parameter file> <save evidence comparison file> "
+                             + "<save test file> [<plot files (no suffix)> <suffix>]\n")
+            sys.exit(1)
 
-    if(sys.argv[1] == 'compare'):
+        kinds = ["Run data" for k in range(n_data)] + ["Metrics", "Parameter list"]
+        for k in range(len(kinds)):
+            if(not os.path.exists(argv[2 + k])):
+                sys.stderr.write("%s file %s does not exist\n"%(kinds[k], argv[2 + k]))
+                sys.exit(1)
 
-        if(len(sys.argv) < 6):
-            sys.stderr.write("Usage: bruteABC.py compare <run data> <metrics file> "
+        with PhaseProfile.phase('read') as record:
+            if split is not None:
+                df = pd.read_csv(argv[2], sep = ',', header = 0)
+            else:
+                # Label the runs in the two files by position: 0 for the first, 1 for the second
+                split = _DEFAULT_SPLIT_LABEL
+                halves = [pd.read_csv(argv[k], sep = ',', header = 0) for k in [2, 3]]
+                for k in range(2):
+                    if split in halves[k].columns:
+                        sys.stderr.write("Run data file %s already has a %s column (use "
+                                         "-split instead)\n"%(argv[2 + k], split))
+                        sys.exit(1)
+                    halves[k][split] = k
+                df = pd.concat(halves, ignore_index = True, sort = False)
+            record['rows'] = len(df.index)
+        metrics = pd.read_csv(argv[2 + n_data], sep = ',', header = 0)
+        params = pd.read_csv(argv[3 + n_data], sep = ',', header = 0)
+
+        BruteABC.ckdata(df, params, metrics, argv[2], argv[3 + n_data], argv[2 + n_data])
+
+        n_rows = len(df.index)
+        with PhaseProfile.phase('construct', n_rows):
+            brute = BruteABC(df, params, metrics)
+        with PhaseProfile.phase('weights', n_rows):
+            if replicates:
+                brute.groupReplicates()
+            if importance is not None:
+                brute.setImportance(importance)
+        with PhaseProfile.phase('acceptance', n_rows):
+            brute.setAcceptance(accept, accept_value)
+        brute.setAdjustment(adjust)
+        with PhaseProfile.phase('split_evidences', n_rows):
+            compared = brute.saveSplitEvidences(argv[4 + n_data], split, bootstraps)
+        with PhaseProfile.phase('split_tests', n_rows):
+            brute.saveSplitTests(argv[5 + n_data], split)
+        if(len(argv) == 8 + n_data):
+            brute.deferFigures()
+            with PhaseProfile.phase('plot_split', n_rows):
+                brute.plotSplitComparison(argv[6 + n_data], argv[7 + n_data], split, compared)
+            with PhaseProfile.phase('render'):
+                brute.renderFigures(processes)
+
+    if(argv[1] == 'compare'):
+
+        if(len(argv) < 6):
+            sys.stderr.write("Usage: bruteABC.py compare [-processes <n>] [-timings <report file> "
+                             + "[-cprofile <stats file>]] "
+                             + "<run data> <metrics file> "
                              + "<plot evidence ratio file> <parameter files...>\n")
             sys.exit(1)
 
 
-        if(not os.path.exists(sys.argv[2])):
-            sys.stderr.write("Run data file %s does not exist\n"%(sys.argv[2]))
+        if(not os.path.exists(argv[2])):
+            sys.stderr.write("Run data file %s does not exist\n"%(argv[2]))
             sys.exit(1)
 
-        if(not os.path.exists(sys.argv[3])):
-            sys.stderr.write("Metrics file %s does not exist\n"%(sys.argv[3]))
+        if(not os.path.exists(argv[3])):
+            sys.stderr.write("Metrics file %s does not exist\n"%(argv[3]))
             sys.exit(1)
 
-        df = pd.read_csv(sys.argv[2], sep = ',', header = 0)
-        metrics = pd.read_csv(sys.argv[3], sep = ",", header = 0)
-        plotfile = sys.argv[4]
-        params = ParamOption.buildarray(sys.argv[5:])
+        with PhaseProfile.phase('read') as record:
+            df = pd.read_csv(argv[2], sep = ',', header = 0)
+            record['rows'] = len(df.index)
+        metrics = pd.read_csv(argv[3], sep = ",", header = 0)
+        plotfile = argv[4]
+        params = ParamOption.buildarray(argv[5:])
 
         for i in range(len(params)):
             BruteABC.ckdata(df, params[i].paramdf, metrics,
-                            sys.argv[2], sys.argv[5 + i], sys.argv[3])
+                            argv[2], argv[5 + i], argv[3])
+
+        ParamOption.plotarray(params, df, metrics, plotfile, processes = processes)
+
+    if(argv[1] == 'normalise'):
+
+        if(len(argv) < 8):
+            sys.stderr.write("Usage: bruteABC.py normalise <run data> <metrics file> "
+                             + "<parameter file> <save evidence file> "
+                             + "<save evidence ratio file> <metrics variant files...>\n")
+            sys.exit(1)
+
+        for i in range(2, len(argv)):
+            if(i != 5 and i != 6 and not os.path.exists(argv[i])):
+                sys.stderr.write("File %s does not exist\n"%(argv[i]))
+                sys.exit(1)
+
+        df = pd.read_csv(argv[2], sep = ',', header = 0)
+        metrics = pd.read_csv(argv[3], sep = ',', header = 0)
+        params = pd.read_csv(argv[4], sep = ',', header = 0)
+        variants = [pd.read_csv(argv[i], sep = ',', header = 0)
+                    for i in range(7, len(argv))]
+
+        BruteABC.ckdata(df, params, metrics, argv[2], argv[4], argv[3])
+
+        brute = BruteABC(df, params, metrics)
+        brute.saveVariantEvidences(argv[5], variants, argv[7:])
+        brute.saveVariantEvidences(argv[6], variants, argv[7:], ratio = True)
+
+    if(argv[1] == 'targets'):
+
+        if(len(argv) != 8):
+            sys.stderr.write("Usage: bruteABC.py targets [-replicates] "
+                             + "[-importance <weight column>] "
+                             + "<run data> <metrics file> "
+                             + "<parameter file> <targets file> <save evidence file> "
+                             + "<save evidence ratio file>\n")
+            sys.exit(1)
+
+        for i in range(2, 6):
+            if(not os.path.exists(argv[i])):
+                sys.stderr.write("File %s does not exist\n"%(argv[i]))
+                sys.exit(1)
+
+        df = pd.read_csv(argv[2], sep = ',', header = 0)
+        metrics = pd.read_csv(argv[3], sep = ',', header = 0)
+        params = pd.read_csv(argv[4], sep = ',', header = 0)
+
+        BruteABC.ckdata(df, params, metrics, argv[2], argv[4], argv[3])
+
+        brute = BruteABC(df, params, metrics)
+        if replicates:
+            brute.groupReplicates()
+        if importance is not None:
+            brute.setImportance(importance)
+        (names, targets) = BruteABC.readTargets(argv[5], brute.headers)
+        brute.saveTargetEvidences(argv[6], targets, names)
+        brute.saveTargetEvidences(argv[7], targets, names, ratio = True)
+
+    if(argv[1] == 'plotcube'):
+
+        if(len(argv) != 5):
+            sys.stderr.write("Usage: bruteABC.py plotcube [-processes <n>] <npz file> "
+                             + "<posterior plots file (no suffix)> <suffix>\n")
+            sys.exit(1)
+
+        if(not os.path.exists(argv[2])):
+            sys.stderr.write("Posterior cube file %s does not exist\n"%(argv[2]))
+            sys.exit(1)
+
+        BruteABC.plotPosteriorCube(argv[2], argv[3], argv[4], processes = processes)
+
+    if(argv[1] == 'plottriangles'):
+
+        if(len(argv) != 4):
+            sys.stderr.write("Usage: bruteABC.py plottriangles [-processes <n>] <npz file> "
+                             + "<triangle plots file>\n")
+            sys.exit(1)
+
+        if(not os.path.exists(argv[2])):
+            sys.stderr.write("Triangle histograms file %s does not exist\n"%(argv[2]))
+            sys.exit(1)
 
-        ParamOption.plotarray(params, df, metrics, plotfile)
+        BruteABC.plotTriangleHistograms(argv[2], argv[3], processes = processes)
 
+    if timings is not None:
+        PhaseProfile.active.save(timings, cprofile)
     sys.exit(0)
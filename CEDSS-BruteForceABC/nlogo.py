@@ -34,6 +34,26 @@ Run from the command line, it can be used to:
 
   You can then submit the jobs with qsub <SGE submission script>
 
+  By default there is one SGE task per sample, in sample order. To balance
+  the tasks' wall times instead, give a CSV file of telemetry from past runs
+  (such as the -runs output of runcost.py), the number of tasks, and a file
+  to save the task to experiment mapping to:
+
+  ./nlogo.py <nlogo file> montq <parameter file> <tick number to stop at>
+                                <number of samples> <experiment XML file>
+                                <file to save SGE submission script to>
+                                <telemetry CSV file> <number of tasks>
+                                <file to save task mapping CSV to>
+
+  A log-linear model of wall time (the 'mean_seconds' or 'seconds' column)
+  is fitted to the parameter columns of the telemetry file that match the
+  model's parameters (ignoring case and punctuation, so 'max.links' and
+  'maxlinks' match max-links) and have numeric or boolean values. The
+  samples are then packed into the tasks, longest predicted first, each
+  going to the task with the least predicted time so far, and each task runs
+  its experiments in turn. The mapping file has a row for each experiment
+  with its task and predicted wall time.
+
 A typical workflow would be to run this with param and then montq, before
 qsubbing the submission script. Once you've extracted the results you want
 from the outputs, you could then use, for example bruteABC.py to analyse
@@ -75,8 +95,11 @@ __author__ = "Gary Polhill"
 # Imports
 import io
 import os
+import re
 import sys
+import csv
 import math
+import heapq
 import random as rnd
 import xml.etree.ElementTree as xml
 
@@ -770,7 +793,7 @@ class Experiment:
         for p in param:
             if isinstance(p, Parameter):
                 valuearr = []
-                if p.datatypeStr() == 'string' and not p.settingStr().startswith('"') and not p.settingStr().startsWith('&quot;'):
+                if p.datatypeStr() == 'string' and not p.settingStr().startswith('"') and not p.settingStr().startswith('&quot;'):
                     valuearr.append('"' + p.settingStr() + '"')
                 else:
                     valuearr.append(p.settingStr())
@@ -1101,6 +1124,139 @@ class NetlogoModel:
             for expt in self.behav:
                 print "\t" + expt.name
 
+class RuntimeModel:
+    """
+    A log-linear model of the wall time of an experiment from its parameter
+    settings, fitted to telemetry from past runs, used to pack experiments
+    into tasks with similar predicted wall times
+    """
+    def __init__(self, variables, means, coefficients):
+        self.variables = variables
+        self.means = means
+        self.coefficients = coefficients
+
+    @staticmethod
+    def key(name):
+        """
+        Return the name without case or punctuation, for matching telemetry
+        columns to parameters
+        """
+        return re.sub(r'[\W_]', '', name).lower()
+
+    @staticmethod
+    def number(value):
+        """
+        Return the value as a float (booleans as 0 or 1), or None if it is not
+        numeric
+        """
+        if isinstance(value, bool) or str(value).lower() in ['true', 'false']:
+            return 1.0 if str(value).lower() == 'true' else 0.0
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def read(file_name, params):
+        """
+        Fit a RuntimeModel to the telemetry in the CSV file, using the columns
+        matching the parameters (a dictionary from variable name) with numeric
+        values that vary, and log of the 'mean_seconds' column (or 'seconds'
+        if there isn't one) as the response. Rows without a positive wall time
+        are ignored.
+        """
+        try:
+            fp = io.open(file_name, 'rb' if sys.version_info[0] < 3 else 'r')
+        except IOError as e:
+            sys.stderr.write("Error opening file %s: %s\n"%(file_name, e.strerror))
+            return False
+        rows = [row for row in csv.DictReader(fp)]
+        fp.close()
+        if len(rows) == 0:
+            sys.stderr.write("No telemetry in file %s\n"%(file_name))
+            return False
+
+        cost = 'mean_seconds' if 'mean_seconds' in rows[0] else 'seconds'
+        if cost not in rows[0]:
+            sys.stderr.write("No seconds or mean_seconds column in file %s\n"%(file_name))
+            return False
+        rows = [row for row in rows
+                if RuntimeModel.number(row[cost]) is not None and RuntimeModel.number(row[cost]) > 0]
+        if len(rows) == 0:
+            sys.stderr.write("No runs with a positive %s in file %s\n"%(cost, file_name))
+            return False
+        columns = {}
+        for column in rows[0].keys():
+            columns[RuntimeModel.key(column)] = column
+        variables = []
+        for variable in sorted(params.keys()):
+            column = columns.get(RuntimeModel.key(variable))
+            if column is None:
+                continue
+            values = [RuntimeModel.number(row[column]) for row in rows]
+            if None not in values and len(set(values)) > 1:
+                variables.append((variable, column))
+        if len(rows) <= len(variables) + 1:
+            sys.stderr.write("Warning: too few runs in %s to fit a runtime model; "
+                             "predicting the same time for every experiment\n"%(file_name))
+            variables = []
+
+        import numpy as np
+        x = np.array([[1.0] + [RuntimeModel.number(row[column]) for (variable, column) in variables]
+                      for row in rows])
+        y = np.log([RuntimeModel.number(row[cost]) for row in rows])
+        coefficients = np.linalg.lstsq(x, y, rcond = None)[0]
+        return RuntimeModel([variable for (variable, column) in variables],
+                            list(x[:, 1:].mean(axis = 0)), list(coefficients))
+
+    def predict(self, expt):
+        """
+        Return the predicted wall time of the experiment, using the mean
+        telemetry value of any variable the experiment does not set
+        """
+        settings = {}
+        for v in expt.enumeratedValueSet:
+            if len(v.values) > 0:
+                settings[v.variable] = RuntimeModel.number(v.values[0])
+        log_seconds = self.coefficients[0]
+        for i in range(0, len(self.variables)):
+            value = settings.get(self.variables[i])
+            log_seconds += self.coefficients[i + 1] * (self.means[i] if value is None else value)
+        return math.exp(log_seconds)
+
+    def pack(self, expts, n_tasks):
+        """
+        Pack the experiments into tasks, longest predicted wall time first,
+        each to the task with the least predicted wall time so far. Returns a
+        list of (task number from 1, experiment, predicted wall time) in task
+        order.
+        """
+        predicted = sorted([(self.predict(expt), i) for i, expt in enumerate(expts)],
+                           reverse = True)
+        loads = [(0.0, task) for task in range(1, n_tasks + 1)]
+        tasks = []
+        for (seconds, i) in predicted:
+            (load, task) = heapq.heappop(loads)
+            tasks.append((task, expts[i], seconds))
+            heapq.heappush(loads, (load + seconds, task))
+        return sorted(tasks, key = lambda t: (t[0], t[1].name))
+
+    @staticmethod
+    def writeTasks(file_name, tasks):
+        """
+        Save the task to experiment mapping from pack() as a CSV file
+        """
+        try:
+            fp = io.open(file_name, "w")
+        except IOError as e:
+            sys.stderr.write("Error creating file %s: %s\n"%(file_name, e.strerror))
+            return False
+        fp.write(u"task,experiment,predicted_seconds\n")
+        for (task, expt, seconds) in tasks:
+            fp.write(u"%d,%s,%f\n"%(task, expt.name, seconds))
+        fp.close()
+        return True
+
 class Sample:
     def __init__(self, param, datatype, setting, minimum, maximum):
         self.param = param
@@ -1169,11 +1325,55 @@ if __name__ == "__main__":
     elif cmd == 'expts':
         model.printExperiments()
     elif cmd == 'monte' or cmd == 'montq':
+        if cmd == 'montq' and len(sys.argv) != 8 and len(sys.argv) != 11:
+            sys.stderr.write("Usage: nlogo.py <nlogo file> montq <parameter file> <tick number to stop at> "
+                             "<number of samples> <experiment XML file> <SGE submission script> "
+                             "[<telemetry CSV file> <number of tasks> <task mapping CSV file>]\n")
+            sys.exit(1)
         samples = Sample.read(sys.argv[3], model.getParameters())
         expt = Experiment.fromWidgets(model.widgets, "x", int(sys.argv[4]))
         expts = expt.withNSamples(samples, int(sys.argv[5]), True)
         Experiment.writeExperiments(sys.argv[6], expts)
-        if cmd == 'montq':
+        if cmd == 'montq' and len(sys.argv) == 11:
+            runtime = RuntimeModel.read(sys.argv[8], model.getParameters())
+            if runtime == False:
+                sys.exit(1)
+            tasks = runtime.pack(expts, min(int(sys.argv[9]), len(expts)))
+            if not RuntimeModel.writeTasks(sys.argv[10], tasks):
+                sys.exit(1)
+            loads = {}
+            for (task, x, seconds) in tasks:
+                loads[task] = loads.get(task, 0.0) + seconds
+            print "Packed %d experiments into %d tasks using %s: predicted wall time %.0fs (longest task) to %.0fs (shortest)" \
+                % (len(expts), len(loads), ", ".join(runtime.variables) if len(runtime.variables) > 0 else "no parameters",
+                   max(loads.values()), min(loads.values()))
+            try:
+                fp = io.open(sys.argv[7], "w")
+            except IOError as e:
+                sys.stderr.write("Error creating file %s: %s\n"%(sys.argv[7], e.strerror))
+                sys.exit(1)
+            fp.write(u'''#!/bin/sh
+#$ -cwd
+#$ -t 1-{ntasks}
+#$ -pe smp {threads}
+export JAVA_HOME="{java_home}"
+wd=`pwd`
+cd "{nlogo_home}"
+xml="$wd/{xml}"
+for xpt in `awk -F, -v task=$SGE_TASK_ID '$1 == task {{ print $2 }}' "$wd/{tasks}"`
+do
+  out="$wd/$xpt.out"
+  csv="$wd/$xpt-table.csv"
+  "{nlogo_invoke}" --model "$wd/{model}" --setup-file "$xml" --experiment "$xpt" --threads {threads} --table "$csv" > "$out" 2>&1
+done
+            '''.format(ntasks = len(loads), threads = 2,
+                        java_home = os.getenv('JAVA_HOME', '/usr/bin/java'),
+                        nlogo_home = os.getenv('NETLOGO_HOME', '/Applications/NetLogo 6.0.4'),
+                        nlogo_invoke = os.getenv('NETLOGO_INVOKE', '/Applications/NetLogo 6.0.4/netlogo-headless.sh'),
+                        xml = sys.argv[6], model = nlogo, tasks = sys.argv[10]))
+            fp.close()
+            os.chmod(sys.argv[7], 0775)
+        elif cmd == 'montq':
             try:
                 fp = io.open(sys.argv[7], "w")
             except IOError as e:
@@ -0,0 +1,397 @@
+#!/usr/bin/python
+"""runcost.py
+
+Harvests the cost of each run of the model from the files the sampling
+scripts in the CEDSS-ABC*-scripts directories leave behind, so that the
+parameter regions that are expensive (or fail) to simulate can be seen.
+
+Each run x-NNNN of sampleCEDSS.pl has a parameter file x-NNNN.csv (one
+'parameter,value' line per parameter), an x-NNNN.out and x-NNNN.err (or one
+of each per split, x-NNNN-splitXiX.out), and, for each rep k, setup output
+x-NNNN-k-stdout-setup.txt and x-NNNN-k-stderr-setup.txt and a directory
+x-NNNN-k containing the NetLogo files of each sub-run (prep) r: the setup
+file x-NNNN-k-r.xml, written just before the sub-run starts, its standard
+output and error x-NNNN-k-r.out and x-NNNN-k-r.err, and its output
+x-NNNN-k-output-r.csv. The wall time of a sub-run is taken from the
+modification times of its .xml and .out files, and that of the run from the
+parameter file to the last .out file, so the times are only as precise as
+the file system's (or archive's) timestamps -- a second for tar files. A
+sub-run has failed if its .err file is not empty, and has no output if its
+output file is missing or empty.
+
+The runs are read from the directories the runs were made in (which may
+contain many runs) and from the x-NNNN.tar.bz2 archives of finished runs
+(such as those in the example-output directories) without extracting them;
+archives found in a directory are read too. Sources are read in parallel
+with -processes.
+
+Usage: runcost.py [-processes <n>] [-runs <CSV file>] [-regions <CSV file>]
+                  [-bins <n>] <sub-run CSV file> <directory or archive...>
+
+The sub-run CSV file has a row for each sub-run with the run (rundir),
+split (if any run was split), rep, prep, start time, wall time (seconds),
+status ('ok', 'failed' or 'no output') and the first line of any error,
+followed by the run's parameter values. With -runs, a row for each run
+is saved with its status, numbers of sub-runs and failures, wall time,
+total setup time, mean sub-run wall time of the sub-runs that were ok, and
+the parameter values. With -regions, the runs are split into bins (default
+4) of equal numbers of runs on each parameter that varies (by choice, for
+non-numeric parameters), and the number of runs, mean and maximum mean
+sub-run wall time and proportion of runs with failures are saved for each
+bin of each parameter.
+
+Authors: Jonathan Gair (University of Edinburgh)
+         and Gary Polhill (The James Hutton Institute)
+Uses: numpy, pandas
+Licence: GNU General Public Licence v3 (see comments)
+"""
+# Copyright (C) 2018-2019  The James Hutton Institute & University of Edinburgh
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public Licence as published by
+# the Free Software Foundation, either version 3 of the Licence, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public Licence for more details.
+#
+# You should have received a copy of the GNU General Public Licence
+# along with this program.  If not, see <https://www.gnu.org/licences/>.
+import sys
+import os
+import re
+import tarfile
+import time
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+_DEFAULT_BINS = 4
+_ARCHIVES = ('.tar.bz2', '.tar.gz', '.tgz', '.tar')
+_MESSAGE_BYTES = 1024   # Bytes read from the start of non-empty error files
+_PARAMETER_BYTES = 65536
+_RUN_COLUMNS = ['rundir', 'status', 'subruns', 'failures', 'seconds', 'setup_seconds',
+                'mean_seconds', 'message']
+_SUBRUN_COLUMNS = ['rundir', 'split', 'rep', 'prep', 'start', 'seconds', 'status',
+                   'message']
+
+def isError(name):
+    """
+    Return whether the file (by name) is standard error of setup or a run
+    """
+    base = name.split('/')[-1]
+    return(base.endswith('.err') or base.startswith('stderr-')
+           or base.endswith('-stderr-setup.txt'))
+
+def readText(name, size, fp):
+    """
+    Return the start of the file's text if it is needed (a parameter file in
+    the top directory, or a non-empty error file), otherwise None
+    """
+    if '/' not in name and name.endswith('.csv') and size <= _PARAMETER_BYTES:
+        return(fp().read(_PARAMETER_BYTES).decode('utf-8', 'replace'))
+    if size > 0 and isError(name):
+        return(fp().read(_MESSAGE_BYTES).decode('utf-8', 'replace'))
+    return(None)
+
+def archiveListing(file_name):
+    """
+    Return a dictionary of the files in the archive, from the name to a
+    list of modification time, size and text (if needed, see readText()).
+    The archive is read once in order, so compressed archives are not
+    decompressed more than once.
+    """
+    listing = dict()
+    tar = tarfile.open(file_name, 'r:*')
+    for member in tar:
+        if not member.isfile():
+            continue
+        name = member.name[2:] if member.name.startswith('./') else member.name
+        listing[name] = [member.mtime, member.size,
+                         readText(name, member.size, lambda: tar.extractfile(member))]
+    tar.close()
+    return(listing)
+
+def directoryListing(dir_name, entries):
+    """
+    Return a dictionary of the files (as archiveListing()) among the entries
+    of the directory, including those in any entries that are directories
+    """
+    listing = dict()
+    for entry in entries:
+        path = os.path.join(dir_name, entry)
+        if os.path.isdir(path):
+            names = [entry + '/' + sub for sub in os.listdir(path)]
+        else:
+            names = [entry]
+        for name in names:
+            path = os.path.join(dir_name, name)
+            if os.path.islink(path) or not os.path.isfile(path):
+                continue
+            size = os.path.getsize(path)
+            listing[name] = [os.path.getmtime(path), size,
+                             readText(name, size, lambda: open(path, 'rb'))]
+    return(listing)
+
+def runStems(names):
+    """
+    Return the runs (stems x-NNNN) among the names of files in a directory
+    or archive: those with a parameter file x-NNNN.csv and either x-NNNN.out
+    or split outputs x-NNNN-splitXiX.out
+    """
+    outs = set()
+    for name in names:
+        if '/' not in name and name.endswith('.out'):
+            outs.add(re.sub(r'-splitX\d+X$', '', name[:-4]))
+    return(sorted([name[:-4] for name in names if '/' not in name and name.endswith('.csv')
+                   and name[:-4] in outs]))
+
+def firstLine(text):
+    """
+    Return the first non-blank line of the text
+    """
+    for line in text.split('\n'):
+        if line.strip() != '':
+            return(line.strip())
+    return('')
+
+def parameters(text):
+    """
+    Return a dictionary of the parameters in a sampleCEDSS.pl parameter file
+    """
+    params = dict()
+    for line in text.split('\n'):
+        if ',' not in line:
+            continue
+        (key, value) = line.strip().split(',', 1)
+        try:
+            params[key] = float(value)
+        except ValueError:
+            params[key] = value
+    return(params)
+
+def analyse(stem, listing):
+    """
+    Return a run record (a dictionary) and a list of sub-run records for the
+    run with the stem, from the listing of its files
+    """
+    params = parameters(listing[stem + '.csv'][2] or '')
+    subrun = re.compile('^(?P<run>' + re.escape(stem)
+                        + r'(?:-splitX(?P<split>\d+)X)?-(?P<rep>\d+))/(?P=run)-(?P<prep>\d+)\.xml$')
+    subruns = []
+    starts = dict()
+    messages = []
+    for name in sorted(listing.keys()):
+        match = subrun.match(name)
+        if match is None:
+            continue
+        run = match.group('run')
+        prep = match.group('prep')
+        start = listing[name][0]
+        starts[run] = min(start, starts.get(run, start))
+        record = {'rundir': stem, 'split': match.group('split'), 'rep': int(match.group('rep')),
+                  'prep': int(prep), 'seconds': None, 'message': None,
+                  'start': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start))}
+        out = listing.get('%s/%s-%s.out'%(run, run, prep))
+        err = listing.get('%s/%s-%s.err'%(run, run, prep))
+        output = listing.get('%s/%s-output-%s.csv'%(run, run, prep))
+        if out is not None:
+            record['seconds'] = out[0] - start
+        if err is not None and err[1] > 0:
+            record['status'] = 'failed'
+            record['message'] = firstLine(err[2] or '')
+            messages.append(record['message'])
+        elif output is None or output[1] == 0:
+            record['status'] = 'no output'
+        else:
+            record['status'] = 'ok'
+        record.update(params)
+        subruns.append(record)
+
+    setup = 0.0
+    for run in starts:
+        stdout = listing.get(run + '-stdout-setup.txt')
+        if stdout is not None:
+            setup += max(starts[run] - stdout[0], 0.0)
+        stderr = listing.get(run + '-stderr-setup.txt')
+        if stderr is not None and stderr[1] > 0:
+            messages.insert(0, firstLine(stderr[2] or ''))
+
+    outs = [listing[name] for name in listing
+            if re.match('^' + re.escape(stem) + r'(?:-splitX\d+X)?\.(out|err)$', name)]
+    for err in [f for f in outs if f[2] is not None]:
+        messages.insert(0, firstLine(err[2]))
+    ok = [s['seconds'] for s in subruns if s['status'] == 'ok' and s['seconds'] is not None]
+    failures = len([s for s in subruns if s['status'] != 'ok'])
+    record = {'rundir': stem, 'subruns': len(subruns), 'failures': failures,
+              'setup_seconds': setup, 'seconds': None,
+              'mean_seconds': np.mean(ok) if len(ok) > 0 else None,
+              'message': messages[0] if len(messages) > 0 else None}
+    if len(outs) > 0:
+        record['seconds'] = max([f[0] for f in outs]) - listing[stem + '.csv'][0]
+    if len(subruns) == 0:
+        record['status'] = 'no runs'
+    elif failures > 0 or len(messages) > 0:
+        record['status'] = 'failed'
+    else:
+        record['status'] = 'ok'
+    record.update(params)
+    return(record, subruns)
+
+def harvest(source):
+    """
+    Return the run records, sub-run records and any error reading the source,
+    which is an archive file name, or a directory name, the stems of the runs
+    in it, and the entries of the directory belonging to them. (This is a
+    function rather than a method so multiprocessing can call it.)
+    """
+    try:
+        if isinstance(source, tuple):
+            (dir_name, stems, entries) = source
+            listing = directoryListing(dir_name, entries)
+        else:
+            listing = archiveListing(source)
+            stems = runStems(listing.keys())
+    except (tarfile.TarError, IOError, OSError, EOFError) as e:
+        return([], [], str(e))
+    runs = []
+    subruns = []
+    for stem in stems:
+        (run, subrun) = analyse(stem, listing)
+        runs.append(run)
+        subruns.extend(subrun)
+    return(runs, subruns, None)
+
+def sources(paths):
+    """
+    Return the sources to harvest (see harvest()) from the command line:
+    archives, and directories, which are split into a source per run (with
+    the entries whose names start with the run's stem) and any archives in
+    them
+    """
+    found = []
+    for path in paths:
+        if not os.path.isdir(path):
+            found.append(path)
+            continue
+        entries = os.listdir(path)
+        stems = set(runStems(entries))
+        runs = dict()
+        for entry in entries:
+            if entry.endswith(_ARCHIVES) and os.path.isfile(os.path.join(path, entry)):
+                found.append(os.path.join(path, entry))
+                continue
+            # Assign the entry to the longest run stem it starts with
+            name = entry
+            while name not in stems and re.search(r'[-.][^-.]*$', name):
+                name = re.sub(r'[-.][^-.]*$', '', name)
+            if name in stems:
+                runs.setdefault(name, []).append(entry)
+        for stem in sorted(runs.keys()):
+            found.append((path, [stem], runs[stem]))
+    return(found)
+
+def regions(runs, bins = _DEFAULT_BINS):
+    """
+    Return a data frame of the cost of runs in bins of each parameter that
+    varies: quantile bins for numeric parameters, and each choice otherwise
+    """
+    params = [c for c in runs.columns if c not in _RUN_COLUMNS]
+    rows = []
+    for param in params:
+        values = runs[param]
+        if values.nunique() < 2:
+            continue
+        if values.dtype.kind in 'if':
+            groups = pd.qcut(values, bins, duplicates = 'drop')
+            keys = list(groups.cat.categories)
+        else:
+            groups = values
+            keys = sorted(values.dropna().unique())
+        for key in keys:
+            bin_runs = runs[groups == key]
+            rows.append([param, bin_runs[param].min(), bin_runs[param].max(),
+                         len(bin_runs.index),
+                         bin_runs['mean_seconds'].mean(), bin_runs['mean_seconds'].max(),
+                         (bin_runs['failures'] > 0).mean()])
+    return(pd.DataFrame(rows, columns = ['parameter', 'minimum', 'maximum', 'runs', 'mean_seconds',
+                                         'max_seconds', 'failure_rate']))
+
+if __name__ == "__main__":
+    processes = 1
+    runs_file = None
+    regions_file = None
+    bins = _DEFAULT_BINS
+    i = 1
+    while i < len(sys.argv) and sys.argv[i][0:1] == '-':
+        if sys.argv[i] == '-processes' and i + 1 < len(sys.argv):
+            processes = int(sys.argv[i + 1])
+            i = i + 2
+        elif sys.argv[i] == '-runs' and i + 1 < len(sys.argv):
+            runs_file = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-regions' and i + 1 < len(sys.argv):
+            regions_file = sys.argv[i + 1]
+            i = i + 2
+        elif sys.argv[i] == '-bins' and i + 1 < len(sys.argv):
+            bins = int(sys.argv[i + 1])
+            i = i + 2
+        else:
+            sys.stderr.write("Option %s not recognized\n"%(sys.argv[i]))
+            sys.exit(1)
+    argv = sys.argv[i:]
+
+    if len(argv) < 2:
+        sys.stderr.write("Usage: runcost.py [-processes <n>] [-runs <CSV file>] "
+                         + "[-regions <CSV file>] [-bins <n>] <sub-run CSV file> "
+                         + "<directory or archive...>\n")
+        sys.exit(1)
+
+    for path in argv[1:]:
+        if not os.path.exists(path):
+            sys.stderr.write("File %s does not exist\n"%(path))
+            sys.exit(1)
+
+    found = sources(argv[1:])
+    if processes > 1 and len(found) > 1:
+        pool = multiprocessing.Pool(min(processes, len(found)))
+        results = pool.map(harvest, found, chunksize = 1)
+        pool.close()
+        pool.join()
+    else:
+        results = [harvest(source) for source in found]
+
+    runs = []
+    subruns = []
+    for (source, (run, subrun, error)) in zip(found, results):
+        if error is not None:
+            sys.stderr.write("Cannot read %s: %s\n"
+                             %(source if not isinstance(source, tuple)
+                               else os.path.join(source[0], source[1][0]), error))
+        runs.extend(run)
+        subruns.extend(subrun)
+    if len(runs) == 0:
+        sys.stderr.write("No runs found in %s\n"%(", ".join(argv[1:])))
+        sys.exit(1)
+
+    runs = pd.DataFrame(runs)
+    params = sorted([c for c in runs.columns if c not in _RUN_COLUMNS])
+    runs = runs[_RUN_COLUMNS + params].sort_values('rundir')
+    subruns = pd.DataFrame(subruns, columns = _SUBRUN_COLUMNS + params)
+    if subruns['split'].isnull().all():
+        subruns = subruns.drop('split', axis = 1)
+    subruns = subruns.sort_values([c for c in ['rundir', 'split', 'rep', 'prep']
+                                   if c in subruns.columns])
+    subruns.to_csv(argv[0], index = False)
+    if runs_file is not None:
+        runs.to_csv(runs_file, index = False)
+    if regions_file is not None:
+        regions(runs, bins).to_csv(regions_file, index = False)
+
+    ok = subruns[subruns['status'] == 'ok']
+    sys.stdout.write("%d runs, %d sub-runs (%d not ok), %.1f hours in sub-runs that were ok\n"
+                     %(len(runs.index), len(subruns.index), len(subruns.index) - len(ok.index),
+                       ok['seconds'].sum() / 3600.0))
+    sys.exit(0)